@@ -9,7 +9,7 @@ import numpy as np
 class CAMChannel(object):
     def __init__(self, jcnPosition, jcnCtrlRegion,
                  scanRange=250, CAMoverride=False, PER=0., noise=False,
-                 CDOTS=False):
+                 CDOTS=False, netIndex=None):
         self.TGenCamMin = 0.1 # Min time for CAM generation 10Hz/100ms/0.1sec
         self.TGenCamMax = 1.0 # Max time for CAM generation 1Hz/1000ms/1sec
         self.TGenCamDCC = 0.1 # CAM generation time under channel congestion
@@ -33,6 +33,8 @@ class CAMChannel(object):
         self.jcnGeometry = (jcnPosition, jcnCtrlRegion)
 
         self.CDOTS = CDOTS  # we only want signal data if controller is CDOTS
+        # dict channel keeps vehID keys, the vector channel uses the rows
+        self.netIndex = netIndex
  
     def getDCCstate(self, CAMoverride = False): 
         return {'RELAXED': CAMoverride if CAMoverride else self.TGenCamMin,
@@ -155,3 +157,210 @@ class CAMChannel(object):
         # In reality we made need a better cyclic mapping system as a vehicle
         # would only report a heading between 0-360
         return heading + self.random.normal(0, 6.67)
+
+
+# CAM record for the array backed channel, row indexes the vehicle in the
+# channel's vehicle index, signal is the raw traci VAR_SIGNALS bit field,
+# laneRow is the lane's networkIndex row (-1 without a networkIndex)
+camDtype = np.dtype([('row', np.intp), ('x', float), ('y', float),
+                     ('heading', float), ('speed', float), ('Tgen', float),
+                     ('NGC', int), ('signal', int), ('lane', object),
+                     ('laneRow', np.intp)])
+
+
+def growLookup(lookup, size):
+    # grow a row -> record position lookup, new rows map to -1 (no record)
+    if size <= lookup.shape[0]:
+        return lookup
+    newLookup = -np.ones(max(size, 2*lookup.shape[0]), dtype=np.intp)
+    newLookup[:lookup.shape[0]] = lookup
+    return newLookup
+
+
+class camView(object):
+    # Read only dict style view of a CAM record array, gives the
+    # receiveData[vehID]['coords'] etc. interface the controllers use
+    def __init__(self, state, lookup, vehIndex, CDOTS=False):
+        self.state = state
+        self.lookup = lookup
+        self.vehIndex = vehIndex
+        self.CDOTS = CDOTS
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.state)
+
+    def keys(self):
+        IDs = self.vehIndex.IDs
+        return [IDs[row] for row in self.state['row']]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, vehID):
+        row = self.vehIndex.rowDict.get(vehID)
+        return row is not None and row < len(self.lookup)\
+            and self.lookup[row] >= 0
+
+    def __getitem__(self, vehID):
+        try:
+            return self.cache[vehID]
+        except KeyError:
+            pass
+        if vehID not in self:
+            raise KeyError(vehID)
+        record = self.state[self.lookup[self.vehIndex.rowDict[vehID]]]
+        if self.CDOTS:
+            signal = sigTools.vehicleSignalParser(int(record['signal']))
+        else:
+            signal = None
+        vData = {'coords': (float(record['x']), float(record['y'])),
+                 'heading': float(record['heading']),
+                 'speed': float(record['speed']),
+                 'Tgen': float(record['Tgen']),
+                 'signal': signal,
+                 'lane': record['lane'],
+                 'NGC': int(record['NGC'])}
+        self.cache[vehID] = vData
+        return vData
+
+    def items(self):
+        return [(vehID, self[vehID]) for vehID in self.keys()]
+
+
+class VectorCAMChannel(CAMChannel):
+    # Array backed CAM channel. Transmit, channel and receive state are
+    # camDtype record arrays and the ETSI trigger conditions, packet errors
+    # and GPS/heading noise are evaluated for all vehicles at once.
+    # Random draws are batched so runs with noise are statistically, not
+    # bitwise, equivalent to CAMChannel
+    def __init__(self, jcnPosition, jcnCtrlRegion,
+                 scanRange=250, CAMoverride=False, PER=0., noise=False,
+                 CDOTS=False, netIndex=None):
+        # netIndex: sigTools.networkIndex shared by the run, vehicles then
+        # have the same rows in every channel and monitor
+        super(VectorCAMChannel, self).__init__(jcnPosition, jcnCtrlRegion,
+                                               scanRange=scanRange,
+                                               CAMoverride=CAMoverride,
+                                               PER=PER, noise=noise,
+                                               CDOTS=CDOTS, netIndex=netIndex)
+        if netIndex is not None:
+            self.vehIndex = netIndex.vehicles
+        else:
+            self.vehIndex = sigTools.idIndex()
+        self.transmitState = np.zeros(0, dtype=camDtype)
+        self.channelState = np.zeros(0, dtype=camDtype)
+        self.receiveState = np.zeros(0, dtype=camDtype)
+        # row -> position of the vehicle's record in channel/receive state
+        self.channelLookup = -np.ones(1024, dtype=np.intp)
+        self.receiveLookup = -np.ones(1024, dtype=np.intp)
+        self.receiveData = camView(self.receiveState, self.receiveLookup,
+                                   self.vehIndex, self.CDOTS)
+        self.jcnCenter = np.asarray(jcnPosition, dtype=float)
+
+    def channelUpdate(self, vehicleData, TIME_SEC):
+        # Receive data from "channel", clear last steps receive lookup and
+        # reuse it as the (empty) channel lookup
+        self.receiveLookup[self.receiveState['row']] = -1
+        self.receiveState = self.channelState
+        self.receiveLookup, self.channelLookup = \
+            self.channelLookup, self.receiveLookup
+        self.receiveData = camView(self.receiveState, self.receiveLookup,
+                                   self.vehIndex, self.CDOTS)
+
+        # Set DCC time based on channel state
+        numCAVs = len(self.receiveState)
+        self.setTGenCamDCC(numCAVs)
+
+        # transmit the last CAMs on the channel
+        tx = self.transmitState
+        # if packet error do not update channel
+        if self.noise and len(tx):
+            tx = tx[self.random.rand(len(tx)) >= self.PER]
+        rxIdx = self.receiveLookup[tx['row']]
+        known = rxIdx >= 0
+        rx = self.receiveState[rxIdx[known]]
+        # No data for vehicle received yet, force trigger onto channel
+        dx = np.full(len(tx), 5.0)
+        dh = np.full(len(tx), 5.0)
+        dv = np.full(len(tx), 1.0)
+        dt = np.full(len(tx), self.TGenCamMax + self.TGenCamMin)
+        TGenCam = dt.copy()
+        dx[known] = np.hypot(rx['x'] - tx['x'][known],
+                             rx['y'] - tx['y'][known])
+        dh[known] = np.abs(rx['heading'] - tx['heading'][known])
+        dv[known] = np.abs(rx['speed'] - tx['speed'][known])
+        dt[known] = TIME_SEC - rx['Tgen']
+        TGenCam[known] = np.where(rx['NGC'] > self.NGenCamMax,
+                                  self.TGenCamMax, TIME_SEC - rx['Tgen'])
+
+        # CAM trigger condition 1 data to channel, NGC=0
+        # change in: Position change > 4m, heading > 4deg, or speed > 0.5m/s
+        trigger1 = ((dx > 4) | (dh > 4) | (dv > 0.5)) & (dt >= self.TGenCamDCC)
+        # CAM trigger condition 2 - data to channel, NGC++
+        trigger2 = ~trigger1 & ((dt >= self.TGenCamDCC) | (dt >= TGenCam))
+        # otherwise no change in CAM information, nothing sent
+        send = trigger1 | trigger2
+        self.channelState = tx[send]
+        self.channelState['NGC'] = np.where(trigger1[send], 0,
+                                            self.channelState['NGC'] + 1)
+        self.channelLookup[self.channelState['row']] = \
+            np.arange(len(self.channelState))
+
+        # Get new data for transmission from the vehicles
+        self.transmitState = self.getTransmitState(vehicleData, TIME_SEC)
+
+    def getTransmitState(self, vehicleData, TIME_SEC):
+        # check subscription has data
+        if not vehicleData:
+            return np.zeros(0, dtype=camDtype)
+        vehIDs = [vehID for vehID in vehicleData.keys()
+                  if tc.VAR_POSITION in vehicleData[vehID]
+                  and 'c_' in vehicleData[vehID][tc.VAR_TYPE]]
+        positions = np.array([vehicleData[vehID][tc.VAR_POSITION]
+                              for vehID in vehIDs], dtype=float)
+        positions = positions.reshape(len(vehIDs), 2)
+        if self.noise:
+            # 99.7% data within 3 sigma (std. dev) 5/3 ~ 1.67
+            positions += self.random.normal(0, 1.67, positions.shape)
+
+        inRange = sigTools.isInRangeArray(positions, self.scanRange,
+                                          (self.jcnCenter, self.jcnGeometry[1]))
+        vehIDs = [vehID for vehID, keep in zip(vehIDs, inRange) if keep]
+        N = len(vehIDs)
+        transmitState = np.zeros(N, dtype=camDtype)
+        if not N:
+            return transmitState
+        rows = self.vehIndex.getRows(vehIDs)
+        self.channelLookup = growLookup(self.channelLookup, len(self.vehIndex))
+        self.receiveLookup = growLookup(self.receiveLookup, len(self.vehIndex))
+        self.receiveData.lookup = self.receiveLookup
+
+        transmitState['row'] = rows
+        transmitState['x'] = positions[inRange, 0]
+        transmitState['y'] = positions[inRange, 1]
+        transmitState['heading'] = [vehicleData[vehID][tc.VAR_ANGLE]
+                                    for vehID in vehIDs]
+        if self.noise:
+            # Normal += 20deg 99.7% of the time (20/3 ~ 6.67)
+            transmitState['heading'] += self.random.normal(0, 6.67, N)
+        transmitState['speed'] = [vehicleData[vehID][tc.VAR_SPEED]
+                                  for vehID in vehIDs]
+        transmitState['Tgen'] = TIME_SEC
+        # Only get extra data if controller is CDOTS, parsed on access
+        if self.CDOTS:
+            transmitState['signal'] = [vehicleData[vehID][tc.VAR_SIGNALS]
+                                       for vehID in vehIDs]
+        for i, vehID in enumerate(vehIDs):
+            transmitState['lane'][i] = vehicleData[vehID][tc.VAR_LANE_ID]
+        if self.netIndex is not None:
+            transmitState['laneRow'] = \
+                self.netIndex.getLaneRows(transmitState['lane'])
+        else:
+            transmitState['laneRow'] = -1
+        # NGC carries over from the channel
+        chIdx = self.channelLookup[rows]
+        onChannel = chIdx >= 0
+        transmitState['NGC'][onChannel] = \
+            self.channelState['NGC'][chIdx[onChannel]]
+        return transmitState
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+@file    demandTable.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Compact binary demand and streamed vehicle insertion.
+
+buildDemandTable turns a duarouter route file into a compressed npz table,
+one row per vehicle of (depart ms, route index, vType index, depart
+parameter index) plus the vehicle IDs, with the route edge lists, vType
+names and (departLane, departPos, departSpeed) triples each stored once.
+The vType and vTypeDistribution definitions go to a small additional file
+for SUMO to load. demandLoader then adds the vehicles over TraCI a time
+window ahead of their departure, so SUMO neither parses the route XML at
+start up nor holds the whole day's demand in memory.
+"""
+import os
+import xml.etree.ElementTree as ET
+import numpy as np
+import traci
+
+# depart parameters SUMO uses when a vehicle doesn't give them
+DEPART_DEFAULTS = ('first', 'base', '0')
+
+
+def getDemandFiles(routeFile):
+    # table and vType files that stand in for routeFile
+    base = routeFile[:-len('.rou.xml')] if routeFile.endswith('.rou.xml')\
+        else routeFile
+    return base + '.demand.npz', base + '.vtypes.xml'
+
+
+def toStr(value):
+    # table strings are stored as bytes, str in both python 2 and 3
+    return value if isinstance(value, str) else value.decode('utf-8')
+
+
+def iterRouteFile(routeXML):
+    # yields ('vType', element) for top level vType/vTypeDistribution
+    # definitions and ('vehicle', (vehID, depart, vType, departParams,
+    # edges)) for each vehicle. Elements are cleared as they're read so
+    # memory doesn't grow with the file
+    namedRoutes = {}
+    depth = 0
+    root = None
+    for event, elem in ET.iterparse(routeXML, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
+            continue
+        if elem.tag in ('vType', 'vTypeDistribution'):
+            yield 'vType', elem
+        elif elem.tag == 'route':
+            namedRoutes[elem.get('id')] = elem.get('edges')
+        elif elem.tag == 'vehicle':
+            route = elem.find('route')
+            if route is not None:
+                edges = route.get('edges')
+            else:
+                edges = namedRoutes[elem.get('route')]
+            departParams = (elem.get('departLane', DEPART_DEFAULTS[0]),
+                            elem.get('departPos', DEPART_DEFAULTS[1]),
+                            elem.get('departSpeed', DEPART_DEFAULTS[2]))
+            yield 'vehicle', (elem.get('id'), float(elem.get('depart')),
+                              elem.get('type', 'DEFAULT_VEHTYPE'),
+                              departParams, edges)
+        elif elem.tag in ('flow', 'trip', 'person', 'personFlow'):
+            raise ValueError('{} elements not supported, route the demand '
+                             'with duarouter first'.format(elem.tag))
+        root.clear()
+
+
+def buildDemandTable(routeXML, tableFile=None, vTypeFile=None):
+    # convert a route file, tables default to getDemandFiles(routeXML)
+    if tableFile is None or vTypeFile is None:
+        defaultTable, defaultVTypes = getDemandFiles(routeXML)
+        tableFile = tableFile or defaultTable
+        vTypeFile = vTypeFile or defaultVTypes
+    vTypeDefs = []
+    ids, departs, routeRows, typeRows, paramRows = [], [], [], [], []
+    routeDict, typeDict, paramDict = {}, {}, {}
+    for kind, data in iterRouteFile(routeXML):
+        if kind == 'vType':
+            vTypeDefs.append(ET.tostring(data).decode('utf-8').strip())
+            continue
+        vehID, depart, vType, departParams, edges = data
+        ids.append(vehID.encode('utf-8'))
+        departs.append(int(round(1000*depart)))
+        routeRows.append(routeDict.setdefault(edges, len(routeDict)))
+        typeRows.append(typeDict.setdefault(vType, len(typeDict)))
+        paramRows.append(paramDict.setdefault(departParams, len(paramDict)))
+
+    def byRow(lookup):
+        # dict keys in row order
+        keys = [None]*len(lookup)
+        for key, row in lookup.items():
+            keys[row] = key
+        return keys
+
+    # insertion order is depart order, ties keep the route file order
+    order = np.argsort(np.array(departs, dtype=np.int64), kind='mergesort')
+    routes = [edges.encode('utf-8') for edges in byRow(routeDict)]
+    vTypes = [vType.encode('utf-8') for vType in byRow(typeDict)]
+    params = [[x.encode('utf-8') for x in p] for p in byRow(paramDict)]
+    tmpName = '{}.{}.tmp.npz'.format(tableFile[:-len('.npz')], os.getpid())
+    np.savez_compressed(tmpName,
+                        ids=np.array(ids, dtype=bytes)[order],
+                        departMS=np.array(departs, dtype=np.int64)[order],
+                        route=np.array(routeRows, dtype=np.int32)[order],
+                        vType=np.array(typeRows, dtype=np.int16)[order],
+                        departParams=np.array(paramRows, dtype=np.int16)[order],
+                        routes=np.array(routes, dtype=bytes),
+                        vTypes=np.array(vTypes, dtype=bytes),
+                        params=np.array(params, dtype=bytes).reshape(-1, 3))
+    os.rename(tmpName, tableFile)
+
+    tmpName = '{}.{}.tmp'.format(vTypeFile, os.getpid())
+    with open(tmpName, 'w') as f:
+        f.write('<additional>\n')
+        for definition in vTypeDefs:
+            f.write('    {}\n'.format(definition))
+        f.write('</additional>\n')
+    os.rename(tmpName, vTypeFile)
+    return tableFile, vTypeFile
+
+
+def readDemandTable(tableFile):
+    with np.load(tableFile) as table:
+        return dict((name, table[name]) for name in table.files)
+
+
+def iterVehicles(tableFile):
+    # (vehID, depart seconds, route edges string) in depart order
+    table = readDemandTable(tableFile)
+    routes = [toStr(edges) for edges in table['routes']]
+    for vehID, departMS, route in zip(table['ids'], table['departMS'],
+                                      table['route']):
+        yield toStr(vehID), 0.001*departMS, routes[route]
+
+
+class demandLoader(object):
+    # Adds the vehicles of a demand table over TraCI, those departing
+    # within window seconds of the current time are added each call so
+    # SUMO only ever holds a window of future vehicles. Routes are added
+    # the first time a vehicle uses them. Picklable, the SUMO state of a
+    # checkpoint already holds the vehicles and routes added before it
+    def __init__(self, tableFile, window=60.0):
+        table = readDemandTable(tableFile)
+        self.ids = table['ids']
+        self.departMS = table['departMS']
+        self.route = table['route']
+        self.vType = table['vType']
+        self.departParams = table['departParams']
+        self.routes = table['routes']
+        self.vTypes = [toStr(x) for x in table['vTypes']]
+        self.params = [tuple(toStr(x) for x in row)
+                       for row in table['params']]
+        self.windowMS = int(round(1000*window))
+        self.addedRoutes = set()
+        self.next = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def hasPending(self):
+        return self.next < len(self.ids)
+
+    def getRouteID(self, route):
+        routeID = 'demandRoute{}'.format(route)
+        if route not in self.addedRoutes:
+            traci.route.add(routeID, toStr(self.routes[route]).split())
+            self.addedRoutes.add(route)
+        return routeID
+
+    def load(self, simTime):
+        # simTime in ms, call before each traci.simulationStep()
+        if not self.hasPending() or\
+           self.departMS[self.next] >= simTime + self.windowMS:
+            return 0
+        end = int(np.searchsorted(self.departMS, simTime + self.windowMS,
+                                  side='left'))
+        # addFull takes the string depart parameters in SUMO 0.30, newer
+        # versions that dropped it take the same arguments in add
+        addVehicle = getattr(traci.vehicle, 'addFull', traci.vehicle.add)
+        for i in range(self.next, end):
+            departLane, departPos, departSpeed = \
+                self.params[self.departParams[i]]
+            addVehicle(toStr(self.ids[i]),
+                       self.getRouteID(int(self.route[i])),
+                       typeID=self.vTypes[self.vType[i]],
+                       depart='{:.3f}'.format(0.001*self.departMS[i]),
+                       departLane=departLane, departPos=departPos,
+                       departSpeed=departSpeed)
+        added = end - self.next
+        self.next = end
+        return added
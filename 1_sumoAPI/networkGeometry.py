@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+"""
+@file    networkGeometry.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Static network geometry used by the signal controllers at start up.
+
+traciNetwork queries the geometry live over TraCI. networkGeometry holds the
+same information built offline with sumolib from <model>.net.xml, .det.xml
+and the valid routes, and is cached as a compressed pickle keyed by the hash
+of those files so every controller in every run loads it without TraCI.
+Both classes share one interface so controllers use either through self.net
+"""
+import os
+import sys
+import re
+import zlib
+import hashlib
+from collections import defaultdict
+import xml.etree.ElementTree as ET
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import traci
+import signalTools as sigTools
+
+SUMO_HOME = os.environ.get('SUMO_HOME', '/usr/share/sumo')
+GEOMETRY_PATH = '../2_models/GEOMETRY/'
+ROUTE_PATH = '../2_models/VALIDROUTES/'
+
+
+class traciNetwork(object):
+    # network geometry queried live over TraCI
+    def getTLIDs(self):
+        return traci.trafficlights.getIDList()
+
+    def getJunctionPosition(self, junctionID):
+        return traci.junction.getPosition(junctionID)
+
+    def getControlledLinks(self, tlID):
+        return traci.trafficlights.getControlledLinks(tlID)
+
+    def getControlledLanes(self, tlID):
+        return traci.trafficlights.getControlledLanes(tlID)
+
+    def getLaneIDs(self):
+        return traci.lane.getIDList()
+
+    def getLaneShape(self, laneID):
+        return traci.lane.getShape(laneID)
+
+    def getLaneMaxSpeed(self, laneID):
+        return traci.lane.getMaxSpeed(laneID)
+
+    def getLaneLength(self, laneID):
+        return traci.lane.getLength(laneID)
+
+    def getLaneInfo(self):
+        return sigTools.getIncomingLaneInfo(traci.lane.getIDList())
+
+    def getEdgeLaneMap(self):
+        return sigTools.edgeLaneMap()
+
+    def getLoopIDs(self):
+        return traci.inductionloop.getIDList()
+
+    def getLoopLane(self, loopID):
+        return traci.inductionloop.getLaneID(loopID)
+
+    def getRoutes(self, model):
+        return sigTools.getRouteDict()[model]
+
+
+class networkGeometry(object):
+    # network geometry from the offline cache, see buildNetworkGeometry
+    def __init__(self, data):
+        self.data = data
+        self.netHash = data['netHash']
+
+    def getTLIDs(self):
+        return self.data['tlIDs']
+
+    def getJunctionPosition(self, junctionID):
+        return self.data['junctionPositions'][junctionID]
+
+    def getControlledLinks(self, tlID):
+        return self.data['controlledLinks'][tlID]
+
+    def getControlledLanes(self, tlID):
+        return self.data['controlledLanes'][tlID]
+
+    def getLaneIDs(self):
+        return self.data['laneIDs']
+
+    def getLaneShape(self, laneID):
+        return self.data['laneShapes'][laneID]
+
+    def getLaneMaxSpeed(self, laneID):
+        return self.data['laneSpeeds'][laneID]
+
+    def getLaneLength(self, laneID):
+        return self.data['laneLengths'][laneID]
+
+    def getLaneInfo(self):
+        return self.data['laneInfo']
+
+    def getEdgeLaneMap(self):
+        return self.data['edgeLaneMap']
+
+    def getLoopIDs(self):
+        return [loopID for loopID, lane in self.data['loops']]
+
+    def getLoopLane(self, loopID):
+        return self.data['loopLanes'][loopID]
+
+    def getRoutes(self, model=None):
+        return self.data['routes']
+
+
+def getNetworkHash(fileNames):
+    # hash of the files the geometry is built from
+    sha = hashlib.sha1()
+    for fileName in fileNames:
+        with open(fileName, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+    return sha.hexdigest()
+
+
+def getSourceFiles(modelDir, modelBase):
+    netFile = os.path.join(modelDir, modelBase + '.net.xml')
+    detFile = os.path.join(modelDir, modelBase + '.det.xml')
+    routeFile = os.path.join(ROUTE_PATH, modelBase + '_valid_routes.rou.xml')
+    return netFile, detFile, routeFile
+
+
+def readRoutes(routeFile):
+    # same parsing as signalTools.getRouteDict for a single model
+    regex = re.compile('.+edges="(.+?)"')
+    routes = []
+    with open(routeFile, 'r') as f:
+        for line in f:
+            match = regex.match(line)
+            if match:
+                routes.append(match.groups()[0].split())
+    return routes
+
+
+def readLoops(detFile):
+    loops = []
+    for loop in ET.parse(detFile).getroot():
+        if loop.tag in ('inductionLoop', 'e1Detector'):
+            loops.append((loop.attrib['id'], loop.attrib['lane']))
+    return loops
+
+
+def buildNetworkGeometry(netFile, detFile, routeFile):
+    # build the geometry offline with sumolib, no SUMO instance needed
+    sys.path.append(os.path.join(SUMO_HOME, 'tools'))
+    import sumolib
+    net = sumolib.net.readNet(netFile, withInternal=True)
+
+    laneIDs, edgeIDs = [], []
+    laneShapes, laneWidths, laneSpeeds, laneLengths = {}, {}, {}, {}
+    for edge in net.getEdges():
+        edgeIDs.append(edge.getID())
+        for lane in edge.getLanes():
+            laneID = lane.getID()
+            laneIDs.append(laneID)
+            laneShapes[laneID] = tuple(tuple(xy) for xy in lane.getShape())
+            laneWidths[laneID] = lane.getWidth()
+            laneSpeeds[laneID] = lane.getSpeed()
+            laneLengths[laneID] = lane.getLength()
+
+    laneInfo = {}
+    for laneID in laneIDs:
+        laneInfo[laneID] = sigTools.getLaneInfo(laneShapes[laneID],
+                                                laneWidths[laneID])
+
+    # same mapping as signalTools.edgeLaneMap
+    lanesByPrefix = defaultdict(list)
+    for laneID in laneIDs:
+        lanesByPrefix[laneID.split('_')[0]].append(laneID)
+    edgeLaneMap = defaultdict(list)
+    for edgeID in edgeIDs:
+        if edgeID in lanesByPrefix:
+            edgeLaneMap[edgeID] = lanesByPrefix[edgeID]
+
+    tlIDs, junctionPositions = [], {}
+    controlledLinks, controlledLanes = {}, {}
+    for tls in net.getTrafficLights():
+        tlID = tls.getID()
+        tlIDs.append(tlID)
+        # links ordered by link index as traci returns them
+        links = defaultdict(list)
+        for inLane, outLane, linkNo in tls.getConnections():
+            links[linkNo].append((inLane.getID(), outLane.getID(), ''))
+        controlledLinks[tlID] = [links[i] for i in sorted(links.keys())]
+        controlledLanes[tlID] = [links[i][0][0] for i in sorted(links.keys())]
+    for node in net.getNodes():
+        junctionPositions[node.getID()] = tuple(node.getCoord())
+
+    loops = readLoops(detFile)
+    data = {'netHash': getNetworkHash([netFile, detFile, routeFile]),
+            'tlIDs': tlIDs,
+            'junctionPositions': junctionPositions,
+            'controlledLinks': controlledLinks,
+            'controlledLanes': controlledLanes,
+            'laneIDs': laneIDs,
+            'edgeIDs': edgeIDs,
+            'laneShapes': laneShapes,
+            'laneSpeeds': laneSpeeds,
+            'laneLengths': laneLengths,
+            'laneInfo': laneInfo,
+            'edgeLaneMap': edgeLaneMap,
+            'loops': loops,
+            'loopLanes': dict(loops),
+            'routes': readRoutes(routeFile)}
+    return networkGeometry(data)
+
+
+def saveNetworkGeometry(geometry, fileName):
+    # write to a temp file and rename so concurrent workers never read a
+    # partial cache
+    tmpName = '{}.{}.tmp'.format(fileName, os.getpid())
+    with open(tmpName, 'wb') as f:
+        f.write(zlib.compress(pickle.dumps(geometry.data, 2)))
+    os.rename(tmpName, fileName)
+
+
+def readNetworkGeometry(fileName):
+    with open(fileName, 'rb') as f:
+        return networkGeometry(pickle.loads(zlib.decompress(f.read())))
+
+
+def getCacheFile(modelBase, netHash, cachePath=GEOMETRY_PATH):
+    return os.path.join(cachePath, '{}_{}.geom'.format(modelBase, netHash[:16]))
+
+
+def loadNetworkGeometry(modelDir, modelBase, cachePath=GEOMETRY_PATH):
+    # load the cached geometry for this model, building it if the cache for
+    # the current net/det/route files doesn't exist yet
+    sourceFiles = getSourceFiles(modelDir, modelBase)
+    cacheFile = getCacheFile(modelBase, getNetworkHash(sourceFiles), cachePath)
+    if os.path.exists(cacheFile):
+        return readNetworkGeometry(cacheFile)
+    geometry = buildNetworkGeometry(*sourceFiles)
+    if not os.path.isdir(cachePath):
+        try:
+            os.makedirs(cachePath)
+        except OSError:
+            pass  # made by another process
+    saveNetworkGeometry(geometry, cacheFile)
+    return geometry
+
+
+if __name__ == '__main__':
+    # prebuild caches: python networkGeometry.py sellyOak simpleT ...
+    for modelBase in sys.argv[1:]:
+        modelDir = '../2_models/{}/'.format(modelBase)
+        geometry = loadNetworkGeometry(modelDir, modelBase)
+        print('{}: {}'.format(modelBase,
+                              getCacheFile(modelBase, geometry.netHash)))
@@ -13,16 +13,40 @@ import math
 from scipy.spatial import distance
 import numpy as np
 import signalTools as sigTools
+from networkGeometry import traciNetwork
 import re
+import heapq
+import time
 
 class signalControl(object):
     
-    def __init__(self):
+    def __init__(self, net=None, netIndex=None):
         self.transitionObject = stageTransition()
-        traci.simulation.subscribe(varIDs=(tc.VAR_TIME_STEP,))
+        # static geometry, networkGeometry cache or live TraCI queries
+        self.net = net if net is not None else traciNetwork()
+        # integer IDs shared with the rest of the run, IDs are interned
+        # as they're seen in a controller local index if None
+        if netIndex is None:
+            netIndex = sigTools.networkIndex()
+        self.netIndex = netIndex
+        # step length in seconds, timing tolerances are relative to it
+        self.stepLength = sigTools.getStepLength()
+        self.stepMS = int(round(1000*self.stepLength))
+        # controllers with per step work outside process() set this and
+        # implement fastProcess, see controllerScheduler
+        self.fastPath = False
+        sigTools.subscribeSimulation((tc.VAR_TIME_STEP,))
         
     def process(self, simtime=None):
         self.transitionObject.processTransition(simtime)
+
+    def fastProcess(self, time=None):
+        pass
+
+    def getNextWakeup(self, simTime):
+        # sim time (ms) at which process() is next needed, anything not
+        # after simTime means the next step. Default is every step
+        return simTime
         
     def getCurrentSUMOtime(self):
         #return traci.simulation.getCurrentTime()
@@ -37,10 +61,19 @@ class signalControl(object):
     def setAllRedTime(self, time):
         self.transitionObject.setAllRedTime(time)
 
+    def restoreSubscriptions(self):
+        # SUMO state files don't hold subscriptions, renew after loadState
+        sigTools.subscribeSimulation((tc.VAR_TIME_STEP,))
+
+    def setCommandBatch(self, commandBatch):
+        # queue signal state changes in a tlsCommandBatch instead of
+        # sending them to SUMO straight away
+        self.transitionObject.commandBatch = commandBatch
+
     def setTransitionTime(self, junctionID):
         amber1 = 3
         red = 1
-        amber2 = abs(sigTools.getIntergreenTime(junctionID) - (amber1 + red))
+        amber2 = abs(sigTools.getIntergreenTime(junctionID, self.net) - (amber1 + red))
         if amber2 > 3:
             red += amber2 - 3
             amber2 = 3
@@ -73,7 +106,8 @@ class stageTransition(object):
         self.setAmber2Time(0)
         self.setAllRedTime(1)
         self.active=False
-        traci.simulation.subscribe(varIDs=(tc.VAR_TIME_STEP,))
+        self.commandBatch = None
+        sigTools.subscribeSimulation((tc.VAR_TIME_STEP,))
         # current+target -> amber1,amber2,allRed
         self.transitionDict = {'rr': 'rrr', 'GG': 'GGG', 'gg': 'ggg',
                                'rg': 'ryr', 'Gr': 'yrr', 'gr': 'yrr',
@@ -138,10 +172,97 @@ class stageTransition(object):
         else:
             pass
     
+    def getNextWakeup(self, simTime):
+        # time (ms) of the next amber, all red or target stage change
+        amber1Threshold = self.amber1Time*1000
+        allRedThreshold = amber1Threshold + self.allRed*1000
+        amber2Threshold = allRedThreshold + self.amber2Time*1000
+        transitionTimeDelta = simTime - self.transitionStart
+        for threshold in (amber1Threshold, allRedThreshold, amber2Threshold):
+            if transitionTimeDelta < threshold:
+                return self.transitionStart + threshold
+        return simTime
+
     def makeTransition(self, transitionStageString):
         # API Calls are expensive so only call if needed to change stage 
         # the first time
         if self.stageString != transitionStageString:
-            traci.trafficlights.setRedYellowGreenState(self.junctionID,
-                                                       transitionStageString)
+            if self.commandBatch is None:
+                traci.trafficlights.setRedYellowGreenState(self.junctionID,
+                                                           transitionStageString)
+            else:
+                self.commandBatch.setRedYellowGreenState(self.junctionID,
+                                                         transitionStageString)
             self.stageString = transitionStageString
+
+
+class tlsCommandBatch(object):
+    # Collects the signal states set by all controllers during a step and
+    # sends them in one pass before the next simulation step. States equal
+    # to the last one sent for a junction are dropped, so a transition
+    # costs one TraCI call per state change rather than one per step
+    def __init__(self):
+        self.pending = {}
+        self.order = []
+        self.lastSent = {}
+        self.Nqueued = 0
+        self.Nsent = 0
+        # wall time in flush(), i.e. the TraCI calls that were sent
+        self.flushTime = 0.0
+
+    def setRedYellowGreenState(self, junctionID, stateString):
+        if junctionID not in self.pending:
+            self.order.append(junctionID)
+        self.pending[junctionID] = stateString
+        self.Nqueued += 1
+
+    def flush(self):
+        start = time.time()
+        for junctionID in self.order:
+            stateString = self.pending[junctionID]
+            if self.lastSent.get(junctionID) != stateString:
+                traci.trafficlights.setRedYellowGreenState(junctionID,
+                                                           stateString)
+                self.lastSent[junctionID] = stateString
+                self.Nsent += 1
+        self.pending = {}
+        self.order = []
+        self.flushTime += time.time() - start
+
+    def strStats(self):
+        # unbatched every queued state is a TraCI round trip
+        saved = self.Nqueued - self.Nsent
+        return ('TLS BATCH: queued {}, sent {}, saved {} TraCI calls '
+                '({:.1f}%), flush time {:.2f}s'.format(
+                    self.Nqueued, self.Nsent, saved,
+                    100.0*saved/self.Nqueued if self.Nqueued else 0.0,
+                    self.flushTime))
+
+
+class controllerScheduler(object):
+    # Calls each controller's process() only when its getNextWakeup time is
+    # due, wakeups are kept in a heap. Controllers with a fastPath get
+    # fastProcess() on the other steps. Controllers due on the same step
+    # are processed in list order as in the plain loop
+    def __init__(self, controllers):
+        self.controllers = controllers
+        self.fastIndices = set(i for i, c in enumerate(controllers)
+                               if c.fastPath)
+        # everything is due on the first step
+        self.wakeHeap = [(-1, i) for i in range(len(controllers))]
+        heapq.heapify(self.wakeHeap)
+        self.Nprocessed = 0
+
+    def process(self, simTime, **kwargs):
+        due = set()
+        while self.wakeHeap and self.wakeHeap[0][0] <= simTime:
+            due.add(heapq.heappop(self.wakeHeap)[1])
+        for i in sorted(due | self.fastIndices):
+            controller = self.controllers[i]
+            if i in due:
+                controller.process(time=simTime, **kwargs)
+                heapq.heappush(self.wakeHeap,
+                               (controller.getNextWakeup(simTime), i))
+                self.Nprocessed += 1
+            else:
+                controller.fastProcess(time=simTime)
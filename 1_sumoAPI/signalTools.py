@@ -20,6 +20,9 @@ import time
 from psutil import cpu_count
 import sys
 import itertools
+import heapq
+import hashlib
+import demandTable
 import traceback
 
 
@@ -36,15 +39,22 @@ def getIntergreen(dist):
     return intergreen
 
 
-def getJunctionDiameter(junctionID):
-    juncPos = traci.junction.getPosition(junctionID)
-    edges = traci.trafficlights.getControlledLinks(junctionID)
+def getJunctionDiameter(junctionID, net=None):
+    # net: optional networkGeometry, otherwise geometry is read over TraCI
+    if net is None:
+        juncPos = traci.junction.getPosition(junctionID)
+        edges = traci.trafficlights.getControlledLinks(junctionID)
+        getShape = traci.lane.getShape
+    else:
+        juncPos = net.getJunctionPosition(junctionID)
+        edges = net.getControlledLinks(junctionID)
+        getShape = net.getLaneShape
     edges = [x for z in edges for y in z for x in y[:2]]
     edges = list(set(edges))
     boundingCoords = []
     for edge in edges:
         dMin, coordMin = 1e6, []
-        for laneCoord in traci.lane.getShape(edge):
+        for laneCoord in getShape(edge):
             dist = getDistance(juncPos, laneCoord)
             if dist < dMin:
                 dMin, coordMin = dist, laneCoord
@@ -54,11 +64,30 @@ def getJunctionDiameter(junctionID):
     return dMax
 
 
-def getIntergreenTime(junctionID):
-    juncDiameter = getJunctionDiameter(junctionID)
+def getIntergreenTime(junctionID, net=None):
+    juncDiameter = getJunctionDiameter(junctionID, net)
     return getIntergreen(juncDiameter)
 
 
+def getStepLength():
+    # simulation step length in seconds. getDeltaT is in ms before SUMO 1.0
+    # and in s after, no sensible step is >10 s or <10 ms
+    deltaT = traci.simulation.getDeltaT()
+    return 0.001*deltaT if deltaT > 10 else float(deltaT)
+
+
+# TraCI holds one simulation subscription and subscribing again replaces
+# it, every user's variables are kept here and subscribed together
+simulationVars = []
+
+
+def subscribeSimulation(varIDs=()):
+    for varID in varIDs:
+        if varID not in simulationVars:
+            simulationVars.append(varID)
+    traci.simulation.subscribe(varIDs=tuple(simulationVars))
+
+
 def getSUMOHeading(currentLoc, prevLoc):
     dy = currentLoc[1] - prevLoc[1]
     dx = currentLoc[0] - prevLoc[0]
@@ -87,26 +116,30 @@ def mean(x):
     return sum(x)/float(len(x))
 
 
+def getLaneInfo(shape, width):
+    heading = getSUMOHeading(shape[-1], shape[0])
+    x1, y1 = shape[0]
+    x2, y2 = shape[-1]
+    dx = abs(x2 - x1) 
+    dy = abs(y2 - y1)
+    if dx > dy:
+        y1 += width
+        y2 -= width
+    else: 
+        x1 += width
+        x2 -= width
+    return {'heading': heading, 
+            'bounds': {'x1': x1, 'y1': y1,
+                       'x2': x2, 'y2': y2}
+           }
+
+
 def getIncomingLaneInfo(controlledLanes):
     laneInfo = {}
     for lane in unique(controlledLanes):
         shape = traci.lane.getShape(lane)
         width = traci.lane.getWidth(lane)
-        heading = getSUMOHeading(shape[-1], shape[0])
-        x1, y1 = shape[0]
-        x2, y2 = shape[-1]
-        dx = abs(x2 - x1) 
-        dy = abs(y2 - y1)
-        if dx > dy:
-            y1 += width
-            y2 -= width
-        else: 
-            x1 += width
-            x2 -= width
-        laneInfo[lane] = {'heading': heading, 
-                          'bounds': {'x1': x1, 'y1': y1,
-                                     'x2': x2, 'y2': y2}
-                         }
+        laneInfo[lane] = getLaneInfo(shape, width)
     return laneInfo
 
 
@@ -141,6 +174,16 @@ def isInRange(vehPosition, scanRange, jcnGeometry):
     return (c1 and c2 and c3)
 
 
+def isInRangeArray(vehPositions, scanRange, jcnGeometry):
+    # vectorised isInRange for an (N, 2) array of vehicle positions
+    center, JCR = jcnGeometry
+    x, y = vehPositions[:, 0], vehPositions[:, 1]
+    c1 = np.hypot(x - center[0], y - center[1]) < scanRange
+    c2 = (JCR['W'] <= x) & (x <= JCR['E'])
+    c3 = (JCR['S'] <= y) & (y <= JCR['N'])
+    return c1 & c2 & c3
+
+
 # default dict that finds and remembers road speed limits (only if static)
 # needs to be updated otherwise
 class speedLimDict(defaultdict):
@@ -191,55 +234,426 @@ def flatten(listOfLists):
     return [elem for subList in listOfLists for elem in subList]
 
 
-class StopCounter(object):
+def getSubscriptionEdge():
+    # first non-internal edge, used as the centre of network wide context
+    # subscriptions
+    try:
+        return [e for e in traci.edge.getIDList() if ':' not in e][0]
+    except:
+        return [e for e in traci.edge.getIDList() if e[0] != ':'][0]
+
+
+class NetworkSubscription(object):
+    # One network wide vehicle context subscription shared by the monitors.
+    # Each monitor registers the variables it needs, the merged set is
+    # subscribed once and polled once per simulation step with update(), so
+    # SUMO only serialises the fleet a single time per step
+    def __init__(self, varIDs=(), domain=tc.CMD_GET_VEHICLE_VARIABLE):
+        self.varIDs = []
+        self.subResults = None
+        self.domain = domain
+        self.subkey = getSubscriptionEdge()
+        self.addVariables(varIDs)
+
+    def addVariables(self, varIDs):
+        newVars = [v for v in varIDs if v not in self.varIDs]
+        if not newVars:
+            return
+        self.varIDs += newVars
+        # resubscribing replaces the old subscription with the merged set
+        self.restoreSubscriptions()
+
+    def restoreSubscriptions(self):
+        traci.edge.subscribeContext(self.subkey, 
+                                    self.domain, 
+                                    1000000, 
+                                    varIDs=tuple(self.varIDs))
+
+    def update(self):
+        # call once per traci.simulationStep()
+        self.subResults = traci.edge.getContextSubscriptionResults(self.subkey)
+        return self.subResults
+
+    def getSubscriptionResults(self):
+        return self.subResults
+
+
+class subscriptionUser(object):
+    # Mixin for monitors that read from a NetworkSubscription. If no shared
+    # subscription is given the monitor makes and polls its own
+    def setSubscription(self, subscription, varIDs):
+        if subscription is None:
+            self.subscription = NetworkSubscription()
+            self.ownSubscription = True
+        else:
+            self.subscription = subscription
+            self.ownSubscription = False
+        self.subscription.addVariables(varIDs)
+        self.subkey = self.subscription.subkey
+
+    def getSubscriptionResults(self):
+        if self.ownSubscription:
+            return self.subscription.update()
+        return self.subscription.getSubscriptionResults()
+
+    def setStepLength(self):
+        # a vehicle has just stopped when its waiting time is one step
+        self.stepLength = getStepLength()
+        self.stopLower = self.stepLength - 0.001
+        self.stopUpper = self.stepLength + 0.001
+
+    def restoreSubscriptions(self):
+        # a shared subscription is restored by its owner
+        if self.ownSubscription:
+            self.subscription.restoreSubscriptions()
+
+
+class LoopSubscription(object):
+    # Per loop variable subscriptions for the partition's junctions. Not a
+    # context subscription on the NetworkSubscription edge, the TraCI client
+    # keeps context results per reference object whatever the domain, so
+    # the loops would land in the vehicle results every monitor reads
+    def __init__(self, varIDs=(tc.LAST_STEP_TIME_SINCE_DETECTION,)):
+        self.varIDs = tuple(varIDs)
+        self.loopIDs = []
+        self.subResults = {}
+
+    def addLoops(self, loopIDs):
+        for loopID in loopIDs:
+            if loopID not in self.loopIDs:
+                self.loopIDs.append(loopID)
+                traci.inductionloop.subscribe(loopID, self.varIDs)
+
+    def restoreSubscriptions(self):
+        for loopID in self.loopIDs:
+            traci.inductionloop.subscribe(loopID, self.varIDs)
+
+    def update(self):
+        # call once per traci.simulationStep(), results are already held by
+        # the client so this is no extra round trip
+        self.subResults = dict(
+            (loopID, traci.inductionloop.getSubscriptionResults(loopID))
+            for loopID in self.loopIDs)
+        return self.subResults
+
+    def getSubscriptionResults(self):
+        return self.subResults
+
+
+class JunctionPartition(object):
+    # Splits the network wide vehicle subscription into per junction views
+    # in place of one junction context subscription per controller, whose
+    # 250 m regions overlap and have SUMO send the same vehicles several
+    # times per step. Vehicles are binned into a grid once per step and
+    # each junction only checks the cells under its control region. Views
+    # hold the subscription's own vehicle dicts, nothing is copied
+    def __init__(self, subscription=None, cellSize=100.0):
+        if subscription is None:
+            self.subscription = NetworkSubscription()
+            self.ownSubscription = True
+        else:
+            self.subscription = subscription
+            self.ownSubscription = False
+        self.loopSubscription = None
+        self.cellSize = float(cellSize)
+        # dict[jcnID] = (x, y, region, scanRange**2, cells, loopIDs)
+        self.junctions = {}
+        self.views = {}
+        self.source = None
+
+    def getCell(self, x, y):
+        return int(x//self.cellSize), int(y//self.cellSize)
+
+    def addJunction(self, junctionID, jcnPosition, jcnCtrlRegion, scanRange,
+                    varIDs, loopIDs=(), margin=0.0):
+        # margin widens the control region for controllers that add noise
+        # to positions before their own range check
+        self.subscription.addVariables(varIDs)
+        x, y = float(jcnPosition[0]), float(jcnPosition[1])
+        region = (max(jcnCtrlRegion['W'], x - scanRange) - margin,
+                  min(jcnCtrlRegion['E'], x + scanRange) + margin,
+                  max(jcnCtrlRegion['S'], y - scanRange) - margin,
+                  min(jcnCtrlRegion['N'], y + scanRange) + margin)
+        iMin, jMin = self.getCell(region[0], region[2])
+        iMax, jMax = self.getCell(region[1], region[3])
+        cells = [(i, j) for i in range(iMin, iMax+1)
+                 for j in range(jMin, jMax+1)]
+        loopIDs = list(loopIDs)
+        if loopIDs:
+            if self.loopSubscription is None:
+                self.loopSubscription = LoopSubscription()
+            self.loopSubscription.addLoops(loopIDs)
+        self.junctions[junctionID] = (x, y, region, scanRange**2,
+                                      cells, loopIDs)
+        self.views[junctionID] = {}
+
+    def restoreSubscriptions(self):
+        # a shared vehicle subscription is restored by its owner
+        if self.ownSubscription:
+            self.subscription.restoreSubscriptions()
+        if self.loopSubscription is not None:
+            self.loopSubscription.restoreSubscriptions()
+
+    def update(self):
+        # call once per traci.simulationStep(), after a shared subscription
+        # has been updated
+        if self.ownSubscription:
+            self.subscription.update()
+        if self.loopSubscription is not None:
+            self.loopSubscription.update()
+        self.partition()
+
+    def partition(self):
+        vehicleData = self.subscription.getSubscriptionResults()
+        self.source = vehicleData
+        grid = defaultdict(list)
+        if vehicleData is not None:
+            cellSize = self.cellSize
+            posConst = tc.VAR_POSITION
+            for vehID, vData in vehicleData.items():
+                if posConst not in vData:
+                    continue
+                x, y = vData[posConst]
+                grid[(int(x//cellSize), int(y//cellSize))].append(
+                    (vehID, x, y, vData))
+
+        loopData = None
+        if self.loopSubscription is not None:
+            loopData = self.loopSubscription.getSubscriptionResults()
+
+        for jcnID, (x0, y0, region, range2, cells, loopIDs)\
+          in self.junctions.items():
+            W, E, S, N = region
+            view = {}
+            for cell in cells:
+                for vehID, x, y, vData in grid.get(cell, ()):
+                    if W <= x <= E and S <= y <= N and\
+                      (x-x0)*(x-x0) + (y-y0)*(y-y0) < range2:
+                        view[vehID] = vData
+            if loopData:
+                for loopID in loopIDs:
+                    if loopData.get(loopID):
+                        view[loopID] = loopData[loopID]
+            self.views[jcnID] = view
+
+    def getView(self, junctionID):
+        # same {objID: {varID: value}} form as a junction context
+        # subscription, repartitioned if the shared results have moved on
+        if self.subscription.getSubscriptionResults() is not self.source:
+            self.partition()
+        return self.views[junctionID]
+
+
+class laneVehicleIndex(object):
+    # lane -> set of vehIDs buckets built from the CAM receive data. Each CAM
+    # update is indexed once (later calls in the same step are free) and
+    # only vehicles that appear, leave or change lane move bucket.
+    # Stage lookups then only visit vehicles in the stage's target lanes
     def __init__(self):
+        self.buckets = defaultdict(set)
+        self.vehLane = {}
+        self.source = None
+
+    def update(self, receiveData):
+        if receiveData is self.source:
+            return
+        self.source = receiveData
+        newVehLane = {}
+        for vehID in receiveData.keys():
+            newVehLane[vehID] = receiveData[vehID]['lane']
+        for vehID, lane in self.vehLane.items():
+            if newVehLane.get(vehID) != lane:
+                self.buckets[lane].discard(vehID)
+        for vehID, lane in newVehLane.items():
+            if self.vehLane.get(vehID) != lane:
+                self.buckets[lane].add(vehID)
+        self.vehLane = newVehLane
+
+    def getVehicles(self, lanes):
+        vehicles = []
+        for lane in lanes:
+            if lane in self.buckets:
+                vehicles.extend(self.buckets[lane])
+        return vehicles
+
+    def getOncomingVehicles(self, receiveData, targetLanes, headingBounds):
+        # vehicles in the target lanes within any (lower, upper) heading bound
+        self.update(receiveData)
+        vehicles = []
+        for vehID in self.getVehicles(targetLanes):
+            vehHeading = receiveData[vehID]['heading']
+            for headingLower, headingUpper in headingBounds:
+                if headingLower <= vehHeading <= headingUpper:
+                    vehicles.append(vehID)
+                    break
+        return vehicles
+
+
+class vehicleSpill(object):
+    # Output records of finished vehicles kept on disk instead of in a
+    # monitor. Records are buffered and written in batches, each batch
+    # sorted by vehID into its own run file, then merged in vehID order with
+    # the vehicles still in the monitor when the output file is written.
+    # Run files are only ever rewritten from the start, so a checkpointed
+    # spill stays valid when the run carries on past the checkpoint
+    def __init__(self, filename, batchSize=10000):
+        self.filename = filename
+        self.batchSize = batchSize
+        self.buffer = []
+        self.Nruns = 0
+
+    def getRunFile(self, run):
+        return '{}.{}'.format(self.filename, run)
+
+    def add(self, vehID, record):
+        # record: the vehicle's lines of the output file
+        self.buffer.append((vehID, record))
+        if len(self.buffer) >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        with open(self.getRunFile(self.Nruns), 'w') as f:
+            for vehID, record in self.buffer:
+                f.write(record)
+        self.Nruns += 1
+        self.buffer = []
+
+    def readRun(self, run):
+        with open(self.getRunFile(run), 'r') as f:
+            for lineNo, line in enumerate(f):
+                yield line.split(',', 1)[0], run, lineNo, line
+
+    def readRecords(self, records, run):
+        lineNo = 0
+        for vehID, record in sorted(records):
+            for line in record.splitlines(True):
+                yield vehID, run, lineNo, line
+                lineNo += 1
+
+    def iterRecords(self, activeRecords):
+        # output lines of every vehicle in vehID order, activeRecords are
+        # (vehID, record) pairs of the vehicles not spilled yet. A vehicle's
+        # lines are all in one source, so (run, lineNo) keeps their order
+        sources = [self.readRun(run) for run in range(self.Nruns)]
+        sources.append(self.readRecords(self.buffer + list(activeRecords),
+                                        self.Nruns))
+        for vehID, run, lineNo, line in heapq.merge(*sources):
+            yield line
+
+    def clear(self):
+        for runFile in glob(self.filename + '.*'):
+            os.remove(runFile)
+        self.buffer = []
+        self.Nruns = 0
+
+
+class spillingMonitor(subscriptionUser):
+    # Monitors that move arrived vehicles to a vehicleSpill so only the
+    # vehicles on the network stay in memory. Vehicles are spilled the step
+    # after they arrive so anything reading the monitor for the arrival
+    # step, e.g. TripRecorder, still finds them
+    def setSpill(self, spillFile=None, batchSize=10000, trackArrivals=True):
+        # trackArrivals: spill on the arrived vehicles subscription, a
+        # monitor that isn't updated every step finds its own
+        self.ARRIVED = tc.VAR_ARRIVED_VEHICLES_IDS
+        self.arrivedIDs = []
+        self.trackArrivals = trackArrivals
+        if spillFile is None:
+            self.spill = None
+        else:
+            self.spill = vehicleSpill(spillFile, batchSize)
+            if trackArrivals:
+                subscribeSimulation((self.ARRIVED,))
+
+    def spillArrived(self):
+        # call once per step before the update
+        if self.spill is None:
+            return
+        for vehID in self.arrivedIDs:
+            self.spillVehicle(vehID)
+        simResults = traci.simulation.getSubscriptionResults() or {}
+        self.arrivedIDs = list(simResults.get(self.ARRIVED, ()))
+
+    def spillVehicle(self, vehID):
+        pass
+
+    def clearSpill(self):
+        # remove the run files once the output is written for good
+        if self.spill is not None:
+            self.spill.clear()
+
+    def restoreSubscriptions(self):
+        subscriptionUser.restoreSubscriptions(self)
+        if self.spill is not None and self.trackArrivals:
+            subscribeSimulation((self.ARRIVED,))
+
+
+class StopCounter(spillingMonitor):
+    def __init__(self, subscription=None, spillFile=None):
         self.stopCountDict = defaultdict(int)
         self.waitingDict = defaultdict(float)
         self.WAIT = tc.VAR_WAITING_TIME
         self.speedTol = 1e-3
-        self.stopSubscription()  # makes self.subkey
+        self.setStepLength()
+        self.stopSubscription(subscription)  # makes self.subkey
+        self.setSpill(spillFile)
 
-    def stopSubscription(self):
-        try:
-            self.subkey = [e for e in traci.edge.getIDList() if ':' not in e][0]
-        except:
-            self.subkey = [e for e in traci.edge.getIDList() if e[0] != ':'][0]
-        traci.edge.subscribeContext(self.subkey, 
-                                    tc.CMD_GET_VEHICLE_VARIABLE, 
-                                    1000000, 
-                                    varIDs=(self.WAIT,))
-
-    def getSubscriptionResults(self):
-        return traci.edge.getContextSubscriptionResults(self.subkey)
+    def stopSubscription(self, subscription=None):
+        self.setSubscription(subscription, (self.WAIT,))
 
     def getStops(self):
+        self.spillArrived()
         self.subResults = self.getSubscriptionResults()
         
         try:
             for vehID in self.subResults.keys():
                 if self.subResults[vehID][self.WAIT] > 0.0:
-                    self.waitingDict[vehID] += 0.1
-                if 0.099 < self.subResults[vehID][self.WAIT] < 0.101:
+                    self.waitingDict[vehID] += self.stepLength
+                if self.stopLower < self.subResults[vehID][self.WAIT] < self.stopUpper:
                     self.stopCountDict[vehID] += 1
         except KeyError:
             pass
         except AttributeError:
             pass
 
+    def getStopRecord(self, vehID):
+        return '{},{}\n'.format(vehID, self.stopCountDict[vehID])
+
+    def spillVehicle(self, vehID):
+        # vehicles never stopped or looked up have no stops line
+        if vehID in self.stopCountDict:
+            self.spill.add(vehID, self.getStopRecord(vehID))
+            del self.stopCountDict[vehID]
+        self.waitingDict.pop(vehID, None)
+
     def writeStops(self, filename):
         with open(filename, 'w') as f:
             f.write('vehID,stops\n')
+            if self.spill is not None:
+                activeRecords = [(vehID, self.getStopRecord(vehID))
+                                 for vehID in self.stopCountDict.keys()]
+                for line in self.spill.iterRecords(activeRecords):
+                    f.write(line)
+                return
             vehIDs = self.stopCountDict.keys()
             vehIDs.sort()
             for vehID in vehIDs:
                 f.write('{},{}\n'.format(vehID, self.stopCountDict[vehID]))
 
 
-class EmissionCounter(object):
-    def __init__(self):
+def defaultVType():
+    # module level so EmissionCounter.vTypeDict can be pickled
+    return 'car'
+
+
+class EmissionCounter(spillingMonitor):
+    def __init__(self, subscription=None, spillFile=None):
         self.emissionCountDict = emissionDict()
         self.emissionMonitor = emissionDict()
-        self.vTypeDict = defaultdict(lambda: 'car')
+        self.vTypeDict = defaultdict(defaultVType)
         self.CO2 = tc.VAR_CO2EMISSION
         self.CO = tc.VAR_COEMISSION
         self.HC = tc.VAR_HCEMISSION
@@ -249,22 +663,13 @@ class EmissionCounter(object):
         self.emissionList = [self.CO2, self.CO, self.HC,
                              self.PMX, self.NOX, self.FUEL]
         self.vType = tc.VAR_TYPE
-        self.EmissionSubscription()  # makes self.subkey
+        self.EmissionSubscription(subscription)  # makes self.subkey
+        self.setSpill(spillFile)
 
-    def EmissionSubscription(self):
-        try:
-            self.subkey = [e for e in traci.edge.getIDList() if ':' not in e][0]
-        except:
-            self.subkey = [e for e in traci.edge.getIDList() if e[0] != ':'][0]
-        traci.edge.subscribeContext(self.subkey, 
-                                    tc.CMD_GET_VEHICLE_VARIABLE, 
-                                    1000000, 
-                                    varIDs=(self.CO2, self.CO, self.HC,
-                                            self.PMX, self.NOX, self.FUEL,
-                                            self.vType))
-
-    def getSubscriptionResults(self):
-        return traci.edge.getContextSubscriptionResults(self.subkey)
+    def EmissionSubscription(self, subscription=None):
+        self.setSubscription(subscription,
+                             (self.CO2, self.CO, self.HC, self.PMX,
+                              self.NOX, self.FUEL, self.vType))
         
     def getEmissionsOLD(self, time):
         self.subResults = self.getSubscriptionResults()
@@ -300,6 +705,7 @@ class EmissionCounter(object):
             # traceback.print_exc()
 
     def getEmissions(self, time):
+        self.spillArrived()
         self.subResults = self.getSubscriptionResults()
 
         try:
@@ -334,9 +740,28 @@ class EmissionCounter(object):
         except AttributeError:
             pass
 
+    def getEmissionRecord(self, vehID):
+        dataStr = '{},{},'.format(vehID, self.vTypeDict[vehID])
+        dataStr += ','.join(str(self.emissionCountDict[vehID][emission])
+                            for emission in self.emissionList)
+        return dataStr + '\n'
+
+    def spillVehicle(self, vehID):
+        if vehID in self.emissionCountDict:
+            self.spill.add(vehID, self.getEmissionRecord(vehID))
+            del self.emissionCountDict[vehID]
+        self.vTypeDict.pop(vehID, None)
+        self.emissionMonitor.pop(vehID, None)
+
     def writeEmissions(self, filename):
         with open(filename, 'w') as f:
             f.write('vehID,vType,CO2,CO,HC,PMX,NOX,FUEL\n')
+            if self.spill is not None:
+                activeRecords = [(vehID, self.getEmissionRecord(vehID))
+                                 for vehID in self.emissionCountDict.keys()]
+                for line in self.spill.iterRecords(activeRecords):
+                    f.write(line)
+                return
             vehIDs = self.emissionCountDict.keys()
             vehIDs.sort()
             for vehID in vehIDs:
@@ -349,37 +774,374 @@ class EmissionCounter(object):
                 f.write(dataStr)
 
 
-class RouteMonitor(object):
-    def __init__(self, routeXML):
+class idIndex(object):
+    # Interns SUMO string IDs to dense integer rows on first sight, rows are
+    # never reused so a row always refers to the same object for the length
+    # of the run
+    def __init__(self):
+        self.rowDict = {}
+        self.IDs = []
+
+    def __len__(self):
+        return len(self.IDs)
+
+    def __contains__(self, objID):
+        return objID in self.rowDict
+
+    def getRow(self, objID):
+        try:
+            return self.rowDict[objID]
+        except KeyError:
+            row = len(self.IDs)
+            self.rowDict[objID] = row
+            self.IDs.append(objID)
+            return row
+
+    def getRows(self, objIDs):
+        return np.fromiter((self.getRow(x) for x in objIDs),
+                           dtype=np.intp, count=len(objIDs))
+
+    def getIDs(self, rows):
+        IDs = self.IDs
+        return [IDs[row] for row in rows]
+
+
+# vehicles are interned the same way as everything else
+vehicleIndex = idIndex
+
+
+def uniqueRows(rows):
+    # unique rows in order of first appearance
+    rows = np.asarray(rows, dtype=np.intp)
+    if len(rows) < 2:
+        return rows
+    _, first = np.unique(rows, return_index=True)
+    return rows[np.sort(first)]
+
+
+class networkIndex(object):
+    # Integer IDs for lanes, edges, loops, junctions and vehicles shared by
+    # the controllers, CAM channels and monitors of a run so they all agree
+    # on rows. A lane's edge is resolved once when the lane is interned,
+    # lane -> edge and edge -> lanes are then array lookups rather than the
+    # string splits and joins of lane2edge/edge2lanes
+    def __init__(self, net=None):
+        self.lanes = idIndex()
+        self.edges = idIndex()
+        self.loops = idIndex()
+        self.junctions = idIndex()
+        self.vehicles = idIndex()
+        # lane row -> edge row, edge row -> list of lane rows
+        self.laneEdge = np.zeros(0, dtype=np.intp)
+        self.edgeLanes = []
+        # loop row -> lane row
+        self.loopLane = np.zeros(0, dtype=np.intp)
+        if net is not None:
+            self.addNetwork(net)
+
+    def addNetwork(self, net):
+        # intern the static network up front, net is a networkGeometry or
+        # traciNetwork. Edges in sorted order so rows don't depend on dict
+        # order, their lanes in the edge's lane order
+        edgeLaneMap = net.getEdgeLaneMap()
+        for edgeID in sorted(edgeLaneMap.keys()):
+            for laneID in edgeLaneMap[edgeID]:
+                self.getLaneRow(laneID)
+        for laneID in net.getLaneIDs():
+            self.getLaneRow(laneID)
+        for loopID in net.getLoopIDs():
+            self.getLoopRow(loopID, net.getLoopLane(loopID))
+        for tlID in net.getTLIDs():
+            self.junctions.getRow(tlID)
+
+    def getEdgeRow(self, edgeID):
+        row = self.edges.getRow(edgeID)
+        if row == len(self.edgeLanes):
+            self.edgeLanes.append([])
+        return row
+
+    def getLaneRow(self, laneID):
+        try:
+            return self.lanes.rowDict[laneID]
+        except KeyError:
+            pass
+        row = self.lanes.getRow(laneID)
+        # same edge as lane2edge gives
+        edgeRow = self.getEdgeRow(laneID.split('_')[0])
+        self.laneEdge = growArray(self.laneEdge, row + 1)
+        self.laneEdge[row] = edgeRow
+        self.edgeLanes[edgeRow].append(row)
+        return row
+
+    def getLaneRows(self, laneIDs):
+        return np.fromiter((self.getLaneRow(x) for x in laneIDs),
+                           dtype=np.intp, count=len(laneIDs))
+
+    def getLoopRow(self, loopID, laneID=None):
+        row = self.loops.getRow(loopID)
+        self.loopLane = growArray(self.loopLane, row + 1)
+        if laneID is not None:
+            self.loopLane[row] = self.getLaneRow(laneID)
+        return row
+
+    def getLaneEdgeRows(self, laneRows):
+        # unique edges of the lanes
+        return uniqueRows(self.laneEdge[np.asarray(laneRows, dtype=np.intp)])
+
+    def getEdgeLaneRows(self, edgeRows):
+        # all lanes of the edges, in edge order
+        laneRows = [self.edgeLanes[row] for row in edgeRows]
+        return np.array(flatten(laneRows), dtype=np.intp)
+
+    def lane2edge(self, lanes):
+        # lane2edge with the edges resolved by row
+        if isinstance(lanes, str):
+            lanes = [lanes]
+        edgeRows = self.getLaneEdgeRows(self.getLaneRows(lanes))
+        return self.edges.getIDs(edgeRows)
+
+    def edge2lanes(self, edges):
+        # lanes of the edges as the network has them, edges never seen with
+        # a lane have none
+        if isinstance(edges, str):
+            edges = [edges]
+        edgeRows = [self.getEdgeRow(edgeID) for edgeID in edges]
+        return self.lanes.getIDs(self.getEdgeLaneRows(edgeRows))
+
+
+def growArray(array, size):
+    # grow first axis of array to at least size by doubling, new entries zero
+    if size <= array.shape[0]:
+        return array
+    newShape = (max(size, 2*array.shape[0]),) + array.shape[1:]
+    newArray = np.zeros(newShape, dtype=array.dtype)
+    newArray[:array.shape[0]] = array
+    return newArray
+
+
+class columnView(object):
+    # dict style read access to a column of a columnar monitor so code
+    # written against the dict monitors (e.g. CDOTS) works unchanged
+    def __init__(self, getter, keys):
+        self.getter = getter
+        self.keys = keys
+
+    def __getitem__(self, vehID):
+        return self.getter(vehID)
+
+    def __contains__(self, vehID):
+        return vehID in self.keys()
+
+
+class ColumnarStopCounter(subscriptionUser):
+    # Array backed StopCounter, per step update is vectorised over the
+    # vehicles in the subscription. writeStops output matches StopCounter
+    def __init__(self, subscription=None, capacity=4096, vehIndex=None):
+        # vehIndex: idIndex shared with the rest of the run, e.g.
+        # networkIndex.vehicles, own index if None
+        self.WAIT = tc.VAR_WAITING_TIME
+        self.speedTol = 1e-3
+        self.setStepLength()
+        self.vehIndex = vehIndex if vehIndex is not None else idIndex()
+        self.waiting = np.zeros(capacity, dtype=float)
+        self.stopCount = np.zeros(capacity, dtype=int)
+        # rows that would be keys of StopCounter.stopCountDict
+        self.listed = np.zeros(capacity, dtype=bool)
+        self.stopCountDict = columnView(self.getStopCount, self.getListedIDs)
+        self.waitingDict = columnView(self.getWaiting, self.getListedIDs)
+        self.setSubscription(subscription, (self.WAIT,))
+
+    def reserve(self, size):
+        self.waiting = growArray(self.waiting, size)
+        self.stopCount = growArray(self.stopCount, size)
+        self.listed = growArray(self.listed, size)
+
+    def getRow(self, vehID):
+        row = self.vehIndex.getRow(vehID)
+        self.reserve(row + 1)
+        return row
+
+    def getStopCount(self, vehID):
+        # defaultdict access adds the key, mirror that for identical output
+        row = self.getRow(vehID)
+        self.listed[row] = True
+        return int(self.stopCount[row])
+
+    def getWaiting(self, vehID):
+        return float(self.waiting[self.getRow(vehID)])
+
+    def getListedIDs(self):
+        return [self.vehIndex.IDs[i] for i in np.flatnonzero(self.listed)]
+
+    def getStops(self):
+        self.subResults = self.getSubscriptionResults()
+        if not self.subResults:
+            return
+
+        vehIDs = list(self.subResults.keys())
+        try:
+            wait = np.fromiter((self.subResults[v][self.WAIT] for v in vehIDs),
+                               dtype=float, count=len(vehIDs))
+        except KeyError:
+            return
+        rows = self.vehIndex.getRows(vehIDs)
+        self.reserve(len(self.vehIndex))
+        self.waiting[rows[wait > 0.0]] += self.stepLength
+        stopped = rows[(self.stopLower < wait) & (wait < self.stopUpper)]
+        self.stopCount[stopped] += 1
+        self.listed[stopped] = True
+
+    def writeStops(self, filename):
+        with open(filename, 'w') as f:
+            f.write('vehID,stops\n')
+            vehIDs = self.getListedIDs()
+            vehIDs.sort()
+            for vehID in vehIDs:
+                row = self.vehIndex.rowDict[vehID]
+                f.write('{},{}\n'.format(vehID, int(self.stopCount[row])))
+
+
+class ColumnarEmissionCounter(subscriptionUser):
+    # Array backed EmissionCounter, per second maxima and totals are kept as
+    # (vehicles x emissions) arrays. writeEmissions output matches
+    # EmissionCounter
+    def __init__(self, subscription=None, capacity=4096, vehIndex=None):
+        # vehIndex: idIndex shared with the rest of the run, e.g.
+        # networkIndex.vehicles, own index if None
+        self.CO2 = tc.VAR_CO2EMISSION
+        self.CO = tc.VAR_COEMISSION
+        self.HC = tc.VAR_HCEMISSION
+        self.PMX = tc.VAR_PMXEMISSION
+        self.NOX = tc.VAR_NOXEMISSION
+        self.FUEL = tc.VAR_FUELCONSUMPTION
+        self.emissionList = [self.CO2, self.CO, self.HC,
+                             self.PMX, self.NOX, self.FUEL]
+        self.vType = tc.VAR_TYPE
+        self.vehIndex = vehIndex if vehIndex is not None else idIndex()
+        Nemissions = len(self.emissionList)
+        self.emissionMax = np.zeros((capacity, Nemissions), dtype=float)
+        self.emissionTotal = np.zeros((capacity, Nemissions), dtype=float)
+        # rows that would be keys of EmissionCounter.emissionCountDict
+        self.listed = np.zeros(capacity, dtype=bool)
+        # rows with a non-zero per second maximum, so the reset each second
+        # doesn't have to clear every vehicle seen in the run
+        self.touchedRows = []
+        self.vTypes = []
+        self.emissionCountDict = columnView(self.getEmissionTotals,
+                                            self.getListedIDs)
+        self.vTypeDict = columnView(self.getType, self.getTypedIDs)
+        self.setSubscription(subscription,
+                             (self.CO2, self.CO, self.HC, self.PMX,
+                              self.NOX, self.FUEL, self.vType))
+
+    def reserve(self, size):
+        self.emissionMax = growArray(self.emissionMax, size)
+        self.emissionTotal = growArray(self.emissionTotal, size)
+        self.listed = growArray(self.listed, size)
+        self.vTypes += [None]*(size - len(self.vTypes))
+
+    def getRow(self, vehID):
+        row = self.vehIndex.getRow(vehID)
+        self.reserve(row + 1)
+        return row
+
+    def getEmissionTotals(self, vehID):
+        row = self.getRow(vehID)
+        self.listed[row] = True
+        return dict(zip(self.emissionList,
+                        (float(x) for x in self.emissionTotal[row])))
+
+    def getType(self, vehID):
+        # EmissionCounter.vTypeDict defaults unknown vehicles to car
+        row = self.getRow(vehID)
+        if self.vTypes[row] is None:
+            self.vTypes[row] = 'car'
+        return self.vTypes[row]
+
+    def getListedIDs(self):
+        return [self.vehIndex.IDs[i] for i in np.flatnonzero(self.listed)]
+
+    def getTypedIDs(self):
+        return [self.vehIndex.IDs[i] for i, t in enumerate(self.vTypes)
+                if t is not None]
+
+    def getEmissions(self, time):
+        self.subResults = self.getSubscriptionResults()
+        if not self.subResults:
+            return
+
+        vehIDs = list(self.subResults.keys())
+        try:
+            emissions = np.array([[self.subResults[v][e]
+                                   for e in self.emissionList]
+                                  for v in vehIDs], dtype=float)
+        except KeyError:
+            return
+        rows = self.vehIndex.getRows(vehIDs)
+        self.reserve(len(self.vehIndex))
+
+        # Track maximum per second emissions
+        self.emissionMax[rows] = np.maximum(self.emissionMax[rows], emissions)
+        self.touchedRows.append(rows)
+        # If new second, add per second emissions to total
+        if not time%1000:
+            for row, vehID in zip(rows, vehIDs):
+                if self.vTypes[row] is None:
+                    self.vTypes[row] = self.subResults[vehID][self.vType]
+            self.emissionTotal[rows] += self.emissionMax[rows]
+            self.listed[rows] = True
+            # reset monitor for next second
+            self.emissionMax[np.concatenate(self.touchedRows)] = 0.0
+            self.touchedRows = []
+
+    def writeEmissions(self, filename):
+        with open(filename, 'w') as f:
+            f.write('vehID,vType,CO2,CO,HC,PMX,NOX,FUEL\n')
+            vehIDs = self.getListedIDs()
+            vehIDs.sort()
+            for vehID in vehIDs:
+                row = self.vehIndex.rowDict[vehID]
+                dataStr = '{},{},'.format(vehID, self.getType(vehID))
+                dataStr += ','.join(str(float(x))
+                                    for x in self.emissionTotal[row])
+                f.write(dataStr + '\n')
+
+
+class RouteMonitor(spillingMonitor):
+    def __init__(self, routeXML, subscription=None, spillFile=None):
         self.distDict = defaultdict(list)
         self.DISTANCE = tc.VAR_DISTANCE
-        self.routeSubscription()  # makes self.subkey
+        self.routeSubscription(subscription)  # makes self.subkey
         self.getTargetVehIDs(routeXML)
+        self.setSpill(spillFile, trackArrivals=False)
 
-    def routeSubscription(self):
-        self.subkey = [e for e in traci.edge.getIDList() if ':' not in e][0]
-        traci.edge.subscribeContext(self.subkey, 
-                                    tc.CMD_GET_VEHICLE_VARIABLE, 
-                                    1000000, 
-                                    varIDs=(self.DISTANCE,))
-
-    def getSubscriptionResults(self):
-        return traci.edge.getContextSubscriptionResults(self.subkey)
+    def routeSubscription(self, subscription=None):
+        self.setSubscription(subscription, (self.DISTANCE,))
 
     def getTargetVehIDs(self, routeXML):
         #regex = re.compile('<vehicle.*id="(.+?)".*\n.*edges="edge(140|246|116|117|93).*edge(30|180|267|25|83)"')
         regex = re.compile('<vehicle.*id="(.+?)".*\n.*edges="edge(117|140).*edge(30|180|267|25|83)"')
         self.targetVehIDs = []
         self.OD = {}
-        with open(routeXML, 'r') as rfile:
-            data = ''.join(rfile.readlines())
-            targetData = regex.findall(data)
+        if routeXML.endswith('.npz'):
+            # binary demand table, same match on each route's edges
+            edgeRegex = re.compile('edge(117|140).*edge(30|180|267|25|83)$')
+            targetData = []
+            for vehID, depart, edges in demandTable.iterVehicles(routeXML):
+                match = edgeRegex.match(edges)
+                if match:
+                    targetData.append((vehID,) + match.groups())
+        else:
+            with open(routeXML, 'r') as rfile:
+                data = ''.join(rfile.readlines())
+                targetData = regex.findall(data)
         for vehID, origin, destination in targetData:
             self.targetVehIDs.append(vehID)
             self.OD[vehID] = {'O': origin, 'D': destination}
 
     def getDistances(self, time):
         self.subResults = self.getSubscriptionResults()
+        self.spillArrived()
         try:
             timeSec = time/1000.0
             for vehID in self.subResults.keys():
@@ -391,9 +1153,33 @@ class RouteMonitor(object):
         except AttributeError:
             pass
 
+    def spillArrived(self):
+        # only called once a second, so the tracked vehicles that have left
+        # the subscription since the last call are the finished ones
+        if self.spill is None or self.subResults is None:
+            return
+        for vehID in [v for v in self.distDict if v not in self.subResults]:
+            self.spillVehicle(vehID)
+
+    def getDistanceRecord(self, vehID):
+        origin, destination = self.OD[vehID]['O'], self.OD[vehID]['D']
+        return ''.join('{},{},{},{},{}\n'.format(vehID, time, distance,
+                                                origin, destination)
+                       for time, distance in self.distDict[vehID])
+
+    def spillVehicle(self, vehID):
+        self.spill.add(vehID, self.getDistanceRecord(vehID))
+        del self.distDict[vehID]
+
     def writeDistances(self, filename):
         with open(filename, 'w') as f:
             f.write('vehID,time,distance,origin,destination\n')
+            if self.spill is not None:
+                activeRecords = [(vehID, self.getDistanceRecord(vehID))
+                                 for vehID in self.distDict.keys()]
+                for line in self.spill.iterRecords(activeRecords):
+                    f.write(line)
+                return
             vehIDs = self.distDict.keys()
             vehIDs.sort()
             for vehID in vehIDs:
@@ -402,58 +1188,70 @@ class RouteMonitor(object):
                     f.write('{},{},{},{},{}\n'.format(vehID, time, distance, origin, destination))
 
 
-class PIMonitor(object):
-    def __init__(self):
+class PIMonitor(subscriptionUser):
+    # Journey time and stop performance index for the optimiser. Journeys
+    # are tracked from departed/arrived vehicle subscriptions and summed as
+    # vehicles arrive, so getPI is O(1) however many vehicles have been seen
+    def __init__(self, subscription=None):
         self.stopCountDict = defaultdict(int)
         self.waitingDict = defaultdict(float)
-        self.delayDict = delayDefaultDict()
+        self.departDict = {}
         self.WAIT = tc.VAR_WAITING_TIME
         self.ARRIVED = tc.VAR_ARRIVED_VEHICLES_IDS
         self.DEPARTED = tc.VAR_DEPARTED_VEHICLES_IDS
         self.speedTol = 1e-3
-        self.subscription()  # makes self.subkey
+        # running sums over finished journeys
+        self.Nfinished = 0
+        self.delaySum = 0.0
+        self.stopSum = 0
+        self.setStepLength()
+        self.piSubscription(subscription)  # makes self.subkey
 
-    def subscription(self):
-        self.subkey = [e for e in traci.edge.getIDList() if ':' not in e][0]
-        traci.edge.subscribeContext(self.subkey, 
-                                    tc.CMD_GET_VEHICLE_VARIABLE, 
-                                    1000000, 
-                                    varIDs=(self.WAIT,))
+    def piSubscription(self, subscription=None):
+        self.setSubscription(subscription, (self.WAIT,))
+        subscribeSimulation((self.DEPARTED, self.ARRIVED))
 
-    def getSubscriptionResults(self):
-        return traci.edge.getContextSubscriptionResults(self.subkey)
+    def restoreSubscriptions(self):
+        subscriptionUser.restoreSubscriptions(self)
+        subscribeSimulation((self.DEPARTED, self.ARRIVED))
 
     def getPIUpdate(self, simTime):
         self.subResults = self.getSubscriptionResults()
-        
-        try:
-            for vehID in self.subResults.keys():
-                # If the vehicle has entered then add first time stamp
-                if vehID not in self.delayDict.keys():
-                    self.delayDict[vehID][0] = simTime*1e-3
-                # Count stops and waiting
-                if self.subResults[vehID][self.WAIT] > 0.0:
-                    self.waitingDict[vehID] += 0.1
-                if 0.099 < self.subResults[vehID][self.WAIT] < 0.101:
-                    self.stopCountDict[vehID] += 1
+        simResults = traci.simulation.getSubscriptionResults() or {}
+        timeSec = simTime*1e-3
 
-            for vehID in self.delayDict.keys():
-                if vehID not in self.subResults.keys() and self.delayDict[vehID][1] == 0:
-                    self.delayDict[vehID][1] = simTime*1e-3
+        for vehID in simResults.get(self.DEPARTED, ()):
+            self.departDict[vehID] = timeSec
 
+        try:
+            # Count stops and waiting
+            for vehID, data in self.subResults.items():
+                if data[self.WAIT] > 0.0:
+                    self.waitingDict[vehID] += self.stepLength
+                if self.stopLower < data[self.WAIT] < self.stopUpper:
+                    self.stopCountDict[vehID] += 1
         except KeyError:
             pass
         except AttributeError:
             pass
 
+        # a journey ends on the step the vehicle leaves the network
+        for vehID in simResults.get(self.ARRIVED, ()):
+            try:
+                depart = self.departDict.pop(vehID)
+            except KeyError:
+                continue  # departed before monitoring started
+            self.Nfinished += 1
+            self.delaySum += timeSec - depart
+            self.stopSum += self.stopCountDict.get(vehID, 0)
+
     def getPI(self):
         # using journey time as no way to get all info needed cheaply yet
         # Only consider vehicles who have finished their journeys
-        finishedIDs = [k for k in self.delayDict.keys() if self.delayDict[k][1]]
-        delays = [v[1]-v[0] for k,v in self.delayDict.items() if k in finishedIDs]
-        delays = np.array([x for x in delays if x >= 0])
-        stops = np.array([self.stopCountDict[k] for k in finishedIDs])
-        return delays.mean(), stops.mean()
+        if not self.Nfinished:
+            return float('nan'), float('nan')
+        return (self.delaySum/self.Nfinished,
+                self.stopSum/float(self.Nfinished))
 
     def writeStops(self, filename):
         with open(filename, 'w') as f:
@@ -464,6 +1262,210 @@ class PIMonitor(object):
                 f.write('{},{}\n'.format(vehID, self.stopCountDict[vehID]))
 
 
+class CVPAssigner(subscriptionUser):
+    # Connected vehicle penetration set at run time, so one route file per
+    # seed (all vehicles unconnected) serves every CVP. Departing vehicles
+    # are switched to the c_ variant of their vType when a uniform draw
+    # hashed from (seed, vehID) is below CVP. The draw doesn't depend on
+    # departure order and the connected fleet at a CVP is contained in the
+    # fleet at any higher CVP, so CVP levels compare like for like
+    def __init__(self, CVP, seed, subscription=None, prefix='c_'):
+        self.CVP = float(CVP)
+        self.seed = int(seed)
+        self.prefix = prefix
+        self.TYPE = tc.VAR_TYPE
+        self.DEPARTED = tc.VAR_DEPARTED_VEHICLES_IDS
+        # departures seen and vehicles switched to connected
+        self.Ndeparted = 0
+        self.Nassigned = 0
+        self.cvpSubscription(subscription)  # makes self.subkey
+
+    def cvpSubscription(self, subscription=None):
+        self.setSubscription(subscription, (self.TYPE,))
+        subscribeSimulation((self.DEPARTED,))
+
+    def restoreSubscriptions(self):
+        subscriptionUser.restoreSubscriptions(self)
+        subscribeSimulation((self.DEPARTED,))
+
+    def getDraw(self, vehID):
+        # uniform [0, 1) from the first 52 bits of the hash
+        key = '{}:{}'.format(self.seed, vehID).encode('utf-8')
+        return int(hashlib.sha1(key).hexdigest()[:13], 16)/float(1 << 52)
+
+    def assign(self):
+        # call after the shared subscription is updated and before anything
+        # reads it, the results are updated with the new type so everything
+        # sees the vehicle as connected from its departure step
+        self.subResults = self.getSubscriptionResults()
+        if self.subResults is None:
+            self.subResults = {}
+        simResults = traci.simulation.getSubscriptionResults() or {}
+        for vehID in simResults.get(self.DEPARTED, ()):
+            self.Ndeparted += 1
+            if self.getDraw(vehID) >= self.CVP:
+                continue
+            data = self.subResults.get(vehID)
+            if data is not None and self.TYPE in data:
+                vType = data[self.TYPE]
+            else:
+                vType = traci.vehicle.getTypeID(vehID)
+            if vType.startswith(self.prefix):
+                continue  # connected in the route file
+            connectedType = self.prefix + vType
+            traci.vehicle.setType(vehID, connectedType)
+            if data is not None:
+                data[self.TYPE] = connectedType
+            self.Nassigned += 1
+
+
+def laneEdge(laneID):
+    # edge of a lane, internal junction lanes have no edge in tripinfo
+    if not laneID or laneID[0] == ':':
+        return ''
+    return laneID.rsplit('_', 1)[0]
+
+
+def getScheduledDeparts(routeXML):
+    # vehID -> depart time written in the route file or demand table
+    if routeXML.endswith('.npz'):
+        return dict((vehID, depart) for vehID, depart, edges
+                    in demandTable.iterVehicles(routeXML))
+    departs = {}
+    idRegex = re.compile(r'\sid="([^"]*)"')
+    departRegex = re.compile(r'\sdepart="([^"]*)"')
+    with open(routeXML, 'r') as rfile:
+        for tag in re.findall(r'<vehicle\s[^>]*>', rfile.read()):
+            vehID, depart = idRegex.search(tag), departRegex.search(tag)
+            if vehID and depart:
+                try:
+                    departs[vehID.group(1)] = float(depart.group(1))
+                except ValueError:
+                    pass  # triggered departs have no time
+    return departs
+
+
+class TripRecorder(subscriptionUser):
+    # Records the tripinfo fields in the simulation instead of having SUMO
+    # write tripinfo XML for the parsers. Departures and arrivals come from
+    # a simulation subscription, the vehicle state at arrival from the
+    # shared subscription of the step before, so the fleet isn't looped over
+    # each step when SUMO has VAR_TIMELOSS. Stops and emissions are read
+    # from the run's counters as each vehicle arrives. Trips are written as
+    # one npz of columns per run, see tripinfoReader.parseTripFile
+    FIELDS = ['id', 'depart', 'origin', 'departDelay', 'arrival',
+              'destination', 'duration', 'routeLength', 'timeLoss', 'vType',
+              'stops', 'CO2', 'CO', 'HC', 'PMX', 'NOX', 'FUEL']
+
+    def __init__(self, subscription=None, routeXML=None, stopCounter=None,
+                 emissionCounter=None):
+        self.LANE = tc.VAR_LANE_ID
+        self.TYPE = tc.VAR_TYPE
+        self.DISTANCE = tc.VAR_DISTANCE
+        # older SUMO has no time loss variable, accumulate it from speed
+        self.TIMELOSS = getattr(tc, 'VAR_TIMELOSS', None)
+        self.SPEED = tc.VAR_SPEED
+        self.ALLOWED = tc.VAR_ALLOWED_SPEED
+        self.DEPARTED = tc.VAR_DEPARTED_VEHICLES_IDS
+        self.ARRIVED = tc.VAR_ARRIVED_VEHICLES_IDS
+        self.stopCounter = stopCounter
+        self.emissionCounter = emissionCounter
+        self.setStepLength()
+        # depart delay is measured against the route file schedule
+        if routeXML is not None and os.path.isfile(routeXML):
+            self.scheduledDeparts = getScheduledDeparts(routeXML)
+        else:
+            self.scheduledDeparts = {}
+        # vehID -> [depart, origin, vType, timeLoss] while on the network
+        self.activeDict = {}
+        self.lastResults = {}
+        self.trips = dict((field, []) for field in self.FIELDS)
+        self.tripSubscription(subscription)  # makes self.subkey
+
+    def tripSubscription(self, subscription=None):
+        varIDs = [self.LANE, self.TYPE, self.DISTANCE]
+        if self.TIMELOSS is None:
+            varIDs += [self.SPEED, self.ALLOWED]
+        else:
+            varIDs.append(self.TIMELOSS)
+        self.setSubscription(subscription, varIDs)
+        subscribeSimulation((self.DEPARTED, self.ARRIVED))
+
+    def restoreSubscriptions(self):
+        subscriptionUser.restoreSubscriptions(self)
+        subscribeSimulation((self.DEPARTED, self.ARRIVED))
+
+    def getTrips(self, time):
+        # time in ms after the step, events are stamped with the step's start
+        self.subResults = self.getSubscriptionResults()
+        if self.subResults is None:
+            self.subResults = {}
+        simResults = traci.simulation.getSubscriptionResults() or {}
+        stepTime = time*1e-3 - self.stepLength
+
+        for vehID in simResults.get(self.DEPARTED, ()):
+            data = self.subResults.get(vehID, {})
+            self.activeDict[vehID] = [stepTime,
+                                      laneEdge(data.get(self.LANE, '')),
+                                      data.get(self.TYPE, ''), 0.0]
+
+        if self.TIMELOSS is None:
+            for vehID, data in self.subResults.items():
+                try:
+                    allowed = data[self.ALLOWED]
+                    if allowed > 0.0:
+                        self.activeDict[vehID][3] += \
+                            self.stepLength*(1.0 - data[self.SPEED]/allowed)
+                except KeyError:
+                    pass
+
+        for vehID in simResults.get(self.ARRIVED, ()):
+            self.addTrip(vehID, stepTime)
+        self.lastResults = self.subResults
+
+    def addTrip(self, vehID, arrival):
+        try:
+            depart, origin, vType, timeLoss = self.activeDict.pop(vehID)
+        except KeyError:
+            return  # departed before recording started
+        # arrived vehicles have left the subscription, use the step before
+        data = self.lastResults.get(vehID, {})
+        if self.TIMELOSS is not None:
+            timeLoss = data.get(self.TIMELOSS, 0.0)
+        scheduled = self.scheduledDeparts.get(vehID, depart)
+        row = [vehID, depart, origin, depart - scheduled, arrival,
+               laneEdge(data.get(self.LANE, '')), arrival - depart,
+               data.get(self.DISTANCE, 0.0), timeLoss, vType or
+               data.get(self.TYPE, '')]
+        if self.stopCounter is not None:
+            row.append(int(self.stopCounter.stopCountDict[vehID]))
+        else:
+            row.append(-1)
+        if self.emissionCounter is not None:
+            totals = self.emissionCounter.emissionCountDict[vehID]
+            row += [float(totals[e]) for e in self.emissionCounter.emissionList]
+        else:
+            row += [0.0]*6
+        for field, value in zip(self.FIELDS, row):
+            self.trips[field].append(value)
+
+    def writeTrips(self, filename):
+        # only completed trips, as tripinfo output. Written to a temporary
+        # file first so a killed run doesn't leave a truncated record
+        columns = {}
+        for field in self.FIELDS:
+            if field in ('id', 'origin', 'destination', 'vType'):
+                columns[field] = np.array([str(x) for x in self.trips[field]])
+            elif field == 'stops':
+                columns[field] = np.array(self.trips[field], dtype=int)
+            else:
+                columns[field] = np.array(self.trips[field], dtype=float)
+        tmpName = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmpName, 'wb') as f:
+            np.savez_compressed(f, **columns)
+        os.rename(tmpName, filename)
+
+
 class simTimer(object):
     def __init__(self):
         self.startTime = 0
@@ -551,6 +1553,67 @@ def isSimGridlocked(model, timeMS):
         return False
 
 
+class GridlockDetector(subscriptionUser):
+    # Gridlock from the shared vehicle subscription rather than per vehicle
+    # TraCI calls, cheap enough to check every simulated second. Gridlock
+    # is probable once at least stationaryFraction of the vehicles are
+    # stationary and some vehicle has waited waitLimit seconds, i.e. it
+    # has sat through every cycle, and that has held for holdTime seconds
+    def __init__(self, subscription=None, stationaryFraction=0.9,
+                 waitLimit=500.0, holdTime=300.0, minVehicles=10):
+        self.SPEED = tc.VAR_SPEED
+        self.WAIT = tc.VAR_WAITING_TIME
+        self.speedTol = 0.1
+        self.stationaryFraction = stationaryFraction
+        self.waitLimit = waitLimit
+        self.holdMS = int(1000*holdTime)
+        self.minVehicles = minVehicles
+        # latest counts and the time (ms) the gridlock condition started
+        self.Nvehicles = 0
+        self.Nstationary = 0
+        self.maxWait = 0.0
+        self.onsetTime = None
+        self.lastTime = None
+        self.setSubscription(subscription, (self.SPEED, self.WAIT))
+
+    def update(self, timeMS):
+        self.subResults = self.getSubscriptionResults()
+        self.lastTime = timeMS
+        if not self.subResults:
+            self.Nvehicles, self.Nstationary, self.maxWait = 0, 0, 0.0
+            self.onsetTime = None
+            return
+        # TraCI sends every subscribed vehicle each step, there is no change
+        # feed to keep counts from, so recount over arrays of the results
+        rows = [data for data in self.subResults.values()
+                if self.SPEED in data and self.WAIT in data]
+        speed = np.fromiter((data[self.SPEED] for data in rows),
+                            dtype=float, count=len(rows))
+        wait = np.fromiter((data[self.WAIT] for data in rows),
+                           dtype=float, count=len(rows))
+        self.Nvehicles = len(rows)
+        self.Nstationary = int(np.count_nonzero(speed < self.speedTol))
+        self.maxWait = float(wait.max()) if len(rows) else 0.0
+        if self.Nvehicles >= self.minVehicles and\
+           self.Nstationary >= self.stationaryFraction*self.Nvehicles and\
+           self.maxWait >= self.waitLimit:
+            if self.onsetTime is None:
+                self.onsetTime = timeMS
+        else:
+            self.onsetTime = None
+
+    def isGridlocked(self):
+        if self.onsetTime is None or\
+           self.lastTime - self.onsetTime < self.holdMS:
+            return False
+        print('GRIDLOCK: {}/{} vehicles stationary, max wait {:.0f}s, '
+              'since hour: {:.2f}'.format(self.Nstationary, self.Nvehicles,
+                                          self.maxWait,
+                                          self.onsetTime/3600000.0))
+        sys.stdout.flush()
+        return True
+
+
 def lane2edge(lanes):
     if type(lanes) is str:
         return unique([lanes.split('_')[0]])
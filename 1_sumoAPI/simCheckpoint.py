@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+@file    simCheckpoint.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Save and resume a running simulation. SUMO's state is written with
+traci.simulation.saveState and the python side (controllers, monitors,
+subscriptions) is pickled alongside it. The pickle is renamed into place
+last so an interrupted save leaves the previous checkpoint usable.
+
+Checkpointing needs SUMO >= 1.0.0 for saveState/loadState and the
+save-state.rng option, see checkSupport.
+"""
+import os
+import re
+from glob import glob
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import traci
+
+
+MIN_SUMO_VERSION = (1, 0, 0)
+
+
+def getSumoVersion(versionString):
+    # 'SUMO 1.2.0' or 'SUMO v0_30_0' -> (major, minor, patch), None if the
+    # string has no version in it
+    numbers = re.findall(r'\d+', versionString)
+    if len(numbers) < 3:
+        return None
+    return tuple(int(x) for x in numbers[:3])
+
+
+def checkSupport(serverVersion=None):
+    # call before writing a config with checkpointing, and with
+    # traci.getVersion()[1] once connected, as the SUMO binary can be older
+    # than the tools on the path. SUMO stops at start up on the unknown
+    # save-state.rng option otherwise
+    required = '.'.join(str(x) for x in MIN_SUMO_VERSION)
+    if not (hasattr(traci.simulation, 'saveState') and
+            hasattr(traci.simulation, 'loadState')):
+        raise RuntimeError('checkpointing needs SUMO >= {}, this TraCI has no '
+                           'saveState/loadState'.format(required))
+    if serverVersion is not None:
+        version = getSumoVersion(serverVersion)
+        if version is not None and version < MIN_SUMO_VERSION:
+            raise RuntimeError('checkpointing needs SUMO >= {}, connected to '
+                               '{}'.format(required, serverVersion))
+
+
+def getCheckpointFile(basePath):
+    return basePath + '.pkl'
+
+
+def saveCheckpoint(basePath, simTime, objects):
+    # objects: dict of everything needed to carry on, pickled together so
+    # references shared between controllers and monitors are kept
+    stateFile = '{}_{}.state.xml.gz'.format(basePath, simTime)
+    traci.simulation.saveState(stateFile)
+    # signal states set over TraCI aren't part of the tls program state
+    tlsStates = {tlID: traci.trafficlights.getRedYellowGreenState(tlID)
+                 for tlID in traci.trafficlights.getIDList()}
+    data = {'simTime': simTime, 'stateFile': stateFile,
+            'tlsStates': tlsStates, 'objects': objects}
+    checkpointFile = getCheckpointFile(basePath)
+    tmpName = checkpointFile + '.tmp'
+    with open(tmpName, 'wb') as f:
+        pickle.dump(data, f, 2)
+    os.rename(tmpName, checkpointFile)
+    # state files of older checkpoints are no longer referenced
+    for oldState in glob(basePath + '_*.state.xml.gz'):
+        if oldState != stateFile:
+            os.remove(oldState)
+
+
+def loadCheckpoint(basePath):
+    # returns (simTime, objects) of the latest checkpoint or None
+    checkpointFile = getCheckpointFile(basePath)
+    if not os.path.exists(checkpointFile):
+        return None
+    with open(checkpointFile, 'rb') as f:
+        data = pickle.load(f)
+    traci.simulation.loadState(data['stateFile'])
+    for tlID, stateString in data['tlsStates'].items():
+        traci.trafficlights.setRedYellowGreenState(tlID, stateString)
+    restoreSubscriptions(data['objects'])
+    return data['simTime'], data['objects']
+
+
+def restoreSubscriptions(objects):
+    # subscriptions aren't part of the SUMO state file, renew them for
+    # anything that made one
+    for obj in objects.values():
+        for item in (obj if isinstance(obj, list) else [obj]):
+            if hasattr(item, 'restoreSubscriptions'):
+                item.restoreSubscriptions()
+
+
+def removeCheckpoint(basePath):
+    for fileName in glob(basePath + '_*.state.xml.gz') +\
+      glob(getCheckpointFile(basePath) + '*'):
+        os.remove(fileName)
@@ -11,8 +11,14 @@ import traciLink, platform, subprocess, sys, traci
 
 class sumoConnect(object):
     
-    def __init__(self, pathToConfig, gui, port=8813):
+    def __init__(self, pathToConfig, gui, port=8813, backend=None):
         self.setPort(port)
+        # 'traci' (socket) or 'libsumo' (in process, no gui), the default
+        # is the backend traciLink registered from TRACI_BACKEND
+        self.backend = backend if backend is not None else traciLink.backend
+        if self.backend != traciLink.backend:
+            raise ValueError("backend %s requested but traciLink loaded %s, set TRACI_BACKEND"
+                             % (self.backend, traciLink.backend))
         programme = ""
         if gui:
             programme = "sumo-gui"
@@ -28,6 +34,11 @@ class sumoConnect(object):
         
     
     def launchSumoAndConnect(self):
+        if self.backend == 'libsumo':
+            # no process or socket, remote-port from the config is overridden
+            traci.start(["sumo", "-c", self.sumoConfig, "--remote-port", "0"])
+            self.isConnected = True
+            return
         try:
             sumoProcess = subprocess.Popen("%s -c %s" % (self.sumoBinary, self.sumoConfig), shell=True, stdout=sys.stdout)
             traci.init(self.Port)
@@ -23,3 +23,18 @@ try:
 except Exception:
     print("failed to import traci or sumolib library, please make sure these libraries are on your Python path.")
 
+# TRACI_BACKEND=libsumo runs SUMO in process through the libsumo bindings.
+# libsumo is registered as the traci module so the controllers' traci.*
+# calls go to it, this module must be imported before anything else
+# imports traci for that to take effect
+backend = os.environ.get('TRACI_BACKEND', 'traci')
+if backend == 'libsumo':
+    import traci.constants
+    import libsumo
+    # older traci domain name used throughout the controllers
+    if not hasattr(libsumo, 'trafficlights'):
+        libsumo.trafficlights = libsumo.trafficlight
+    libsumo.constants = traci.constants
+    sys.modules['traci'] = libsumo
+    traci = libsumo
+
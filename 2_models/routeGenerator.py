@@ -7,6 +7,10 @@ import shlex
 import re
 import multiprocessing as mp
 import time
+import os
+import sys
+sys.path.insert(0, '../1_sumoAPI')
+import demandTable
 
 
 def vehicleDistribution(cvp):
@@ -73,7 +77,12 @@ def vehicleDistribution(cvp):
 def makeRoutes(config):
     flowPrefix, run = config
     model = flowPrefix if 'selly' not in flowPrefix else 'sellyOak'
-    cvpRatios = np.linspace(0, 100, 21).astype(int)
+    # with runtimeCVP the simulation assigns connected vehicles itself, only
+    # the unconnected base file is needed, see signalTools.CVPAssigner
+    if runtimeCVP:
+        cvpRatios = []
+    else:
+        cvpRatios = np.linspace(0, 100, 21).astype(int)
 
     flowFile = './FLOWFILES/{}_flows.xml'.format(flowPrefix)
     routeFile = '/hardmem/ROUTEFILES/{}_R{:03d}.rou.xml'.format(flowPrefix,
@@ -93,20 +102,39 @@ def makeRoutes(config):
     with open(routeFile, 'r') as f:
         content = f.readlines()
 
+    # base file has the connected vTypes at zero probability for setType
+    baseFile = '/hardmem/ROUTEFILES/{}_R{:03d}_base.rou.xml'.format(flowPrefix,
+                                                                    run)
+    finalFiles = [(baseFile, 0)]
     for cvp in cvpRatios:
         finalFile = '/hardmem/ROUTEFILES/{}_R{:03d}_CVP{:03d}.rou.xml'\
             .format(flowPrefix, run, cvp)
+        finalFiles.append((finalFile, cvp))
+
+    content = [re.sub('<vehicle', '<vehicle type="vDist"', line)
+               for line in content]
+    for finalFile, cvp in finalFiles:
         with open(finalFile, 'w') as f:
             for line in content:
-                f.write(re.sub('<vehicle', '<vehicle type="vDist"', line))
+                f.write(line)
                 if '<routes' in line:
                     f.write(vehicleDistribution(cvp))
+        # binary table and vType file in place of the XML, see
+        # demandTable.demandLoader
+        if binaryDemand:
+            demandTable.buildDemandTable(finalFile)
+            os.remove(finalFile)
 
 # models = ['cross', 'simpleT', 'twinT', 'corridor',
 #           'sellyOak_avg', 'sellyOak_hi', 'sellyOak_lo']
 models = ['sellyOak_avg', 'sellyOak_hi', 'sellyOak_lo']
 models = ['simpleT']
 runs = 51
+# True writes one route file per seed for hpcSimulation's runtimeCVP mode,
+# the simulation defaults still read the _CVP### files
+runtimeCVP = False
+# write demand tables for hpcSimulation's binaryDemand mode
+binaryDemand = False
 configs = itertools.product(models, range(runs+1))
 nproc = 1
 print('Starting route building on {} cores'.format(nproc)+' '+time.ctime())
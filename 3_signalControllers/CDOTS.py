@@ -17,7 +17,7 @@ from math import atan2, degrees, ceil, hypot
 import numpy as np
 from collections import defaultdict
 import traci.constants as tc
-from cooperativeAwarenessMessage import CAMChannel
+from cooperativeAwarenessMessage import CAMChannel, VectorCAMChannel
 import cdots_utils as cutils
 
 
@@ -26,8 +26,15 @@ class CDOTS(signalControl.signalControl):
                  scanRange=250, loopIO=False, CAMoverride=False, model='simpleT',
                  PER=0., noise=False, pedStageActive=False,
                  activationArray=np.ones(7), weightArray=np.ones(7, dtype=float),
-                 sync=False, junctions=None, syncFactor=0.0, syncMode='NO'):
-        super(CDOTS, self).__init__()
+                 sync=False, junctions=None, syncFactor=0.0, syncMode='NO',
+                 vectorCAM=False, geometry=None, vectorUtility=False,
+                 partition=None, netIndex=None):
+        # geometry: networkGeometry cache, geometry read over TraCI if None
+        # partition: sigTools.JunctionPartition giving this junction's view
+        # of a network wide subscription, own context subscription if None
+        # netIndex: sigTools.networkIndex shared by the run's controllers,
+        # CAM channels and monitors
+        super(CDOTS, self).__init__(net=geometry, netIndex=netIndex)
         self.junctionData = junctionData
         self.setTransitionTime(self.junctionData.id)
         self.firstCalled = traci.simulation.getCurrentTime()
@@ -49,14 +56,15 @@ class CDOTS(signalControl.signalControl):
         self.stagesSinceLastCall = [0]*self.Nstages
         self.setModelName(model)
         self.scanRange = scanRange
-        self.jcnPosition = np.array(traci.junction.getPosition(self.junctionData.id))
+        self.jcnPosition = np.array(self.net.getJunctionPosition(self.junctionData.id))
         self.jcnCtrlRegion = self.getJncCtrlRegion()
         # self.laneNumDict = sigTools.getLaneNumbers()
-        self.controlledLanes = traci.trafficlights.getControlledLanes(self.junctionData.id)
+        self.controlledLanes = self.net.getControlledLanes(self.junctionData.id)
+        self.controlledLaneRows = self.netIndex.getLaneRows(self.controlledLanes)
         # dict[laneID] = {heading; float, shape:((x1,y1),(x2,y2))}
         # self.laneDetectionInfo = sigTools.getIncomingLaneInfo(self.controlledLanes)
-        self.allLaneInfo = sigTools.getIncomingLaneInfo(traci.lane.getIDList())
-        self.edgeLaneMap = sigTools.edgeLaneMap()
+        self.allLaneInfo = self.net.getLaneInfo()
+        self.edgeLaneMap = self.net.getEdgeLaneMap()
         self.stageTime = 0.0
         self.minGreenTime = 2*self.intergreen
         self.maxGreenTime = 10*self.intergreen
@@ -72,8 +80,8 @@ class CDOTS(signalControl.signalControl):
         self.stopCounter = None
         self.emissionCounter = None
 
-        lanes = [x for x in traci.lane.getIDList() if x[0] != ':']
-        speedLimDict = {lane: traci.lane.getMaxSpeed(lane) for lane in lanes}
+        lanes = [x for x in self.net.getLaneIDs() if x[0] != ':']
+        speedLimDict = {lane: self.net.getLaneMaxSpeed(lane) for lane in lanes}
         self.nearVehicleCatchDistanceDict =\
             {lane: 2.0*speedLimDict[lane] for lane in lanes}
         carLen = float(traci.vehicletype.getLength('car') +
@@ -87,7 +95,7 @@ class CDOTS(signalControl.signalControl):
             {lane: carLen/speedLimDict[lane] for lane in lanes}
 
         # Pedestrian parameters
-        self.pedTime = 1000 * sigTools.getJunctionDiameter(self.junctionData.id)/1.2
+        self.pedTime = 1000 * sigTools.getJunctionDiameter(self.junctionData.id, self.net)/1.2
         self.pedStage = False
         if 'selly' not in self.model:
             self.pedCtrlString = 'r'*len(self.junctionData.stages[self.currentStageIndex].controlString)
@@ -108,12 +116,17 @@ class CDOTS(signalControl.signalControl):
             self.getSyncRelations()
             self.sync = self.junctionData.id in self.syncDict.keys()
 
-        self.stageOptimiser = cutils.stageOptimiser(self,
-                                                    activationArray=activationArray,
-                                                    weightArray=weightArray,
-                                                    sync=self.sync,
-                                                    syncFactor=syncFactor,
-                                                    syncMode=syncMode)
+        # vectorUtility builds the utility matrix from per vehicle arrays
+        if vectorUtility:
+            optimiserModel = cutils.vectorStageOptimiser
+        else:
+            optimiserModel = cutils.stageOptimiser
+        self.stageOptimiser = optimiserModel(self,
+                                             activationArray=activationArray,
+                                             weightArray=weightArray,
+                                             sync=self.sync,
+                                             syncFactor=syncFactor,
+                                             syncMode=syncMode)
 
         # Rolling average stage length
         if 'selly' not in self.model:
@@ -125,18 +138,42 @@ class CDOTS(signalControl.signalControl):
             
         self.stageAvgIndexer = [0]*self.Nstages
 
-        # setup CAM channel
-        self.CAM = CAMChannel(self.jcnPosition, self.jcnCtrlRegion,
-                              scanRange=self.scanRange,
-                              CAMoverride=CAMoverride,
-                              PER=PER, noise=noise, CDOTS=True)
+        # setup CAM channel, vectorCAM uses the array backed channel
+        channelModel = VectorCAMChannel if vectorCAM else CAMChannel
+        self.CAM = channelModel(self.jcnPosition, self.jcnCtrlRegion,
+                                scanRange=self.scanRange,
+                                CAMoverride=CAMoverride,
+                                PER=PER, noise=noise, CDOTS=True,
+                                netIndex=self.netIndex)
+
+        self.partition = partition
+        self.junctionSubscription()
+
+        # lane -> vehicle index for oncoming vehicle lookups
+        self.laneIndex = sigTools.laneVehicleIndex()
+        self.targetLaneCache = {}
+
+        self.stageData = []
+        # CAM channel runs every step, decisions only when due
+        self.fastPath = True
 
+    def junctionSubscription(self):
         # subscribe to vehicle params
+        vehicleVars = (tc.VAR_POSITION, tc.VAR_ANGLE, tc.VAR_SPEED, tc.VAR_TYPE,
+                       tc.VAR_SIGNALS, tc.VAR_LANE_ID)
+        if self.partition is not None:
+            # GPS noise is added before the range check, widen the region
+            loopIDs = sigTools.unique(sigTools.flatten(
+                self.laneInductors.values())) if self.loopIO else ()
+            self.partition.addJunction(self.junctionData.id, self.jcnPosition,
+                                       self.jcnCtrlRegion, self.scanRange,
+                                       vehicleVars, loopIDs=loopIDs,
+                                       margin=10.0 if self.CAM.noise else 0.0)
+            return
         traci.junction.subscribeContext(self.junctionData.id, 
             tc.CMD_GET_VEHICLE_VARIABLE, 
             self.scanRange, 
-            varIDs=(tc.VAR_POSITION, tc.VAR_ANGLE, tc.VAR_SPEED, tc.VAR_TYPE,
-                    tc.VAR_SIGNALS, tc.VAR_LANE_ID))
+            varIDs=vehicleVars)
 
         # only subscribe to loop params if necessary
         if self.loopIO:
@@ -145,15 +182,39 @@ class CDOTS(signalControl.signalControl):
                 250, 
                 varIDs=(tc.LAST_STEP_TIME_SINCE_DETECTION,))
 
-        self.stageData = []
+    def restoreSubscriptions(self):
+        super(CDOTS, self).restoreSubscriptions()
+        # a partition is restored with the simulation's other subscriptions
+        if self.partition is None:
+            self.junctionSubscription()
 
-    def process(self, time=None, stopCounter=None, emissionCounter=None):
+    def getNextWakeup(self, simTime):
+        # process() is needed every step inside the extension window and
+        # otherwise only for the first step of a stage, the 2.7 s queue
+        # cancellation checks, transition thresholds and the stage end
+        if self.pedStage:
+            wakeups = [self.lastCalled + self.pedTime]
+        else:
+            # stageTime as clamped at the start of process()
+            stageTime = min(max(self.minGreenTime, self.stageTime),
+                            self.maxGreenTime)
+            windowStart = self.lastCalled + (stageTime - 5.0)*1000
+            if windowStart <= simTime:
+                return simTime
+            Nchecks = (simTime - self.lastCalled)//2700 + 1
+            wakeups = [windowStart,
+                       self.lastCalled + Nchecks*2700,
+                       self.lastCalled + stageTime*1000]
+            if self.lastCalled + self.stepMS > simTime:
+                wakeups.append(self.lastCalled + self.stepMS)
+        if self.transitionObject.active:
+            wakeups.append(self.transitionObject.getNextWakeup(simTime))
+        return min(wakeups)
+
+    def fastProcess(self, time=None):
+        # per step work, kept up to date on steps controllerScheduler skips
         self.TIME_MS = time if time is not None else self.getCurrentSUMOtime()
         self.TIME_SEC = 0.001 * self.TIME_MS
-        self.stageTime = max(self.minGreenTime, self.stageTime)
-        self.stageTime = min(self.stageTime, self.maxGreenTime)
-        self.stopCounter = stopCounter
-        self.emissionCounter = emissionCounter
 
         # Packets sent on this step
         # packet delay + only get packets towards the end of the second
@@ -166,8 +227,15 @@ class CDOTS(signalControl.signalControl):
         # Update stage decisions
         # If there's no ITS enabled vehicles present use VA ctrl
         self.numCAVs = len(self.CAM.receiveData)
-        isControlInterval = not self.TIME_MS % 1000
         self.elapsedTime = self.getElapsedTime()
+
+    def process(self, time=None, stopCounter=None, emissionCounter=None):
+        self.fastProcess(time)
+        self.stageTime = max(self.minGreenTime, self.stageTime)
+        self.stageTime = min(self.stageTime, self.maxGreenTime)
+        self.stopCounter = stopCounter
+        self.emissionCounter = emissionCounter
+        isControlInterval = not self.TIME_MS % 1000
         Tremaining = self.stageTime - self.elapsedTime
         if self.pedStage:
             pass  # no calculations needed for ped stage
@@ -205,7 +273,7 @@ class CDOTS(signalControl.signalControl):
                 updateTime = max(0.0, fixedTime-self.elapsedTime)
             self.updateStageTime(updateTime)
         # If we've just changed stage get the queuing information
-        elif self.elapsedTime <= 0.11 and self.numCAVs > 0:
+        elif self.elapsedTime <= self.stepLength + 0.01 and self.numCAVs > 0:
             try:
                 queueExtend = self.getQueueExtension()
                 self.updateStageTime(queueExtend)
@@ -214,7 +282,8 @@ class CDOTS(signalControl.signalControl):
             # print(self.junctionData.id, self.stageTime)
         # run GPS extend only to check if queue cancelation needed
         elif self.elapsedTime > self.minGreenTime\
-          and np.isclose(self.elapsedTime%2.7, 0., atol=0.05) and self.numCAVs > 0:
+          and self.crossedCheckTime()\
+          and self.numCAVs > 0:
             # print('checking')
             gpsExtend = self.getCVextension()
         # process stage as normal
@@ -296,7 +365,10 @@ class CDOTS(signalControl.signalControl):
         super(CDOTS, self).process(self.TIME_MS)
 
     def getSubscriptionResults(self):
-        self.subResults = traci.junction.getContextSubscriptionResults(self.junctionData.id)
+        if self.partition is not None:
+            self.subResults = self.partition.getView(self.junctionData.id)
+        else:
+            self.subResults = traci.junction.getContextSubscriptionResults(self.junctionData.id)
 
     def updateStageTime(self, updateTime):
         # update time is the seconds to add
@@ -325,10 +397,16 @@ class CDOTS(signalControl.signalControl):
     def getElapsedTime(self):
         return 0.001*(self.TIME_MS - self.lastCalled)
 
+    def crossedCheckTime(self):
+        # True on the first step at or past each 2.7 s of the stage, any
+        # step length, in integer ms like the 2700 ms wakeups
+        elapsedMS = self.TIME_MS - self.lastCalled
+        return elapsedMS//2700 > (elapsedMS - self.stepMS)//2700
+
     def getJncCtrlRegion(self):
-        jncPosition = traci.junction.getPosition(self.junctionData.id)
-        otherJuncPos = [traci.junction.getPosition(x)\
-                        for x in traci.trafficlights.getIDList()\
+        jncPosition = self.net.getJunctionPosition(self.junctionData.id)
+        otherJuncPos = [self.net.getJunctionPosition(x)\
+                        for x in self.net.getTLIDs()\
                         if x != self.junctionData.id]
         ctrlRegion = {'N':jncPosition[1] + self.scanRange,
                       'S':jncPosition[1] - self.scanRange, 
@@ -357,6 +435,37 @@ class CDOTS(signalControl.signalControl):
         return ctrlRegion
 
     def getOncomingVehicles(self, headingTol=15, stageIndexOverride=None):
+        # Oncoming if (in active lane & heading matches oncoming heading)
+        # uses the lane index so only vehicles in the target lanes are checked
+        targetLanes, headingBounds = self.getTargetLanes(headingTol,
+                                                         stageIndexOverride)
+        return self.laneIndex.getOncomingVehicles(self.CAM.receiveData,
+                                                  targetLanes, headingBounds)
+
+    def getTargetLanes(self, headingTol=15, stageIndexOverride=None):
+        # target lanes and their heading bounds, cached per set of edges
+        activeEdges = tuple(sorted(self.getActiveEdges(
+            stageIndexOverride=stageIndexOverride)))
+        try:
+            return self.targetLaneCache[activeEdges, headingTol]
+        except KeyError:
+            pass
+        targetLanes = []
+        for edges in activeEdges:
+            for edge in self.controlledEdges[edges]:
+                targetLanes += self.edgeLaneMap[edge]
+        targetLanes = set(targetLanes)
+        headingBounds = []
+        for lane in targetLanes:
+            laneHeading = self.allLaneInfo[lane]['heading']
+            headingBounds.append((laneHeading - headingTol,
+                                  laneHeading + headingTol))
+        self.targetLaneCache[activeEdges, headingTol] = (targetLanes,
+                                                         headingBounds)
+        return targetLanes, headingBounds
+
+    def getOncomingVehiclesNested(self, headingTol=15, stageIndexOverride=None):
+        # Original O(lanes x vehicles) lookup, kept for benchmarking
         # Oncoming if (in active lane & heading matches oncoming heading & 
         # is in lane bounds)
         vehicles = []
@@ -385,7 +494,7 @@ class CDOTS(signalControl.signalControl):
         return sigTools.unique(vehicles)
 
     def getActiveEdges(self, stageIndexOverride=None):
-        return sigTools.lane2edge(self.getActiveLanes(stageIndexOverride=stageIndexOverride))
+        return self.netIndex.lane2edge(self.getActiveLanes(stageIndexOverride=stageIndexOverride))
 
     def getActiveLanes(self, stageIndexOverride=None):
         # Get the current control string to find the green lights
@@ -433,17 +542,16 @@ class CDOTS(signalControl.signalControl):
         return activeLanesDict
 
     def getLanesFromString(self, ctrlString):
-        activeLanes = []
-        for i, letter in enumerate(ctrlString):
-            if letter == 'G' and self.controlledLanes[i] not in activeLanes:
-                activeLanes.append(self.controlledLanes[i])
-        return activeLanes
+        # lanes of the green links, unique in link order
+        green = [i for i, letter in enumerate(ctrlString) if letter == 'G']
+        laneRows = sigTools.uniqueRows(self.controlledLaneRows[green])
+        return self.netIndex.lanes.getIDs(laneRows)
 
     def getLaneInductors(self):
         laneInductors = defaultdict(list)
 
-        for loop in traci.inductionloop.getIDList():
-            loopLane = traci.inductionloop.getLaneID(loop)
+        for loop in self.net.getLoopIDs():
+            loopLane = self.net.getLoopLane(loop)
             if loopLane in self.controlledLanes:
                 laneInductors[loopLane].append(loop)
             
@@ -481,7 +589,7 @@ class CDOTS(signalControl.signalControl):
         detectTimePerLane = []
         retrievedEdges = []
         flowConst = tc.LAST_STEP_TIME_SINCE_DETECTION
-        edges = sigTools.unique([lane.split('_')[0] for lane in activeLanes])
+        edges = self.netIndex.lane2edge(activeLanes)
         for edge in edges:
             detectTimes = []
             for loop in self.laneInductors[edge]:
@@ -492,7 +600,7 @@ class CDOTS(signalControl.signalControl):
 
     def getInductorMap(self):
         otherJunctionLanes = []
-        juncIDs = traci.trafficlights.getIDList()
+        juncIDs = self.net.getTLIDs()
         for junc in juncIDs:
             if junc != self.junctionData.id:
                 lanes = self.getLanes(junc)
@@ -500,7 +608,7 @@ class CDOTS(signalControl.signalControl):
         links = self.getLanes(self.junctionData.id)
         self.linkRelation = defaultdict(list)
         ctrlEdges = {}
-        routes = sigTools.getRouteDict()[self.modelName]
+        routes = self.net.getRoutes(self.modelName)
         for lane in links['incoming']:
             laneHeading = self.allLaneInfo[lane+'_0']['heading']
             lanesBefore = []
@@ -518,7 +626,7 @@ class CDOTS(signalControl.signalControl):
                 for edgeIdx in list(range(rIndex-1, -1, -1))[:3]:
                     if route[edgeIdx] not in otherJunctionLanes:
                         lanesBefore.append(route[edgeIdx])
-                        shape = traci.lane.getShape(route[edgeIdx]+'_0')
+                        shape = self.net.getLaneShape(route[edgeIdx]+'_0')
                         heading = sigTools.getSUMOHeading(shape[-1], shape[0])
                         if laneHeading-20 < heading < laneHeading+20: 
                             ctrlLanes.append(route[edgeIdx])
@@ -537,11 +645,11 @@ class CDOTS(signalControl.signalControl):
             ctrlEdges[lane] = sigTools.unique(ctrlLanes+[lane])
 
         loopRelation = {}
-        loopIDs = traci.inductionloop.getIDList()
+        loopIDs = self.net.getLoopIDs()
         loopLanes = defaultdict(list)
         for loop in loopIDs:
-            edge = traci.inductionloop.getLaneID(loop).split('_')[0]
-            edgeShapes = traci.lane.getShape(edge+'_0')
+            edge = self.net.getLoopLane(loop).split('_')[0]
+            edgeShapes = self.net.getLaneShape(edge+'_0')
             distFromJunc = max([sigTools.getDistance(x, self.jcnPosition)\
                                 for x in edgeShapes])
             if distFromJunc < 200:
@@ -559,7 +667,7 @@ class CDOTS(signalControl.signalControl):
         return ctrlEdges, loopRelation
 
     def getLanes(self, junctionID):
-        links = traci.trafficlights.getControlledLinks(junctionID)
+        links = self.net.getControlledLinks(junctionID)
         incomingLanes = [x[0][0] for x in links]
         outgoingLanes = [x[0][1] for x in links]
         incomingLanes = [x.split('_')[0] for x in incomingLanes]
@@ -717,6 +825,7 @@ class CDOTS(signalControl.signalControl):
         for j in junctions:
             if j.junctionData.id in self.syncDict[self.junctionData.id]:
                 self.syncJuncs[j.junctionData.id] = j
+        self.stageOptimiser.compileSyncRelations()
 
     def getSyncRelations(self):
         # Stages from coordinating junction the stage at this junction
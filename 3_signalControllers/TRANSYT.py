@@ -85,6 +85,17 @@ class TRANSYT(signalControl.signalControl):
         super(TRANSYT, self).process(self.TIME_MS)
         return None
 
+    def getNextWakeup(self, simTime):
+        # only transition thresholds and stage/ped stage ends need process()
+        if self.transitionObject.active:
+            return self.transitionObject.getNextWakeup(simTime)
+        elif (self.TIME_MS - self.firstCalled) < (self.junctionData.offset*1000):
+            return self.firstCalled + self.junctionData.offset*1000
+        elif self.pedStage:
+            return self.lastCalled + self.pedTime
+        else:
+            return self.lastCalled + self.junctionData.stages[self.mode][self.lastStageIndex].period*1000
+
     def getTimeToSignalChange(self):
         return (self.junctionData.stages[self.getMode()][self.lastStageIndex].period*1000 - 
             (self.TIME_MS - self.lastCalled))
@@ -12,9 +12,13 @@ from math import atan2, degrees, ceil, hypot
 import numpy as np
 from collections import defaultdict
 import traci.constants as tc
-from cooperativeAwarenessMessage import CAMChannel
+from cooperativeAwarenessMessage import CAMChannel, camView
 import traceback
 
+# column of a sync relation's direction in the turn count arrays, 3 is an
+# unknown direction that never syncs
+SYNC_DIRECTIONS = {'D': 0, 'L': 1, 'R': 2}
+
 
 class stageOptimiser():
     def __init__(self, signalController, activationArray=np.ones(7),
@@ -228,35 +232,39 @@ class stageOptimiser():
         else:
             return self.RNG.randint(1, maxOccupancy)
 
+    def getVehiclePassengers(self, vehID):
+        # passengers are drawn once per vehicle and remembered
+        try:
+            return self.occupancyDict[vehID]
+        except KeyError:
+            vType = self.sigCtrl.emissionCounter.vTypeDict[vehID]
+            if 'car' in vType:
+                Npassengers = self.getCarPassengers()
+            elif 'lgv' in vType:
+                Npassengers = 1 
+            elif 'hgv' in vType:
+                Npassengers = 1 
+            elif 'motorcycle' in vType:
+                Npassengers = 1 
+            elif 'bus' in vType:
+                isDblDecker = self.RNG.rand() <= self.P_dblDeckBus
+                if isDblDecker:
+                    Npassengers = self.getBusPassengers(self.dblDeckPaxMax)
+                else:
+                    Npassengers = self.getBusPassengers(self.sglDeckPaxMax)
+            else:
+                Npassengers = 1 
+
+            self.occupancyDict[vehID] = Npassengers
+            return Npassengers
+
     def getTotalPassengers(self):
         totalPassengers = []
         for vehicleSet in self.vehiclesPerStage:
             paxCount = 0 if len(vehicleSet) else -1
             # vehicle set is empty for active lane so wont process
             for vehID in vehicleSet:
-                try:
-                    paxCount += self.occupancyDict[vehID]
-                except KeyError:
-                    vType = self.sigCtrl.emissionCounter.vTypeDict[vehID]
-                    if 'car' in vType:
-                        Npassengers = self.getCarPassengers()
-                    elif 'lgv' in vType:
-                        Npassengers = 1 
-                    elif 'hgv' in vType:
-                        Npassengers = 1 
-                    elif 'motorcycle' in vType:
-                        Npassengers = 1 
-                    elif 'bus' in vType:
-                        isDblDecker = self.RNG.rand() <= self.P_dblDeckBus
-                        if isDblDecker:
-                            Npassengers = self.getBusPassengers(self.dblDeckPaxMax)
-                        else:
-                            Npassengers = self.getBusPassengers(self.sglDeckPaxMax)
-                    else:
-                        Npassengers = 1 
-
-                    paxCount += Npassengers
-                    self.occupancyDict[vehID] = Npassengers
+                paxCount += self.getVehiclePassengers(vehID)
             totalPassengers.append(paxCount)
         return np.array(totalPassengers)
 
@@ -380,7 +388,7 @@ class stageOptimiser():
         qLenMaxDict = defaultdict(float)
         for edge in self.sigCtrl.controlledEdges.keys():
             for lane in self.sigCtrl.controlledEdges[edge]:
-                qLenMaxDict[edge] += traci.lane.getLength(lane+'_0')
+                qLenMaxDict[edge] += self.sigCtrl.net.getLaneLength(lane+'_0')
         return qLenMaxDict 
 
     def getSpeedCost(self):
@@ -468,77 +476,112 @@ class stageOptimiser():
         else:
             return 0
 
+    def compileSyncRelations(self):
+        # Sync relations as integer index arrays, built from the string
+        # relations once when junctions are coupled rather than parsed at
+        # every decision. Tables are per adjacent junction and per mode, as
+        # the stage order changes with mode. The string matching is the
+        # same as it was done at run time
+        self.syncTables = {}
+        self.turnCountSource = None
+
+    def getSyncRows(self, syncRels, sourceStr, targetOfRel):
+        # (target stage index, source stage ID, direction) of every relation
+        # whose source stage string contains sourceStr. -1 targets are stage
+        # IDs missing from the current mode
+        stageIDMap = self.getStageIDMap()
+        target, source, direction = [], [], []
+        for snkStage, coordStages in syncRels.items():
+            snkStageID = snkStage.split('_')[-1]
+            for srcStage in coordStages:
+                if sourceStr not in srcStage:
+                    continue
+                srcStageID, dirStr = srcStage.split('_')[1:]
+                stageID = snkStageID if targetOfRel else srcStageID
+                target.append(stageIDMap.get(stageID, -1))
+                source.append(int(srcStageID))
+                direction.append(SYNC_DIRECTIONS.get(dirStr, 3))
+        return (np.array(target, dtype=int), np.array(source, dtype=int),
+                np.array(direction, dtype=int))
+
+    def getSyncTable(self, adjJunc, adjStageID=None):
+        # adjStageID given: stages here receiving from the adjacent
+        # junction's stage, otherwise stages here sending to it
+        if not hasattr(self, 'syncTables'):
+            self.compileSyncRelations()
+        key = (self.sigCtrl.mode, adjJunc.junctionData.id, adjStageID)
+        if key not in self.syncTables:
+            if adjStageID is not None:
+                # SRC: ADJ JUNC | SNK: THIS JUNC
+                self.syncTables[key] = self.getSyncRows(
+                    self.sigCtrl.syncRels, adjStageID, True)
+            else:
+                # SRC: THIS JUNC | SNK: ADJ JUNC
+                self.syncTables[key] = self.getSyncRows(
+                    adjJunc.syncRels, self.sigCtrl.junctionData.id, False)
+        return self.syncTables[key]
+
+    def getTurnCountArray(self):
+        # (Nstages, [DIRECT, LEFT, RIGHT]) counts, published once per step
+        # and reused by every junction syncing with this one
+        if not hasattr(self, 'vehiclesPerStage'):
+            self.getVehiclesPerStage()
+        source = (self.sigCtrl.TIME_MS, self.vehiclesPerStage,
+                  self.sigCtrl.CAM.receiveData)
+        last = getattr(self, 'turnCountSource', None)
+        if last is None or source[0] != last[0] or\
+           source[1] is not last[1] or source[2] is not last[2]:
+            turnCounts = self.getTurnCounts()
+            self.turnCountArray = np.array(
+                [[t['DIRECT'], t['LEFT'], t['RIGHT']] for t in turnCounts],
+                dtype=int).reshape(-1, 3)
+            self.turnCountSource = source
+        return self.turnCountArray
+
+    def getSyncGather(self, table, turnCounts):
+        # turnCountFilter for every relation at once, max per target stage
+        target, source, direction = table
+        syncVector = np.zeros(self.Nstages, dtype=int)
+        if not len(target):
+            return syncVector
+        if (target < 0).any():
+            raise KeyError('sync stage not in mode {}'.format(self.sigCtrl.mode))
+        modeWeights = self.syncModeWeights[self.syncMode]
+        filterWeights = np.array([modeWeights[0], modeWeights[1],
+                                  modeWeights[1], 0.0])
+        moving = turnCounts[source, np.minimum(direction, 2)] > 0
+        values = np.where(moving, filterWeights[direction], 0.0)
+        # int as the per relation assignment into the int vector was
+        syncFloat = np.zeros(self.Nstages)
+        np.maximum.at(syncFloat, target, values)
+        return syncFloat.astype(int)
+
     def getSyncVector(self):
         try:
-            # Map stage ID to the current sequence
-            stageIDMap = self.getStageIDMap()
             # Need to calculate sync vector every time as stage order may change
             # Type must be into for bitwise OR later on
             self.syncVector = np.zeros(self.Nstages, dtype=int)
             # for every junction ID and object in the dict of junctions we sync with
             for adjID, adjJunc in self.sigCtrl.syncJuncs.items():
-                syncVector = np.zeros(self.Nstages, dtype=int)
                 # Get the junction ID appended with the ID of the current stage
                 # from the junction to sync with
-                adjStageID = adjJunc.getSyncString()
-                adjStageIDint = int(adjStageID.split('_')[-1])
+                adjStageIDint = int(adjJunc.getStageID())
                 # If the target junction is less than halfway through its max
                 # stage then its less likely to change so receive vehicles
                 stageCutoff = 0.5*adjJunc.getAvgStageTime()[adjStageIDint]
                 if adjJunc.elapsedTime <= stageCutoff:
-                    turnCounts = adjJunc.stageOptimiser.getTurnCounts()
-                    # get the sync relationships from the SOURCE to the SINK
-                    # SRC: ADJ JUNC | SNK: THIS JUNC
-                    for snkStage, coordStages in self.sigCtrl.syncRels.items():
-                        snkStageID = snkStage.split('_')[-1]
-                        snkStageIDint = int(snkStageID)
-                        # check if we have stages in the adjacent junctions
-                        # sync strings
-                        for srcStage in coordStages:
-                            # If this junction present in the target stages sync strings
-                            # only sync if its the surrent stage of the adj junc
-                            if adjStageID not in srcStage:
-                                continue
-                            # get the stage id and flow direction for the stages
-                            # that will send vehicles to the adjacent junction
-                            srcStageID, direction = srcStage.split('_')[1:]
-                            turns = turnCounts[int(srcStageID)]
-                            # Only sync if there are vehicles travelling ato
-                            # this junction from the sync stage
-                            # turns = {'DIRECT':1,'LEFT':1, 'RIGHT':1}
-                            syncVector[stageIDMap[snkStageID]] =\
-                                max(syncVector[stageIDMap[snkStageID]],
-                                    self.turnCountFilter(direction, turns))
+                    table = self.getSyncTable(adjJunc, adjJunc.getSyncString())
+                    turnCounts = adjJunc.stageOptimiser.getTurnCountArray()
                 # The target junction is over halfway through its stage so is 
                 # likely to change soon. Therefore send it vehicles
                 else:
-                    # As we're sending vehicles, get this junctions turn counts
-                    turnCounts = self.sigCtrl.stageOptimiser.getTurnCounts()
-                    # get the sync relationships for the adjacent junction
-                    # SRC: THIS JUNC | SNK: ADJ JUNC
-                    for snkStage, coordStages in adjJunc.syncRels.items():
-                        # check if we have stages in the adjacent junctions
-                        # sync strings i.e. stage we can send vehicles to
-                        for srcStage in coordStages:
-                            # If this junction present in the target stages' sync strings
-                            if self.sigCtrl.junctionData.id not in srcStage:
-                                continue
-                            # get the stage id and flow direction for the stages
-                            # that will send vehicles to the adjacent junction
-                            srcStageID, direction = srcStage.split('_')[1:]
-                            turns = turnCounts[int(srcStageID)]
-                            # Only sync if there are vehiles travelling along the
-                            # sync path
-                            # turns = {'DIRECT':1,'LEFT':1, 'RIGHT':1}
-                            syncVector[stageIDMap[srcStageID]] =\
-                                max(syncVector[stageIDMap[srcStageID]],
-                                    self.turnCountFilter(direction, turns))
+                    table = self.getSyncTable(adjJunc)
+                    turnCounts = self.getTurnCountArray()
                 # bitwise or the stage vectors to capture all syncing stages
                 # need np.maximum to do max along array
-                self.syncVector = np.maximum(self.syncVector, syncVector)
-                # if self.sigCtrl.junctionData.id == 'junc3':
-                #     print(self.syncVector, adjJunc.elapsedTime <= stageCutoff,
-                #           self.sigCtrl.mode)
+                self.syncVector = np.maximum(self.syncVector,
+                                             self.getSyncGather(table,
+                                                                turnCounts))
         except Exception as e:
             self.syncVector = np.zeros(self.Nstages)
             print(self.sigCtrl.junctionData.id, str(e))
@@ -569,3 +612,94 @@ class stageOptimiser():
                     pass # print('No vehID: ', vehID)
             turnCounts.append(turnDict)
         return turnCounts
+
+
+class vectorStageOptimiser(stageOptimiser):
+    # stageOptimiser with the utility matrix built from per vehicle arrays.
+    # The vehicles of all stages are gathered once per decision and each cost
+    # row is a bincount/maximum over the stage labels, passenger draws are
+    # kept per vehicle so the RNG stream matches stageOptimiser
+    def getStageMembership(self):
+        # flat list of oncoming vehicles and the stage index of each one
+        vehIDs = []
+        stageSizes = []
+        for vehicleSet in self.vehiclesPerStage:
+            vehIDs.extend(vehicleSet)
+            stageSizes.append(len(vehicleSet))
+        stageOf = np.repeat(np.arange(self.Nstages), stageSizes)
+        return vehIDs, stageOf, np.array(stageSizes)
+
+    def getCAMArrays(self, vehIDs):
+        # coords, speed and turning status (either blinker) of each vehicle
+        receiveData = self.sigCtrl.CAM.receiveData
+        if isinstance(receiveData, camView):
+            rowDict = receiveData.vehIndex.rowDict
+            rows = np.fromiter((rowDict[v] for v in vehIDs),
+                               dtype=np.intp, count=len(vehIDs))
+            records = receiveData.state[receiveData.lookup[rows]]
+            coords = np.column_stack((records['x'], records['y']))
+            # bit 0 BLINKER_RIGHT, bit 1 BLINKER_LEFT
+            turning = (records['signal'].astype(int) & 3) > 0
+            return coords, records['speed'].astype(float), turning
+        coords = np.zeros((len(vehIDs), 2))
+        speed = np.zeros(len(vehIDs))
+        turning = np.zeros(len(vehIDs), dtype=bool)
+        for i, vehID in enumerate(vehIDs):
+            vData = receiveData[vehID]
+            coords[i] = vData['coords']
+            speed[i] = vData['speed']
+            signal = vData['signal']
+            turning[i] = bool(signal['BLINKER_LEFT'] or signal['BLINKER_RIGHT'])
+        return coords, speed, turning
+
+    def getStopArrays(self, vehIDs):
+        # stop counts and waiting times from the stop counter
+        stopCounter = self.sigCtrl.stopCounter
+        stopCountDict = stopCounter.stopCountDict
+        Nstops = np.fromiter((stopCountDict[v] for v in vehIDs),
+                             dtype=float, count=len(vehIDs))
+        subResults = stopCounter.subResults
+        waitConst = tc.VAR_WAITING_TIME
+        waitTime = np.fromiter((subResults[v][waitConst] for v in vehIDs),
+                               dtype=float, count=len(vehIDs))
+        return Nstops, waitTime
+
+    def stageTotal(self, values, stageOf, empty):
+        # sum per stage, -1 for stages with no vehicles
+        total = np.bincount(stageOf, weights=values, minlength=self.Nstages)
+        total[empty] = -1
+        return total
+
+    def getUtilityMatrix(self):
+        self.getVehiclesPerStage()
+        vehIDs, stageOf, stageSizes = self.getStageMembership()
+        empty = stageSizes == 0
+        NumVehicles = np.where(empty, -1, stageSizes).astype(float)
+        absNumVehicles = np.abs(NumVehicles)
+
+        Nstops, waitTime = self.getStopArrays(vehIDs)
+        passengers = np.fromiter((self.getVehiclePassengers(v) for v in vehIDs),
+                                 dtype=float, count=len(vehIDs))
+        coords, speed, turning = self.getCAMArrays(vehIDs)
+
+        # furthest halted vehicle per stage, sumo halts at v < 0.01 m/s
+        queueLength = -np.ones(self.Nstages)
+        halted = speed < 0.01
+        if halted.any():
+            distance = np.hypot(coords[halted, 0] - self.sigCtrl.jcnPosition[0],
+                                coords[halted, 1] - self.sigCtrl.jcnPosition[1])
+            np.maximum.at(queueLength, stageOf[halted], distance)
+        queueLength[self.sigCtrl.currentStageIndex] = -1
+
+        Nturning = np.bincount(stageOf, weights=turning.astype(float),
+                               minlength=self.Nstages)
+        notTurningRatio = np.where(empty, -1, 1.0 - Nturning/absNumVehicles)
+
+        costMatrix = [self.getTimeSinceLastGreen(),
+                      NumVehicles,
+                      self.stageTotal(passengers, stageOf, empty),
+                      self.stageTotal(Nstops, stageOf, empty)/absNumVehicles,
+                      self.stageTotal(waitTime, stageOf, empty)/absNumVehicles,
+                      queueLength/self.queueNormFactors,
+                      notTurningRatio]
+        return np.array(costMatrix)
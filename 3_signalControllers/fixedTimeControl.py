@@ -46,6 +46,15 @@ class fixedTimeControl(signalControl.signalControl):
         super(fixedTimeControl, self).process(self.currentTime)
         return None
 
+    def getNextWakeup(self, simTime):
+        # only transition thresholds and stage ends need process()
+        if self.transitionObject.active:
+            return self.transitionObject.getNextWakeup(simTime)
+        elif (self.currentTime - self.firstCalled) < (self.junctionData.offset*1000):
+            return self.firstCalled + self.junctionData.offset*1000
+        else:
+            return self.lastCalled + self.junctionData.stages[self.lastStageIndex].period*1000
+
     def getTimeToSignalChange(self):
         return (self.junctionData.stages[self.lastStageIndex].period*1000 - 
             (self.currentTime - self.lastCalled))
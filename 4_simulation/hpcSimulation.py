@@ -4,7 +4,7 @@ import os
 import shutil
 import socket
 import time
-from sumoConfigGen import sumoConfigGen
+from sumoConfigGen import sumoConfigGen, getRouteFile
 sys.path.insert(0, '../1_sumoAPI')
 import sumoConnect
 import readJunctionData
@@ -15,11 +15,21 @@ import HybridVAControl
 import CDOTS
 import traci
 import signalTools as sigTools
+import networkGeometry
+import signalControl
+import simCheckpoint
+import demandTable
 import traceback
 import numpy as np
 
 def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
-               routeTracking=False):
+               routeTracking=False, columnarMonitors=False, vectorCAM=False,
+               geometryCache=False, vectorUtility=False, batchCommands=False,
+               checkpointInterval=0, stepSize=0.1, eventScheduling=False,
+               junctionViews=False, tripRecording=False, spillMonitors=False,
+               internIDs=False, runtimeCVP=False, binaryDemand=False,
+               gridlockDetection=False):
+    runComplete = False
     try:
         timer = sigTools.simTimer()
         timer.start()
@@ -38,7 +48,6 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         model = '../2_models/{}_{}_{}/'.format(modelBase, hostname, procID)
         simport = 8812 + procID
         seed = int(run)
-        stepSize = 0.1
         configFile = model + modelBase + ".sumocfg"
 
         print('STARTING: {}, {}, Run: {:03d}, CVP: {:03d}%, Ped: {}, Date: {}'
@@ -83,14 +92,30 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
             except:
                 time.sleep(1)  # sleep to make sure folder created
 
+        # vehicles streamed in over TraCI from the binary demand table
+        # instead of SUMO reading the route file
+        if binaryDemand:
+            demandFiles = demandTable.getDemandFiles(
+                getRouteFile(modelName, seed, CVP, runtimeCVP))
+        else:
+            demandFiles = None
+
+        # checkpoints need SUMO >= 1.0.0, fail clearly before SUMO would
+        # stop on the save-state.rng option
+        if checkpointInterval:
+            simCheckpoint.checkSupport()
+
         # Edit the the output filenames in sumoConfig
         sumoConfigGen(modelName, configFile, exportPath, 
               CVP=CVP, stepSize=stepSize, 
-              run=seed, port=simport, seed=seed)
+              run=seed, port=simport, seed=seed, runtimeCVP=runtimeCVP,
+              demandFiles=demandFiles, checkpointing=bool(checkpointInterval))
 
         # Connect to model
         connector = sumoConnect.sumoConnect(configFile, gui=GUIbool, port=simport)
         connector.launchSumoAndConnect()
+        if checkpointInterval:
+            simCheckpoint.checkSupport(traci.getVersion()[1])
 
         # Get junction data
         if 'selly' in model:
@@ -101,6 +126,29 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         jd = readJunctionData.readJunctionData(junctionFile)
         junctionsList = jd.getJunctionData()
 
+        # Static network geometry shared by all controllers, built offline
+        # with sumolib and cached per net file instead of queried over TraCI
+        if geometryCache:
+            geometry = networkGeometry.loadNetworkGeometry(model, modelBase)
+        else:
+            geometry = None
+
+        # integer lane/edge/vehicle IDs shared by the controllers, their CAM
+        # channels and the columnar monitors
+        if internIDs:
+            netIndex = sigTools.networkIndex(geometry)
+        else:
+            netIndex = None
+
+        # one network wide vehicle subscription shared by all the monitors
+        vehicleSubscription = sigTools.NetworkSubscription()
+        # adaptive controllers read their region from the same subscription
+        # instead of each making an overlapping junction subscription
+        if junctionViews:
+            partition = sigTools.JunctionPartition(vehicleSubscription)
+        else:
+            partition = None
+
         # Add controller models to junctions
         controllerList = []
         # Turn loops off if CAV ratio > 50%
@@ -115,7 +163,9 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
                                     CAMoverride=CAMmod,
                                     model=modelBase,
                                     PER=PER, noise=noise,
-                                    pedStageActive=pedStage)
+                                    pedStageActive=pedStage,
+                                    vectorCAM=vectorCAM, geometry=geometry,
+                                    partition=partition, netIndex=netIndex)
             elif 'CDOTS' in tlLogic:
                 sync = True if 'SynCDOTS' in tlLogic else False
                 ctrl = tlController(junction, 
@@ -125,11 +175,20 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
                                     pedStageActive=pedStage,
                                     activationArray=activationArray,
                                     weightArray=weightArray, sync=sync,
-                                    syncFactor=syncFactor, syncMode=syncMode)
+                                    syncFactor=syncFactor, syncMode=syncMode,
+                                    vectorCAM=vectorCAM, geometry=geometry,
+                                    vectorUtility=vectorUtility,
+                                    partition=partition, netIndex=netIndex)
             else:
                 ctrl = tlController(junction, pedStageActive=pedStage)
             controllerList.append(ctrl)
 
+        # Queue signal changes from all controllers and send once per step
+        if batchCommands:
+            tlsBatch = signalControl.tlsCommandBatch()
+            for c in controllerList:
+                c.setCommandBatch(tlsBatch)
+
         # Couple synced junctions
         if 'SynCDOTS' in tlLogic:
             for c in controllerList:
@@ -140,64 +199,191 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         simTime, simActive = traci.simulation.getCurrentTime(), True
         timeLimit = 1*60*60  # 1 hours in seconds for time limit
         limitExtend = 15*60 # check again in 15 mins if things seem ok
-        stopCounter = sigTools.StopCounter()
-        emissionCounter = sigTools.EmissionCounter()
         stopFilename = exportPath+'stops_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
         emissionFilename = exportPath+'emissions_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
+        # columnar monitors keep their step buffers in numpy arrays
+        if columnarMonitors:
+            vehIndex = netIndex.vehicles if internIDs else None
+            stopCounter = sigTools.ColumnarStopCounter(subscription=vehicleSubscription,
+                                                       vehIndex=vehIndex)
+            emissionCounter = sigTools.ColumnarEmissionCounter(subscription=vehicleSubscription,
+                                                               vehIndex=vehIndex)
+        # finished vehicles spilled next to the outputs so memory only
+        # grows with the vehicles on the network
+        elif spillMonitors:
+            stopCounter = sigTools.StopCounter(subscription=vehicleSubscription,
+                                               spillFile=stopFilename+'.spill')
+            emissionCounter = sigTools.EmissionCounter(subscription=vehicleSubscription,
+                                                       spillFile=emissionFilename+'.spill')
+        else:
+            stopCounter = sigTools.StopCounter(subscription=vehicleSubscription)
+            emissionCounter = sigTools.EmissionCounter(subscription=vehicleSubscription)
         stageFilename = exportPath+'stageinfo_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
-        timeDelta = int(1000*stepSize)
+        # step in ms as SUMO ran it, stepSize must divide one second
+        timeDelta = int(round(1000*sigTools.getStepLength()))
         oneSecond = 1000  # one second in simulation (1 sec in msec)
         oneMinute = 60*oneSecond  # one minute in simulation 60sec in msec
 
+        if binaryDemand:
+            routeXML = demandFiles[0]
+            demandLoader = demandTable.demandLoader(routeXML)
+        else:
+            routeXML = getRouteFile(modelName, seed, CVP, runtimeCVP)
         if routeTracking:
-            routeXML = "/hardmem/ROUTEFILES/{}_R{:03d}_CVP{:03d}.rou.xml".format(modelName, seed, int(CVP*100))
-            routeMonitor = sigTools.RouteMonitor(routeXML)
             routeFile = exportPath+'routes_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
+            routeMonitor = sigTools.RouteMonitor(routeXML,
+                                                 subscription=vehicleSubscription,
+                                                 spillFile=routeFile+'.spill' if spillMonitors else None)
+
+        # trip data recorded live in place of SUMO's tripinfo output
+        if tripRecording:
+            tripRecorder = sigTools.TripRecorder(vehicleSubscription, routeXML,
+                                                 stopCounter=stopCounter,
+                                                 emissionCounter=emissionCounter)
+            tripFilename = exportPath+'tripdata_R{:03d}_CVP{:03d}.npz'.format(seed, int(CVP*100))
+
+        # connected vehicles drawn at departure from the seed's base routes
+        if runtimeCVP:
+            cvpAssigner = sigTools.CVPAssigner(CVP, seed, vehicleSubscription)
+
+        # gridlock judged on simulated time from the shared subscription,
+        # the wall clock check below stays as a backstop
+        if gridlockDetection:
+            gridlockDetector = sigTools.GridlockDetector(vehicleSubscription)
+
+        # Resume from the last checkpoint of this config if there is one,
+        # checkpointInterval in simulation seconds, 0 turns it off
+        checkpointPath = exportPath+'checkpoint_R{:03d}_CVP{:03d}'.format(seed, int(CVP*100))
+        checkpointStep = int(checkpointInterval*oneSecond)
+        if checkpointStep:
+            checkpoint = simCheckpoint.loadCheckpoint(checkpointPath)
+            if checkpoint is not None:
+                simTime, savedState = checkpoint
+                controllerList = savedState['controllers']
+                vehicleSubscription = savedState['vehicleSubscription']
+                stopCounter = savedState['stopCounter']
+                emissionCounter = savedState['emissionCounter']
+                if routeTracking:
+                    routeMonitor = savedState['routeMonitor']
+                if tripRecording:
+                    tripRecorder = savedState['tripRecorder']
+                if runtimeCVP:
+                    cvpAssigner = savedState['cvpAssigner']
+                if binaryDemand:
+                    demandLoader = savedState['demandLoader']
+                if gridlockDetection:
+                    gridlockDetector = savedState['gridlockDetector']
+                if batchCommands:
+                    tlsBatch = savedState['tlsBatch']
+                if junctionViews:
+                    partition = savedState['partition']
+                print('RESUMED: {}, {}, Run: {:03d}, CVP: {:03d}%, simTime: {}'
+                      .format(modelName, tlLogic, run, int(CVP*100), simTime))
+
+        # Only process controllers at their next wakeup time, built after
+        # any resume so it holds the restored controllers
+        if eventScheduling:
+            scheduler = signalControl.controllerScheduler(controllerList)
 
         # Flush print buffer
         sys.stdout.flush()
 
         while simActive:
+            if binaryDemand:
+                demandLoader.load(simTime)
             traci.simulationStep()
             simTime += timeDelta
+            vehicleSubscription.update()
+            if runtimeCVP:
+                cvpAssigner.assign()
+            if junctionViews:
+                partition.update()
             stopCounter.getStops()
             emissionCounter.getEmissions(simTime)
+            if tripRecording:
+                tripRecorder.getTrips(simTime)
 
             if routeTracking and not simTime % oneSecond:
                 routeMonitor.getDistances(simTime)
 
-            for controller in controllerList:
-                if 'CDOTS' in tlLogic:
-                    controller.process(time=simTime, stopCounter=stopCounter, 
-                                       emissionCounter=emissionCounter)
-                else:
-                    controller.process(time=simTime)
+            if gridlockDetection and not simTime % oneSecond:
+                gridlockDetector.update(simTime)
+
+            if eventScheduling and 'CDOTS' in tlLogic:
+                scheduler.process(simTime, stopCounter=stopCounter,
+                                  emissionCounter=emissionCounter)
+            elif eventScheduling:
+                scheduler.process(simTime)
+            else:
+                for controller in controllerList:
+                    if 'CDOTS' in tlLogic:
+                        controller.process(time=simTime, stopCounter=stopCounter, 
+                                           emissionCounter=emissionCounter)
+                    else:
+                        controller.process(time=simTime)
+            if batchCommands:
+                tlsBatch.flush()
+
+            if checkpointStep and not simTime % checkpointStep:
+                savedState = {'controllers': controllerList,
+                              'vehicleSubscription': vehicleSubscription,
+                              'stopCounter': stopCounter,
+                              'emissionCounter': emissionCounter}
+                if routeTracking:
+                    savedState['routeMonitor'] = routeMonitor
+                if tripRecording:
+                    savedState['tripRecorder'] = tripRecorder
+                if runtimeCVP:
+                    savedState['cvpAssigner'] = cvpAssigner
+                if binaryDemand:
+                    savedState['demandLoader'] = demandLoader
+                if gridlockDetection:
+                    savedState['gridlockDetector'] = gridlockDetector
+                if batchCommands:
+                    savedState['tlsBatch'] = tlsBatch
+                if junctionViews:
+                    savedState['partition'] = partition
+                simCheckpoint.saveCheckpoint(checkpointPath, simTime, savedState)
 
             # reduce calls to traci to 1 per simulation min to improve performance
             # flag will always be positive int while there are vehicles no need for else
             if not simTime % oneMinute: 
                 simActive = traci.simulation.getMinExpectedNumber()
+                # vehicles still in the table aren't known to SUMO yet
+                if binaryDemand:
+                    simActive = simActive or demandLoader.hasPending()
+                gridlocked = gridlockDetection and\
+                    gridlockDetector.isGridlocked()
                 # stop sim to free resources if taking longer than ~10 hours
                 # i.e. the sim is gridlocked
-                if timer.runtime() > timeLimit:
+                if gridlocked or timer.runtime() > timeLimit:
                     stopCounter.writeStops(stopFilename)
                     emissionCounter.writeEmissions(emissionFilename)
                     if routeTracking:
                         routeMonitor.writeDistances(routeFile)
-                    if sigTools.isSimGridlocked(modelBase, simTime):
+                    if tripRecording:
+                        tripRecorder.writeTrips(tripFilename)
+                    if gridlocked or sigTools.isSimGridlocked(modelBase, simTime):
                         connector.disconnect()
+                        # a retry would only resume into the same gridlock
+                        if checkpointStep:
+                            simCheckpoint.removeCheckpoint(checkpointPath)
                         raise RuntimeError("RuntimeError: GRIDLOCK")
                     else:
                         timeLimit += limitExtend
 
         # Disconnect from current configuration
         connector.disconnect()
+        if checkpointStep:
+            simCheckpoint.removeCheckpoint(checkpointPath)
 
         # save stops and emissions files
         stopCounter.writeStops(stopFilename)
         emissionCounter.writeEmissions(emissionFilename)
         if routeTracking:
             routeMonitor.writeDistances(routeFile)
+        if tripRecording:
+            tripRecorder.writeTrips(tripFilename)
         if ('VA' in tlLogic) or ('DOTS' in tlLogic):
             with open(stageFilename, 'w') as oFile:
                 oFile.write('junction,stageID,simTime,stageDuration\n')
@@ -208,7 +394,11 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         print('DONE: {}, {}, Run: {:03d}, CVP: {:03d}%, Ped: {} Runtime: {}, Date: {}'
               .format(modelName, tlLogic, run, int(CVP*100), pedStage,
                       timer.strTime(), time.ctime()))
+        if batchCommands:
+            # whole run, tlsBatch is carried through checkpoints
+            print(tlsBatch.strStats())
         sys.stdout.flush()
+        runComplete = True
         return (True, configList)
     except Exception as e:
         # Print if an experiment fails and provide repr of params to repeat run
@@ -223,6 +413,15 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         emissionCounter.writeEmissions(emissionFilename)
         if routeTracking:
             routeMonitor.writeDistances(routeFile)
+        if tripRecording:
+            tripRecorder.writeTrips(tripFilename)
+        # spilled vehicles are kept for a resume until the run completes
+        if spillMonitors and (runComplete or not checkpointStep):
+            for monitor in (stopCounter, emissionCounter):
+                if hasattr(monitor, 'clearSpill'):
+                    monitor.clearSpill()
+            if routeTracking:
+                routeMonitor.clearSpill()
         sys.stdout.flush()
         # remove spawned model folder
         try:
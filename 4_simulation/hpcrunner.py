@@ -4,6 +4,7 @@ import os
 import shutil
 import time
 import numpy as np
+from functools import partial
 import multiprocessing as mp
 from itertools import product
 from glob import glob
@@ -11,9 +12,10 @@ from hpcSimulation import simulation
 sys.path.insert(0, '../1_sumoAPI')
 sys.path.insert(0, '../3_signalControllers')
 import signalTools as sigTools
+import simCheckpoint
 from socket import gethostname
 import traceback
-import random
+import jobQueue
 
 ###############################################################################
 # MAIN SIMULATION DEFINITION
@@ -36,9 +38,22 @@ syncModes = ['PS','P','Ps']
 #activationArrays = [a for a in activationArrays if not a[-1]]
 PBS_ARRAYID = int(sys.argv[-1])
 nproc = 16
-nsims = 32
-startIndex = PBS_ARRAYID * nsims
-stopIndex = (PBS_ARRAYID + 1) * nsims
+# shared job queue, every array task adds the same configs and then claims
+# work from it until it is empty
+queueFile = os.environ.get('JOBQUEUE', '/hardmem/results/jobqueue.db')
+maxAttempts = 3
+# running jobs whose heartbeat (every jobQueue.HEARTBEAT_INTERVAL s) is
+# older than this belong to dead nodes, not long runs
+staleAge = 15*60
+# simulated seconds between checkpoints, a requeued run resumes from its
+# last one. Needs SUMO >= 1.0.0, 0 turns it off
+checkpointInterval = int(os.environ.get('CHECKPOINT_INTERVAL', 1800))
+if checkpointInterval:
+    try:
+        simCheckpoint.checkSupport()
+    except RuntimeError as e:
+        print('Checkpointing off: {}'.format(e))
+        checkpointInterval = 0
 
 configs = []
 # TRANSYT configurations
@@ -52,50 +67,40 @@ configs = []
 # configs += list(product(['sellyOak_avg'], tlControllers[1:], CAVratios, runIDs, pedStage))
 configs += list(product(models, ['SynCDOTS', 'SynCDOTSslow'], CAVratios, runIDs, 
                        pedStage, activationArrays[-1:], syncFactors, syncModes[:1]))
-# sort configurations to process most intensive case first
-# configs.sort(key=lambda x: x[3], reverse=False)
-# randomise configs so that long running jobs aren't bunched
-random.seed(1)
-random.shuffle(configs)
-
-if stopIndex >= len(configs):
-    if startIndex >= len(configs):
-        print("PBS_ARRAYID indexes beyond #configs")
-        sys.exit()
-    configs = configs[startIndex:]
-else:
-    configs = configs[startIndex:stopIndex]
-
-for i in range(len(configs)):
-    configs[i] = list(configs[i])
-    configs[i].append(i%nsims)
-
-print('# simulations: '+str(len(configs)))
+# jobs are claimed most expensive first, costs are estimated from the
+# runtimes of completed runs in the queue
+queue = jobQueue.jobQueue(queueFile)
+queue.addJobs(configs)
+queue.requeueStale(staleAge, maxAttempts)
+print('Queue status: {}'.format(queue.getStatusCounts()))
 print('Starting simulation on {} cores'.format(nproc)+' '+time.ctime())
-# define work pool
-workpool = mp.Pool(processes=nproc)
-# Run simualtions in parallel.
+sys.stdout.flush()
+# one worker per core, each claims the next config as soon as it's free
+workers = [mp.Process(target=jobQueue.runWorker,
+                      args=(queueFile, procID,
+                            partial(simulation,
+                                    checkpointInterval=checkpointInterval),
+                            maxAttempts))
+           for procID in range(nproc)]
 try:
-    result = workpool.map(simulation, configs, chunksize=1)
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 except Exception as e:
     print(e)
     traceback.print_exc()
     sys.stdout.flush()
 finally:
-    # remove spawned model copies
-    # for rmdir in glob('../2_models/*_*'):
-    #     try:
-    #         if os.path.isdir(rmdir):
-    #             shutil.rmtree(rmdir)
-    #     except:
-    #         pass
     timer.stop()
     # Inform of failed expermiments
-    if all([r[0] for r in result]):
+    statusCounts = queue.getStatusCounts()
+    if not statusCounts.get('failed'):
         print('Simulations complete, no errors, exectime: '+timer.strTime())
     else:
         print('Simulations aborted, exectime: '+timer.strTime())
         print('Failed Experiment Runs:')
-        for r in result:
-            if not r[0]:
-                print(r[1])
+        for config in queue.getFailed():
+            print(config)
+    print('Queue status: {}'.format(statusCounts))
+    queue.close()
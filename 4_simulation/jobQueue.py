@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+@file    jobQueue.py
+@author  Craig Rafter
+@date    18/10/2026
+
+SQLite backed experiment queue shared by every node of an array job.
+Workers claim the most expensive pending config one at a time, so idle
+cores keep taking work until the queue is empty rather than running a
+fixed slice. Costs are estimated from the runtimes of completed runs with
+the same model, controller and CVP, failed runs are retried. Workers
+heartbeat their running job so jobs of dead nodes can be told apart from
+long runs and put back.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+import traceback
+from socket import gethostname
+
+# relative cost of demand levels before any runtimes have been recorded
+DEMAND_COST = {'lo': 1.0, 'avg': 2.0, 'hi': 4.0}
+# seconds between heartbeats of a running job
+HEARTBEAT_INTERVAL = 60.0
+
+
+def configKey(config):
+    # numpy scalars from linspace etc. aren't json serialisable
+    return json.dumps(list(config), default=lambda x: x.item())
+
+
+def costKey(config):
+    # runs sharing model, controller and CVP take similar times
+    modelName, tlLogic, CVP = config[:3]
+    return '{}|{}|{:.2f}'.format(modelName, tlLogic, float(CVP))
+
+
+class jobQueue(object):
+    def __init__(self, dbFile, timeout=600.0):
+        self.dbFile = dbFile
+        # isolation_level None so transactions are only those we begin
+        self.db = sqlite3.connect(dbFile, timeout=timeout,
+                                  isolation_level=None)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                               id INTEGER PRIMARY KEY,
+                               config TEXT UNIQUE,
+                               costKey TEXT,
+                               cost REAL,
+                               status TEXT DEFAULT 'pending',
+                               attempts INTEGER DEFAULT 0,
+                               worker TEXT,
+                               started REAL,
+                               heartbeat REAL,
+                               runtime REAL)''')
+        try:
+            # queues made before heartbeats were added
+            self.db.execute('ALTER TABLE jobs ADD COLUMN heartbeat REAL')
+        except sqlite3.OperationalError:
+            pass
+        self.db.execute('''CREATE TABLE IF NOT EXISTS runtimes (
+                               costKey TEXT,
+                               runtime REAL)''')
+
+    def close(self):
+        self.db.close()
+
+    def estimateCost(self, config):
+        row = self.db.execute('SELECT AVG(runtime) FROM runtimes '
+                              'WHERE costKey = ?', (costKey(config),)).fetchone()
+        if row[0] is not None:
+            return row[0]
+        demand = config[0].split('_')[-1]
+        # higher CVP means more CAM processing per step
+        return DEMAND_COST.get(demand, 1.0) * (1.0 + float(config[2]))
+
+    def addJobs(self, configs):
+        # idempotent, every array task can add the same configs
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            for config in configs:
+                self.db.execute('INSERT OR IGNORE INTO jobs '
+                                '(config, costKey, cost) VALUES (?, ?, ?)',
+                                (configKey(config), costKey(config),
+                                 self.estimateCost(config)))
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker):
+        # atomically take the most expensive pending job
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute("SELECT id, config FROM jobs "
+                                  "WHERE status = 'pending' "
+                                  "ORDER BY cost DESC, id LIMIT 1").fetchone()
+            if row is not None:
+                now = time.time()
+                self.db.execute("UPDATE jobs SET status = 'running', "
+                                "worker = ?, started = ?, heartbeat = ?, "
+                                "attempts = attempts + 1 WHERE id = ?",
+                                (worker, now, now, row[0]))
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def beat(self, jobID, worker):
+        # heartbeat of a running job, only while worker still holds it
+        self.db.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? "
+                        "AND worker = ? AND status = 'running'",
+                        (time.time(), jobID, worker))
+
+    def complete(self, jobID, success, maxAttempts=3, worker=None):
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            key, started, attempts, owner, current = self.db.execute(
+                'SELECT costKey, started, attempts, worker, status '
+                'FROM jobs WHERE id = ?', (jobID,)).fetchone()
+            if worker is not None and\
+               (owner != worker or current != 'running'):
+                # requeued as stale and since claimed by another worker
+                self.db.execute('COMMIT')
+                return
+            runtime = time.time() - started
+            if success:
+                status = 'done'
+                self.db.execute('INSERT INTO runtimes VALUES (?, ?)',
+                                (key, runtime))
+            else:
+                status = 'pending' if attempts < maxAttempts else 'failed'
+            self.db.execute('UPDATE jobs SET status = ?, runtime = ? '
+                            'WHERE id = ?', (status, runtime, jobID))
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def requeueStale(self, maxAge, maxAttempts=3):
+        # put back jobs left running by a node that died or hit walltime,
+        # i.e. whose heartbeat is older than maxAge seconds. The lost run
+        # counts as an attempt, it was counted when claimed
+        self.db.execute("UPDATE jobs SET status = CASE WHEN attempts < ? "
+                        "THEN 'pending' ELSE 'failed' END "
+                        "WHERE status = 'running' AND "
+                        "COALESCE(heartbeat, started) < ?",
+                        (maxAttempts, time.time() - maxAge))
+
+    def updateCosts(self):
+        # re-estimate pending jobs with the runtimes recorded so far
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('UPDATE jobs SET cost = (SELECT AVG(runtime) '
+                            'FROM runtimes WHERE runtimes.costKey = jobs.costKey) '
+                            "WHERE status = 'pending' AND costKey IN "
+                            '(SELECT costKey FROM runtimes)')
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def getStatusCounts(self):
+        return dict(self.db.execute('SELECT status, COUNT(*) FROM jobs '
+                                    'GROUP BY status').fetchall())
+
+    def getFailed(self):
+        return [json.loads(row[0]) for row in
+                self.db.execute("SELECT config FROM jobs "
+                                "WHERE status = 'failed'").fetchall()]
+
+
+def heartbeat(dbFile, jobID, worker, stop, interval=HEARTBEAT_INTERVAL):
+    # thread body, own connection as sqlite connections are per thread
+    queue = jobQueue(dbFile)
+    try:
+        while not stop.wait(interval):
+            try:
+                queue.beat(jobID, worker)
+            except sqlite3.OperationalError:
+                # locked past the timeout, try again next beat
+                pass
+    finally:
+        queue.close()
+
+
+def runWorker(dbFile, procID, function, maxAttempts=3):
+    # claim and run configs until the queue is empty. procID is appended
+    # to each config as the simulations use it for the port/model copy
+    queue = jobQueue(dbFile)
+    worker = '{}_{}'.format(gethostname(), procID)
+    try:
+        while True:
+            jobID, config = queue.claim(worker)
+            if jobID is None:
+                break
+            stop = threading.Event()
+            beater = threading.Thread(target=heartbeat,
+                                      args=(dbFile, jobID, worker, stop))
+            beater.daemon = True
+            beater.start()
+            try:
+                success = function(config + [procID])[0]
+            except Exception:
+                traceback.print_exc()
+                success = False
+            finally:
+                stop.set()
+                beater.join()
+            queue.complete(jobID, success, maxAttempts, worker)
+            if success:
+                queue.updateCosts()
+    finally:
+        queue.close()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+@file    oncomingBenchmark.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Benchmark the lane indexed oncoming vehicle lookup against the original
+nested lane/vehicle loop on the Selly Oak network with CDOTS controllers.
+
+usage: python oncomingBenchmark.py [model] [CVP] [hours]
+"""
+import sys
+import os
+import shutil
+import time
+sys.path.insert(0, '../1_sumoAPI')
+sys.path.insert(0, '../3_signalControllers')
+import sumoConnect
+import readJunctionData
+import CDOTS
+import traci
+import signalTools as sigTools
+from sumoConfigGen import sumoConfigGen
+import numpy as np
+
+modelName = sys.argv[1] if len(sys.argv) > 1 else 'sellyOak_hi'
+CVP = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+simHours = float(sys.argv[3]) if len(sys.argv) > 3 else 2.0
+seed = 1
+stepSize = 0.1
+simport = 8899
+repeats = 10  # lookups timed per stage per sample
+sampleInterval = 10*1000  # sample every 10 s of simulation time
+
+modelBase = modelName.split('_')[0]
+model = '../2_models/{}_oncomingBench/'.format(modelBase)
+configFile = model + modelBase + '.sumocfg'
+exportPath = './test_results/'
+if not os.path.isdir(model):
+    shutil.copytree('../2_models/{}/'.format(modelBase), model)
+if not os.path.exists(exportPath):
+    os.makedirs(exportPath)
+
+sumoConfigGen(modelName, configFile, exportPath, CVP=CVP,
+              stepSize=stepSize, run=seed, port=simport, seed=seed)
+connector = sumoConnect.sumoConnect(configFile, gui=False, port=simport)
+connector.launchSumoAndConnect()
+
+if 'selly' in model:
+    junctionFile = model + modelBase + '.t15.xml'
+else:
+    junctionFile = model + modelBase + '.jcn.xml'
+junctionsList = readJunctionData.readJunctionData(junctionFile).getJunctionData()
+controllerList = [CDOTS.CDOTS(junction, model=modelBase)
+                  for junction in junctionsList]
+
+vehicleSubscription = sigTools.NetworkSubscription()
+stopCounter = sigTools.StopCounter(subscription=vehicleSubscription)
+emissionCounter = sigTools.EmissionCounter(subscription=vehicleSubscription)
+
+# rows: simTime, numCAVs, nested time, indexed time (seconds per lookup)
+results = []
+mismatches = 0
+simTime = traci.simulation.getCurrentTime()
+endTime = simTime + int(simHours*3600*1000)
+timeDelta = int(1000*stepSize)
+try:
+    while simTime < endTime:
+        traci.simulationStep()
+        simTime += timeDelta
+        vehicleSubscription.update()
+        stopCounter.getStops()
+        emissionCounter.getEmissions(simTime)
+        for controller in controllerList:
+            controller.process(time=simTime, stopCounter=stopCounter,
+                               emissionCounter=emissionCounter)
+
+        if simTime % sampleInterval:
+            continue
+        for controller in controllerList:
+            if not controller.numCAVs:
+                continue
+            stages = range(controller.Nstages)
+            tstart = time.time()
+            for i in range(repeats):
+                nested = [controller.getOncomingVehiclesNested(
+                              stageIndexOverride=s) for s in stages]
+            nestedTime = time.time() - tstart
+            # force the index to be rebuilt so its cost is included
+            controller.laneIndex = sigTools.laneVehicleIndex()
+            tstart = time.time()
+            for i in range(repeats):
+                indexed = [controller.getOncomingVehicles(
+                               stageIndexOverride=s) for s in stages]
+            indexedTime = time.time() - tstart
+            for a, b in zip(nested, indexed):
+                if set(a) != set(b):
+                    mismatches += 1
+            Nlookups = float(repeats*len(stages))
+            results.append([simTime*1e-3, controller.numCAVs,
+                            nestedTime/Nlookups, indexedTime/Nlookups])
+finally:
+    connector.disconnect()
+    shutil.rmtree(model, ignore_errors=True)
+
+results = np.array(results)
+np.savetxt(exportPath + 'oncomingBenchmark_{}_CVP{:03d}.csv'
+           .format(modelName, int(CVP*100)), results, delimiter=',',
+           header='simTime,numCAVs,nested,indexed', comments='')
+if len(results):
+    print('Samples: {}, mismatches: {}'.format(len(results), mismatches))
+    print('Mean CAVs per junction: {:.1f}'.format(results[:, 1].mean()))
+    print('Nested loop:  {:.3e} s per lookup'.format(results[:, 2].mean()))
+    print('Lane index:   {:.3e} s per lookup'.format(results[:, 3].mean()))
+    print('Speed-up:     {:.1f}x'.format(results[:, 2].sum()/results[:, 3].sum()))
@@ -8,6 +8,7 @@ import multiprocessing as mp
 from itertools import product
 from glob import glob
 from optSimulation import optimiser, optimiserPowell, simulation
+from optSimulation import optimiserCMA, makeEvaluationPool
 #from hpcSimulation import simulation
 sys.path.insert(0, '../1_sumoAPI')
 sys.path.insert(0, '../3_signalControllers')
@@ -29,6 +30,10 @@ CAVratios = [0.0, 0.1, 0.5, 1.0]
 runIDs = list(range(1,6))
 activationArrays = list(product(*([[1]]*1+[[0,1]]*6)))
 nproc = 6
+# batch mode: CMA-ES generations simulated across the pool, one config at a
+# time, with every candidate run on the same seeds
+batchMode = False
+batchSeeds = [1, 2, 3]
 
 configs = []
 # modelName, tlLogic, CVP, run, pedStage, (activationArray), procID
@@ -66,14 +71,25 @@ for i in range(len(configs)):
 
 print('# simulations: '+str(len(configs)))
 # define work pool
-nproc = min(nproc, len(configs))
-workpool = mp.Pool(processes=nproc)
+if not batchMode:
+    nproc = min(nproc, len(configs))
+    workpool = mp.Pool(processes=nproc)
+else:
+    workpool = makeEvaluationPool(nproc)
 print('Starting simulation on {} cores'.format(nproc)+' '+time.ctime())
 # Run simualtions in parallel.True
+result1, result2 = [], []
 try:
     #result = workpool.map(simulation, configs, chunksize=1)
-    result1 = workpool.map(optimiser, configs, chunksize=1)
-    result2 = workpool.map(optimiserPowell, configs, chunksize=1)
+    if batchMode:
+        # population fills the pool with every candidate on every seed
+        popsize = max(nproc//len(batchSeeds), 4)
+        for config in configs:
+            result1.append(optimiserCMA(config, workpool, seeds=batchSeeds,
+                                        popsize=popsize))
+    else:
+        result1 = workpool.map(optimiser, configs, chunksize=1)
+        result2 = workpool.map(optimiserPowell, configs, chunksize=1)
 except Exception as e:
     print(e)
     traceback.print_exc()
@@ -90,6 +106,6 @@ finally:
     # Inform of failed expermiments
     print('Simulations complete, exectime: '+timer.strTime())
     for i, r in enumerate(result1):
-        print('Simplex', configs[i], r)
+        print('CMA' if batchMode else 'Simplex', configs[i], r)
     for i, r in enumerate(result2):
         print('Powell', configs[i], r)
@@ -15,8 +15,10 @@ import HybridVAControl
 import CDOTS
 import traci
 import signalTools as sigTools
+import simCache
 import traceback
-from scipy.optimize import minimize
+from scipy.optimize import minimize, OptimizeResult
+import multiprocessing as mp
 import numpy as np
 
 
@@ -127,9 +129,11 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float)):
         endTime = 30600*1000  # sumo config handles begin, end is manual
         timeLimit = 1*60*60  # 1 hours in seconds for time limit
         limitExtend = 15*60 # check again in 15 mins if things seem ok
-        piMonitor = sigTools.PIMonitor()
-        #stopCounter = sigTools.StopCounter()
-        emissionCounter = sigTools.EmissionCounter()
+        # one network wide vehicle subscription shared by all the monitors
+        vehicleSubscription = sigTools.NetworkSubscription()
+        piMonitor = sigTools.PIMonitor(subscription=vehicleSubscription)
+        #stopCounter = sigTools.StopCounter(subscription=vehicleSubscription)
+        emissionCounter = sigTools.EmissionCounter(subscription=vehicleSubscription)
         stopFilename = exportPath+'stops_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
         emissionFilename = exportPath+'emissions_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
         timeDelta = int(1000*stepSize)
@@ -141,6 +145,7 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float)):
         while simActive:
             traci.simulationStep()
             simTime += timeDelta
+            vehicleSubscription.update()
             piMonitor.getPIUpdate(simTime)
             #stopCounter.getStops()
             emissionCounter.getEmissions(simTime)
@@ -207,11 +212,16 @@ def unifyPI(delay, stops, delayBase=100.0, stopBase=10.0):
 
 def optimiser(config):
     modelName, tlLogic, CVP, run, pedStage, activationArray, procID = config
-    initDelay, initStops = simulation(config)
+    # evaluations are cached to the weight tolerance, baselines are shared
+    # between optimisers
+    xtol = 0.1
+    initDelay, initStops = simCache.cachedEvaluation(
+        simulation, config, np.ones(7, dtype=float), xtol)
 
     def optFunc(x):
         try:
-            delay, stops = simulation(config, weightArray=x)
+            delay, stops = simCache.cachedEvaluation(simulation, config, x,
+                                                     xtol)
             PI = unifyPI(delay, stops, initDelay, initStops)
             print(config, delay, stops, initDelay, initStops, PI)
             return PI
@@ -221,7 +231,7 @@ def optimiser(config):
 
     AA = np.array(activationArray)
     inits = np.ones_like(AA[AA > 0], dtype=float)
-    opts = {'maxiter': 100, 'xatol': 0.1, 'fatol': 0.01, 'adaptive': True}
+    opts = {'maxiter': 100, 'xatol': xtol, 'fatol': 0.01, 'adaptive': True}
     Xmin = minimize(optFunc, inits, method='Nelder-Mead', tol=0.01, options=opts)
     # opts = {'maxiter': 100, 'xtol': 0.1, 'ftol': 0.01}
     # Xmin = minimize(optFunc, inits, method='Powell', tol=0.01, options=opts)
@@ -230,11 +240,16 @@ def optimiser(config):
 
 def optimiserPowell(config):
     modelName, tlLogic, CVP, run, pedStage, activationArray, procID = config
-    initDelay, initStops = simulation(config)
+    # evaluations are cached to the weight tolerance, baselines are shared
+    # between optimisers
+    xtol = 0.1
+    initDelay, initStops = simCache.cachedEvaluation(
+        simulation, config, np.ones(7, dtype=float), xtol)
 
     def optFunc(x):
         try:
-            delay, stops = simulation(config, weightArray=x)
+            delay, stops = simCache.cachedEvaluation(simulation, config, x,
+                                                     xtol)
             PI = unifyPI(delay, stops, initDelay, initStops)
             print(config, delay, stops, initDelay, initStops, PI)
             return PI
@@ -246,12 +261,129 @@ def optimiserPowell(config):
     inits = np.ones_like(AA[AA > 0], dtype=float)
     #opts = {'maxiter': 100, 'xatol': 0.1, 'fatol': 0.01, 'adaptive': True}
     #Xmin = minimize(optFunc, inits, method='Nelder-Mead', tol=0.01, options=opts)
-    opts = {'maxiter': 100, 'xtol': 0.1, 'ftol': 0.01}
+    opts = {'maxiter': 100, 'xtol': xtol, 'ftol': 0.01}
     Xmin = minimize(optFunc, inits, method='Powell', tol=0.01, options=opts)
     print('Powell', config, Xmin)
     return activationArray, Xmin
 
 
+# procID of each evaluation pool worker, so concurrent simulations use
+# their own port and model copy
+workerProcID = None
+
+
+def initEvaluationWorker(procIDs):
+    global workerProcID
+    workerProcID = procIDs.get()
+
+
+def makeEvaluationPool(nproc, firstProcID=0):
+    procIDs = mp.Queue()
+    for procID in range(firstProcID, firstProcID + nproc):
+        procIDs.put(procID)
+    return mp.Pool(processes=nproc, initializer=initEvaluationWorker,
+                   initargs=(procIDs,))
+
+
+def evaluateWeights(task):
+    # one simulation of a candidate, run in an evaluation pool worker
+    config, weightArray, seed, xtol = task
+    config = list(config)
+    config[3] = seed
+    config[-1] = workerProcID
+    return simCache.cachedEvaluation(simulation, config, weightArray, xtol)
+
+
+def optimiserCMA(config, workpool, seeds=(1,), popsize=None, sigma0=0.3,
+                 maxiter=100, xtol=0.1, ftol=0.01):
+    # CMA-ES over the active weights. A whole generation, every candidate on
+    # every seed, is simulated at once through workpool (makeEvaluationPool).
+    # Candidates share the seeds (common random numbers) and each seed's PI
+    # is relative to the baseline of that seed, so the candidates' mean PI
+    # compare on the same traffic rather than seed noise
+    modelName, tlLogic, CVP, run, pedStage, activationArray, procID = config
+    seeds = list(seeds)
+    AA = np.array(activationArray)
+    N = len(AA[AA > 0])
+    # popsize*len(seeds) a multiple of the pool size keeps it busy
+    if popsize is None:
+        popsize = 4 + int(3*np.log(N))
+    mu = popsize//2
+    weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+    weights /= weights.sum()
+    mueff = 1.0/np.sum(weights**2)
+    # strategy parameters (Hansen, The CMA Evolution Strategy: A Tutorial)
+    cc = (4 + mueff/N)/(N + 4 + 2*mueff/N)
+    cs = (mueff + 2)/(N + mueff + 5)
+    c1 = 2/((N + 1.3)**2 + mueff)
+    cmu = min(1 - c1, 2*(mueff - 2 + 1/mueff)/((N + 2)**2 + mueff))
+    damps = 1 + 2*max(0, np.sqrt((mueff - 1)/(N + 1)) - 1) + cs
+    chiN = np.sqrt(N)*(1 - 1.0/(4*N) + 1.0/(21*N**2))
+
+    baselines = workpool.map(evaluateWeights,
+                             [(config, np.ones(7, dtype=float), seed, xtol)
+                              for seed in seeds], chunksize=1)
+
+    def batchPI(candidates):
+        # weights are repaired to >= 0 before they're simulated
+        tasks = [(config, np.maximum(x, 0.0), seed, xtol)
+                 for x in candidates for seed in seeds]
+        results = workpool.map(evaluateWeights, tasks, chunksize=1)
+        PI = np.zeros(len(candidates))
+        for i, (delay, stops) in enumerate(results):
+            initDelay, initStops = baselines[i % len(seeds)]
+            PI[i//len(seeds)] += unifyPI(delay, stops, initDelay, initStops)
+        return PI/len(seeds)
+
+    mean = np.ones(N)
+    sigma = sigma0
+    C = np.eye(N)
+    pc, ps = np.zeros(N), np.zeros(N)
+    bestX, bestPI = mean.copy(), np.inf
+    nfev, success = 0, False
+    message = 'Maximum number of iterations reached'
+    for nit in range(1, maxiter + 1):
+        C = np.triu(C) + np.triu(C, 1).T
+        D2, B = np.linalg.eigh(C)
+        D = np.sqrt(np.maximum(D2, 1e-20))
+        invsqrtC = np.dot(B/D, B.T)
+        Z = np.random.randn(popsize, N)
+        Y = np.dot(Z*D, B.T)
+        X = mean + sigma*Y
+        PI = batchPI(X)
+        nfev += popsize*len(seeds)
+        order = np.argsort(PI)
+        print('CMA', config, nit, sigma, PI[order[0]], np.maximum(X[order[0]], 0))
+        if PI[order[0]] < bestPI:
+            bestX, bestPI = np.maximum(X[order[0]], 0.0), PI[order[0]]
+
+        oldMean = mean
+        mean = np.dot(weights, X[order[:mu]])
+        step = (mean - oldMean)/sigma
+        ps = (1 - cs)*ps + np.sqrt(cs*(2 - cs)*mueff)*np.dot(invsqrtC, step)
+        hsig = (np.linalg.norm(ps)/np.sqrt(1 - (1 - cs)**(2*nit))/chiN
+                < 1.4 + 2.0/(N + 1))
+        pc = (1 - cc)*pc + hsig*np.sqrt(cc*(2 - cc)*mueff)*step
+        artmp = (X[order[:mu]] - oldMean)/sigma
+        C = ((1 - c1 - cmu)*C
+             + c1*(np.outer(pc, pc) + (1 - hsig)*cc*(2 - cc)*C)
+             + cmu*np.dot(artmp.T*weights, artmp))
+        sigma *= np.exp((cs/damps)*(np.linalg.norm(ps)/chiN - 1))
+
+        if sigma*np.sqrt(D2.max()) < xtol:
+            success, message = True, 'Step size below xtol'
+            break
+        if PI[order[-1]] - PI[order[0]] < ftol:
+            success, message = True, 'Generation PI range below ftol'
+            break
+
+    Xmin = OptimizeResult(x=bestX, fun=bestPI, nit=nit, nfev=nfev,
+                          success=success, message=message,
+                          mean=np.maximum(mean, 0.0), sigma=sigma)
+    print('CMA', config, Xmin)
+    return activationArray, Xmin
+
+
 def test(config):
     a, b = 2, 4
     def of(x):
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+@file    simCache.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Persistent cache of optimiser objective evaluations. Each (delay, stops)
+result is stored in its own JSON file named by the hash of the run's
+config, the weights rounded to the optimiser tolerance and the version of
+the simulation code, so repeated baselines and revisited simplex points
+are read back rather than simulated again. A lock file per entry lets
+processes share the cache, one running a config makes any others asking
+for the same config wait and read its result.
+"""
+import os
+import json
+import hashlib
+from glob import glob
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no locking, concurrent misses both simulate
+
+CACHE_PATH = '/hardmem/results/simCache/'
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# code whose changes invalidate cached results
+CODE_FILES = ['1_sumoAPI/*.py', '3_signalControllers/*.py',
+              '4_simulation/optSimulation.py', '4_simulation/sumoConfigGen.py']
+
+codeVersion = None
+
+
+def getCodeVersion():
+    # hash of the simulation code, computed once per process
+    global codeVersion
+    if codeVersion is None:
+        sha = hashlib.sha1()
+        fileNames = []
+        for pattern in CODE_FILES:
+            fileNames += glob(os.path.join(ROOT_PATH, pattern))
+        for fileName in sorted(fileNames):
+            sha.update(os.path.relpath(fileName, ROOT_PATH).encode('utf-8'))
+            with open(fileName, 'rb') as f:
+                sha.update(f.read())
+        codeVersion = sha.hexdigest()
+    return codeVersion
+
+
+def roundWeights(weightArray, tol):
+    # weights closer than the optimiser tolerance share a result
+    steps = np.round(np.asarray(weightArray, dtype=float)/tol).astype(int)
+    return [int(x) for x in steps]
+
+
+def cacheKey(config, weightArray, tol):
+    # procID is left out, it only picks the port and model copy
+    modelName, tlLogic, CVP, run, pedStage = config[:5]
+    activationArray = config[5] if len(config) == 7 else None
+    key = {'model': modelName, 'controller': tlLogic,
+           'CVP': round(float(CVP), 6), 'seed': int(run),
+           'pedStage': bool(pedStage),
+           'activation': (None if activationArray is None else
+                          [int(x) for x in activationArray]),
+           'weights': roundWeights(weightArray, tol), 'tol': tol,
+           'code': getCodeVersion()}
+    return json.dumps(key, sort_keys=True)
+
+
+def getEntryFile(key, cachePath=CACHE_PATH):
+    return os.path.join(cachePath,
+                        hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+
+def readEntry(entryFile, key):
+    try:
+        with open(entryFile, 'r') as f:
+            entry = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    # guard against hash collisions
+    if entry.get('key') != key:
+        return None
+    return entry['delay'], entry['stops']
+
+
+def writeEntry(entryFile, key, delay, stops):
+    tmpName = '{}.{}.tmp'.format(entryFile, os.getpid())
+    with open(tmpName, 'w') as f:
+        json.dump({'key': key, 'delay': delay, 'stops': stops}, f)
+    os.rename(tmpName, entryFile)
+
+
+def cachedEvaluation(simulation, config, weightArray, tol,
+                     cachePath=CACHE_PATH):
+    # simulation(config, weightArray=...) -> (delay, stops), only finite
+    # results are kept so failed or gridlocked runs are retried
+    key = cacheKey(config, weightArray, tol)
+    entryFile = getEntryFile(key, cachePath)
+    result = readEntry(entryFile, key)
+    if result is not None:
+        return result
+
+    if not os.path.isdir(cachePath):
+        try:
+            os.makedirs(cachePath)
+        except OSError:
+            pass  # made by another process
+    with open(entryFile + '.lock', 'w') as lockFile:
+        if fcntl is not None:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+        try:
+            # another process may have run it while we waited for the lock
+            result = readEntry(entryFile, key)
+            if result is not None:
+                return result
+            delay, stops = simulation(config, weightArray=weightArray)
+            if np.isfinite(delay) and np.isfinite(stops) and\
+               (delay, stops) != (1e6, 1e6):
+                writeEntry(entryFile, key, float(delay), float(stops))
+            return delay, stops
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lockFile, fcntl.LOCK_UN)
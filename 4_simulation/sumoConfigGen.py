@@ -7,6 +7,15 @@ Code to generate a config file for a SUMO model.
 
 """
 
+def getRouteFile(modelname, run, CVP=0, runtimeCVP=False):
+    # runtimeCVP: one route file per seed, connected vehicles are assigned
+    # in the run (signalTools.CVPAssigner) rather than by the route file
+    if runtimeCVP:
+        return '/hardmem/ROUTEFILES/{}_R{:03d}_base.rou.xml'.format(modelname, run)
+    return '/hardmem/ROUTEFILES/{}_R{:03d}_CVP{:03d}.rou.xml'\
+        .format(modelname, run, int(CVP*100))
+
+
 def sumoConfigGen(modelname='simpleT',
                   configFile='./models/simpleT.sumocfg',
                   exportPath='../results/',
@@ -14,15 +23,34 @@ def sumoConfigGen(modelname='simpleT',
                   stepSize=0.1,
                   run=0,
                   port=8813,
-                  seed=23423):
+                  seed=23423,
+                  runtimeCVP=False,
+                  demandFiles=None,
+                  checkpointing=False):
+    # demandFiles: (table, vType file) from demandTable.getDemandFiles, the
+    # config then has no route files and the vehicles are added over TraCI
+    # checkpointing: keep the RNG state in saved states, needs SUMO >= 1.0.0
     routename = modelname
     modelname = modelname.split('_')[0]
+    routeFile = getRouteFile(routename, run, CVP, runtimeCVP)
+    if demandFiles is None:
+        routeInput = '<route-files value="{}"/>'.format(routeFile)
+        additionalFiles = '{}.det.xml'.format(modelname)
+    else:
+        routeInput = '<!--vehicles added by demandLoader from {}-->'\
+            .format(demandFiles[0])
+        additionalFiles = '{}.det.xml,{}'.format(modelname, demandFiles[1])
+    if checkpointing:
+        # RNG state in checkpoints so resumed runs match uninterrupted ones
+        stateOutput = '<save-state.rng value="true"/>'
+    else:
+        stateOutput = '<!--save-state.rng value="true"/-->'
     configData = """<configuration>
     <input>
         <net-file value="{model}.net.xml"/>
-        <route-files value="/hardmem/ROUTEFILES/{route}_R{Nrun:03d}_CVP{cvp:03d}.rou.xml"/>
+        {routeInput}
         <!--<gui-settings-file value="gui-settings.cfg"/>-->
-        <additional-files value="{model}.det.xml"/>
+        <additional-files value="{additionalFiles}"/>
     </input>
     <output>
         <!--<summary-output value="{expPath}summary_R{Nrun:03d}_CVP{cvp:03d}.xml"/>-->
@@ -30,6 +58,7 @@ def sumoConfigGen(modelname='simpleT',
         <!--emission-output value="{expPath}emissions_R{Nrun:03d}_CVP{cvp:03d}.xml"/>-->
         <!--<vehroute-output value="{expPath}vehroute_R{Nrun:03d}_CVP{cvp:03d}.xml"/-->
         <!--queue-output value="{expPath}queuedata_R{Nrun:03d}_CVP{cvp:03d}.xml"/-->
+        {stateOutput}
     </output>
     <time>
         <begin value="0"/>
@@ -55,7 +84,9 @@ def sumoConfigGen(modelname='simpleT',
         <remote-port value="{SUMOport}"/>
     </traci_server>
 """.format(model=modelname,
-           route=routename, 
+           routeInput=routeInput,
+           stateOutput=stateOutput,
+           additionalFiles=additionalFiles,
            expPath=exportPath,
            cvp=int(CVP*100),
            stepSz=stepSize,
@@ -141,8 +141,10 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         simTime, simActive = traci.simulation.getCurrentTime(), True
         timeLimit = 1*60*60  # 1 hours in seconds for time limit
         limitExtend = 15*60 # check again in 15 mins if things seem ok
-        stopCounter = sigTools.StopCounter()
-        emissionCounter = sigTools.EmissionCounter()
+        # one network wide vehicle subscription shared by all the monitors
+        vehicleSubscription = sigTools.NetworkSubscription()
+        stopCounter = sigTools.StopCounter(subscription=vehicleSubscription)
+        emissionCounter = sigTools.EmissionCounter(subscription=vehicleSubscription)
         stopFilename = exportPath+'stops_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
         emissionFilename = exportPath+'emissions_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
         stageFilename = exportPath+'stageinfo_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
@@ -155,7 +157,8 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
 
         if routeTracking:
             routeXML = "/hardmem/ROUTEFILES/{}_R{:03d}_CVP{:03d}.rou.xml".format(modelName, seed, int(CVP*100))
-            routeMonitor = sigTools.RouteMonitor(routeXML)
+            routeMonitor = sigTools.RouteMonitor(routeXML,
+                                                 subscription=vehicleSubscription)
             routeFile = exportPath+'routes_R{:03d}_CVP{:03d}.csv'.format(seed, int(CVP*100))
 
         # Flush print buffer
@@ -164,6 +167,7 @@ def simulation(configList, GUIbool=False, weightArray=np.ones(7, dtype=float),
         while simActive:
             traci.simulationStep()
             simTime += timeDelta
+            vehicleSubscription.update()
             stopCounter.getStops()
             emissionCounter.getEmissions(simTime)
 
@@ -6,6 +6,7 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from matplotlib import rcParams
@@ -99,12 +100,13 @@ for model in models:
         # subset plot data
         label = ctrlMap[controller]
         if 'CDOTS' in controller:
-            file = '{}{}-{}-{}-tripinfo.csv'.format(controller, pedString, model, activationArrays[-1])
+            filters = {'activation': activationArrays[-1]}
             #label += '-' + activationArrays[0]
         else:
-            file = '{}{}-{}-tripinfo.csv'.format(controller, pedString, model)
-        data = pd.read_csv('/hardmem/results/outputCSV/'+file,
-                            engine='c', usecols=selectCols)
+            filters = {}
+        data = resultsLake.readTrips(selectCols, controller=controller,
+                                     model=model, pedStage=pedStage,
+                                     **filters)
         data['stops'] = data['stops']/(data['routeLength']*0.001)    
         # if no data in this set continue
         if data.empty:
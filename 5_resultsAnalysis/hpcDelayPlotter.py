@@ -6,6 +6,7 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from matplotlib import rcParams
@@ -87,9 +88,8 @@ for model in models:
     # iterate controllers
     for controller in controllers:
         # subset plot data
-        file = '{}{}-{}-tripinfo.csv'.format(controller, pedString, model)
-        data = pd.read_csv('/hardmem/results/outputCSV/'+file,
-                            engine='c', usecols=selectCols)
+        data = resultsLake.readTrips(selectCols, controller=controller,
+                                     model=model, pedStage=pedStage)
         data['delay'] = data['delay']/(data['routeLength']*0.001)    
         # if no data in this set continue
         if data.empty:
@@ -6,6 +6,7 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 import sys
 from numpy.matlib import repmat
@@ -19,8 +20,10 @@ pedString = '_ped' if pedStage else ''
 cvps = np.arange(0,101, 10, dtype=int)
 for model in models:
     for controller in controllers:
-        file = '{}{}-{}-tripinfo.csv'.format(controller, pedString, model)
-        data = pd.read_csv('/hardmem/results/outputCSV/'+file, engine='c')
+        data = resultsLake.readTrips(['controller', 'model', 'cvp',
+                                      'routeLength', 'delay', 'stops'],
+                                     controller=controller, model=model,
+                                     pedStage=pedStage)
         data['delay'] = data['delay']/(data['routeLength']*0.001)
         data['stops'] = data['stops']/(data['routeLength']*0.001)
         H0 = data[(data.model == model) &
@@ -6,6 +6,7 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from matplotlib import rcParams
@@ -28,9 +29,8 @@ selectCols = ['controller','model','run','cvp','routeLength','delay', 'stops']
 cvp = np.arange(0,101, 10, dtype=int)
 i = 0
 for model in models:
-    file = 'TRANSYT{}-{}-tripinfo.csv'.format(pedString, model)
-    data = pd.read_csv('/hardmem/results/outputCSV/'+file,
-                            engine='c', usecols=selectCols)
+    data = resultsLake.readTrips(selectCols, controller='TRANSYT',
+                                 model=model, pedStage=pedStage)
     data = data[(data.controller == 'TRANSYT') & (data.model == model)]
     data['delay'] = data['delay']/(data['routeLength']*0.001)
     data['stops'] = data['stops']/(data['routeLength']*0.001)
@@ -39,10 +39,10 @@ for model in models:
     # iterate controllers
     for controller in controllers:
         # subset plot data
-        AA = '-1101000' if 'CDOTS' in controller else ''
-        file = '{}{}-{}-tripinfo.csv'.format(controller, pedString, model+AA)
-        data = pd.read_csv('/hardmem/results/outputCSV/'+file,
-                            engine='c', usecols=selectCols)
+        filters = {'activation': '1101000'} if 'CDOTS' in controller else {}
+        data = resultsLake.readTrips(selectCols, controller=controller,
+                                     model=model, pedStage=pedStage,
+                                     **filters)
         data['delay'] = data['delay']/(data['routeLength']*0.001)
         data['stops'] = data['stops']/(data['routeLength']*0.001)
 
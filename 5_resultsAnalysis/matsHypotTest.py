@@ -6,12 +6,15 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from math import ceil, log10, exp
 from scipy.stats import ttest_ind
 
-data = pd.read_csv('/hardmem/results_test/allTripInfo.csv', engine='c')
+data = resultsLake.readTrips(['controller', 'model', 'cvp', 'routeLength',
+                              'delay', 'stops'],
+                             lakePath='/hardmem/results_test/tripLake/')
 data['delay'] = data['delay']/(data['routeLength']*0.001)
 data['stops'] = data['stops']/(data['routeLength']*0.001)
 #data['PI'] = W*data['delay'] + K*data['stops']
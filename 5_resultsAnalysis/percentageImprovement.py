@@ -1,4 +1,5 @@
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from math import ceil, log10, exp
@@ -8,7 +9,9 @@ def pct(a,b):
     # 100.0-100.0*(a/float(b))
     return 100.0*(1.0 - (a/float(b))
 
-data = pd.read_csv('/hardmem/results_test1/allTripInfo.csv', engine='c')
+data = resultsLake.readTrips(['controller', 'model', 'cvp', 'routeLength',
+                              'delay', 'stops'],
+                             lakePath='/hardmem/results_test1/tripLake/')
 # data = data[data.model == 'sellyOak_avg']
 data['delay'] = data['delay']/(data['routeLength']*0.001)
 data['stops'] = data['stops']/(data['routeLength']*0.001)
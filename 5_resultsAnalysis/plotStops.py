@@ -6,6 +6,7 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from matplotlib import rcParams
@@ -60,7 +61,9 @@ lineStyle = {'GPSVAslow': '^k',
              'GPSVA': '*C2',
              'HVA': 'oC3'}
 
-data = pd.read_csv('/hardmem/results_test/allTripInfo.csv', engine='c')
+data = resultsLake.readTrips(['controller', 'model', 'cvp', 'routeLength',
+                              'delay', 'stops'],
+                             lakePath='/hardmem/results_test/tripLake/')
 W = 1.0  # delay cost per second
 K = 14.0  # cost per stop time to decel + time to accel for car
 #data['delay'] = data['delay']/(data['routeLength']*0.001)
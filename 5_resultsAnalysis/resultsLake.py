@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+@file    resultsLake.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Parquet dataset of parsed trip data, replacing allTripInfo.csv and the
+per controller tripinfo CSVs. Files are partitioned in hive style
+directories, controller=CDOTS/model=sellyOak_hi/pedStage=False/cvp=50/,
+with string columns dictionary encoded. readTrips only opens the
+partitions matching its filters and only reads the columns asked for.
+"""
+import os
+from glob import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+LAKE_PATH = '/hardmem/results/tripLake/'
+PARTITION_COLS = ['controller', 'model', 'pedStage', 'cvp']
+# string columns stored as dictionaries, the sync columns mix types
+# between CDOTS and SynCDOTS so are always written as strings
+CATEGORY_COLS = ['origin', 'destination', 'vType',
+                 'activation', 'syncStrength', 'syncMode']
+# columns that separate files within one partition
+NAME_COLS = ['activation', 'syncStrength', 'syncMode', 'run']
+
+
+def parsePartitionValue(col, value):
+    if col == 'pedStage':
+        return value == 'True'
+    if col == 'cvp':
+        return int(value)
+    return value
+
+
+def getPartitionPath(lakePath, values):
+    return os.path.join(lakePath, *['{}={}'.format(col, values[col])
+                                    for col in PARTITION_COLS])
+
+
+def getPartFileName(trips):
+    names = []
+    for col in NAME_COLS:
+        if col in trips:
+            names.append('{}{}'.format('R' if col == 'run' else '',
+                                       '_'.join(str(x) for x in
+                                                sorted(trips[col].unique()))))
+    return '-'.join(names) + '.parquet'
+
+
+def writeTrips(trips, lakePath=LAKE_PATH):
+    # write parsed trips, one file per partition. Reparsing a run replaces
+    # its file rather than adding to it
+    fileNames = []
+    for values, group in trips.groupby(PARTITION_COLS, sort=False):
+        path = getPartitionPath(lakePath, dict(zip(PARTITION_COLS, values)))
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                pass  # made by another process
+        group = group.drop(PARTITION_COLS, axis=1)
+        for col in CATEGORY_COLS:
+            if col in group:
+                group[col] = group[col].astype(str).astype('category')
+        table = pa.Table.from_pandas(group, preserve_index=False)
+        # same dictionary index type in every file so they concatenate
+        table = table.cast(pa.schema([
+            pa.field(field.name, pa.dictionary(pa.int32(), pa.string()))
+            if pa.types.is_dictionary(field.type) else field
+            for field in table.schema]))
+        fileName = os.path.join(path, getPartFileName(group))
+        tmpName = '{}.{}.tmp'.format(fileName, os.getpid())
+        pq.write_table(table, tmpName, use_dictionary=True,
+                       compression='snappy')
+        os.rename(tmpName, fileName)
+        fileNames.append(fileName)
+    return fileNames
+
+
+def writeTripFrames(frames, lakePath=LAKE_PATH):
+    # write parsed files as the pool yields them
+    for trips in frames:
+        writeTrips(trips, lakePath)
+
+
+def listPartitions(lakePath=LAKE_PATH, partFilters={}):
+    # (path, values) of the partitions matching partFilters, a single
+    # value is put in the glob so other directories aren't listed
+    pattern = []
+    for col in PARTITION_COLS:
+        values = partFilters.get(col)
+        if values is not None and len(values) == 1:
+            pattern.append('{}={}'.format(col, list(values)[0]))
+        else:
+            pattern.append('{}=*'.format(col))
+    partitions = []
+    for path in sorted(glob(os.path.join(lakePath, *pattern))):
+        parts = path.rstrip(os.sep).split(os.sep)[-len(PARTITION_COLS):]
+        values = {}
+        for col, part in zip(PARTITION_COLS, parts):
+            values[col] = parsePartitionValue(col, part.split('=', 1)[1])
+        if all(values[col] in partFilters[col] for col in partFilters):
+            partitions.append((path, values))
+    return partitions
+
+
+def readTrips(columns=None, lakePath=LAKE_PATH, **filters):
+    # e.g. readTrips(['cvp', 'delay'], controller='CDOTS', model=models,
+    # activation='1101000'). filters are a value or list of values, those
+    # on partition columns prune the files read, the rest are applied to
+    # each file as it's read
+    partFilters, rowFilters = {}, {}
+    for col, value in filters.items():
+        if isinstance(value, (list, tuple, set, np.ndarray)):
+            values = set(value)
+        else:
+            values = set([value])
+        if col in PARTITION_COLS:
+            partFilters[col] = values
+        else:
+            rowFilters[col] = values
+
+    if columns is None:
+        fileCols = None
+        partCols = PARTITION_COLS
+    else:
+        fileCols = [col for col in columns if col not in PARTITION_COLS]
+        fileCols += [col for col in rowFilters if col not in fileCols]
+        partCols = [col for col in columns if col in PARTITION_COLS]
+
+    tables = []
+    for path, values in listPartitions(lakePath, partFilters):
+        for fileName in sorted(glob(os.path.join(path, '*.parquet'))):
+            fileSchema = pq.read_schema(fileName).names
+            # nothing in a file without the filtered column matches
+            if any(col not in fileSchema for col in rowFilters):
+                continue
+            if fileCols is None:
+                table = pq.read_table(fileName)
+            else:
+                table = pq.read_table(fileName, columns=[
+                    col for col in fileCols if col in fileSchema])
+            for col, allowed in rowFilters.items():
+                colValues = table.column(col).to_pandas()
+                if colValues.dtype.name == 'category':
+                    colValues = colValues.astype(str)
+                    allowed = set(str(x) for x in allowed)
+                mask = colValues.isin(allowed).values
+                if not mask.all():
+                    table = table.filter(pa.array(mask))
+            if not table.num_rows:
+                continue
+            if columns is not None:
+                table = table.select([col for col in columns
+                                      if col in table.column_names])
+            for col in partCols:
+                column = pa.array(np.repeat(values[col], table.num_rows))
+                if col in ('controller', 'model'):
+                    column = column.dictionary_encode()
+                table = table.append_column(col, column)
+            tables.append(table)
+
+    if not tables:
+        return pd.DataFrame(columns=columns if columns is not None else [])
+    # files from the CDOTS parser have the extra activation/sync columns
+    try:
+        data = pa.concat_tables(tables, promote_options='default')
+    except TypeError:
+        data = pa.concat_tables(tables, promote=True)
+    data = data.to_pandas()
+    if columns is not None:
+        data = data[columns]
+    return data
@@ -6,6 +6,7 @@ Created on Tue May  8 13:59:50 2018
 """
 
 import pandas as pd
+import resultsLake
 import numpy as np
 from numpy.matlib import repmat
 from matplotlib import rcParams
@@ -114,18 +115,18 @@ for model in models[1:2]:
         label = ctrlMap[controller]
         if 'SynCDOTS' in controller:
             controller, syncStrength, syncMode = ctrl.split('_')
-            file = '{}{}-{}-{}_{}_{}-tripinfo.csv'.format(controller, pedString,
-                                                          model, activationArrays[3],
-                                                          syncStrength, syncMode)
+            filters = {'activation': activationArrays[3],
+                       'syncStrength': syncStrength, 'syncMode': syncMode}
             label = r'$\alpha={}$'.format(float(syncStrength)/100.0)
             #label += '-' + activationArrays[0]
         elif 'CDOTS' in controller:
-            file = '{}{}-{}-{}-tripinfo.csv'.format(controller, pedString, model, activationArrays[3])
+            filters = {'activation': activationArrays[3]}
             #label += '-' + activationArrays[0]
         else:
-            file = '{}{}-{}-tripinfo.csv'.format(controller, pedString, model)
-        data = pd.read_csv('/hardmem/results/outputCSV/'+file,
-                            engine='c', usecols=selectCols)
+            filters = {}
+        data = resultsLake.readTrips(selectCols, controller=controller,
+                                     model=model, pedStage=pedStage,
+                                     **filters)
         data['delay'] = data['delay']/(data['routeLength']*0.001)    
         # if no data in this set continue
         if data.empty:
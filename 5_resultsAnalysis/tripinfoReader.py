@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+@file    tripinfoReader.py
+@author  Craig Rafter
+@date    18/10/2026
+
+Streaming tripinfo reader shared by the trip parsers. Tripinfo files are
+read in blocks and tokenised a block at a time into typed column chunks,
+freeflow delay and stop counts are then attached with merge joins on
+(vType, model, origin, destination) and vehID rather than a lookup per trip.
+Runs recorded with signalTools.TripRecorder have no tripinfo XML, their npz
+of trip columns already holds stops and emissions and goes through the
+same joins.
+"""
+import os
+import re
+import numpy as np
+import pandas as pd
+
+FREEFLOW_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'freeflows.csv')
+# tripinfo attributes in the order SUMO writes them, departLane and
+# arrivalLane are captured up to the lane index so give the edge directly
+TRIP_REGEX = re.compile(b'<tripinfo id="([^"]*)" depart="([^"]*)" '
+                        b'departLane="([^"_]*)[^"]*"[^>]*? '
+                        b'departDelay="([^"]*)" arrival="([^"]*)" '
+                        b'arrivalLane="([^"_]*)[^"]*"[^>]*? '
+                        b'duration="([^"]*)" routeLength="([^"]*)"[^>]*? '
+                        b'timeLoss="([^"]*)"[^>]*? vType="([^"]*)"')
+TRIP_FIELDS = [('id', str), ('depart', float), ('origin', str),
+               ('departDelay', float), ('arrival', float),
+               ('destination', str), ('duration', float),
+               ('routeLength', float), ('timeLoss', float), ('vType', str)]
+TRIP_COLUMNS = ['controller', 'model', 'run', 'cvp', 'pedStage', 'depart',
+                'origin', 'departDelay', 'arrival', 'destination', 'duration',
+                'routeLength', 'timeLoss', 'vType', 'speedFactor',
+                'journeyTime', 'connected', 'delay', 'stops']
+FREEFLOW_KEYS = ['vType', 'freeflowModel', 'origin', 'destination']
+# per trip totals in TripRecorder files
+EMISSION_COLUMNS = ['CO2', 'CO', 'HC', 'PMX', 'NOX', 'FUEL']
+
+
+def iterTripChunks(fileName, blockSize=1 << 22):
+    # pull the file in blocks and tokenise every complete tripinfo element
+    # in the block at once, yields a DataFrame per block. A partial element
+    # at the end of a block is carried to the next, one left by a run killed
+    # mid write is dropped
+    tail = b''
+    with open(fileName, 'rb') as f:
+        while True:
+            block = f.read(blockSize)
+            if not block:
+                break
+            buf = tail + block
+            cut = buf.rfind(b'>') + 1
+            tail = buf[cut:]
+            rows = TRIP_REGEX.findall(buf, 0, cut)
+            if rows:
+                yield makeChunk(rows)
+
+
+def makeChunk(rows):
+    data = {}
+    for (name, dtype), column in zip(TRIP_FIELDS, zip(*rows)):
+        if dtype is float:
+            data[name] = np.array(column, dtype=float)
+        else:
+            data[name] = np.array(column).astype(str).astype(object)
+    return pd.DataFrame(data)
+
+
+def readTripRecord(fileName):
+    # trip columns written by signalTools.TripRecorder
+    data = {}
+    with np.load(fileName) as record:
+        for name in record.files:
+            column = record[name]
+            if column.dtype.kind in 'SU':
+                column = column.astype(str).astype(object)
+            data[name] = column
+    return pd.DataFrame(data)
+
+
+def readFreeflows(fileName=FREEFLOW_FILE):
+    # key columns kept as strings so they join with the tripinfo edges
+    data = pd.read_csv(fileName, dtype={'type': str, 'model': str,
+                                        'origin': str, 'destination': str})
+    data = data.rename(columns={'type': 'vType', 'model': 'freeflowModel',
+                                'duration': 'freeflowTime'})
+    data = data[FREEFLOW_KEYS + ['freeflowTime']]
+    return data.drop_duplicates(FREEFLOW_KEYS)
+
+
+def getStopFile(fileName):
+    path, fileTxt = os.path.split(fileName)
+    stopFile = re.sub('tripinfo', 'stops', fileTxt)
+    stopFile = re.sub('xml', 'csv', stopFile)
+    return os.path.join(path, stopFile)
+
+
+def readStops(fileName):
+    # stop counts for a tripinfo file, None if there's no usable stops file
+    try:
+        stops = pd.read_csv(getStopFile(fileName),
+                            dtype={'vehID': str, 'stops': int})
+    except Exception:
+        return None
+    return stops[['vehID', 'stops']].drop_duplicates('vehID')
+
+
+def addTripColumns(trips, netModel, freeflows, stops):
+    # derived columns, freeflow delay and stops
+    trips['journeyTime'] = trips['duration'] + trips['departDelay']
+    # only a handful of vTypes, work on those rather than every trip
+    codes, vTypes = pd.factorize(trips['vType'])
+    connected = np.array([int('c_' in x) for x in vTypes], dtype=int)
+    # remove connectivity indicator from vType
+    plainTypes = np.array([x.split('_')[1] if 'c_' in x else x
+                           for x in vTypes], dtype=object)
+    trips['connected'] = connected[codes]
+    trips['vType'] = plainTypes[codes]
+    trips['speedFactor'] = 1.0
+
+    trips['freeflowModel'] = netModel.split('_')[0]
+    trips = trips.merge(freeflows, how='left', on=FREEFLOW_KEYS, sort=False)
+    valid = trips['freeflowTime'].notnull() & (trips['freeflowTime'] > -1.0)
+    trips['delay'] = np.where(valid,
+                              (trips['journeyTime']
+                               - trips['freeflowTime']).abs(), -1)
+
+    if 'stops' in trips:
+        pass  # counted during the run
+    elif stops is None:
+        trips['stops'] = -1
+    else:
+        trips = trips.merge(stops, how='left', left_on='id',
+                            right_on='vehID', sort=False)
+        # vehicles that never stopped aren't in the stops file
+        trips['stops'] = trips['stops'].fillna(0).astype(int)
+    return trips
+
+
+def parseTripFile(fileName, netModel, info, extra=(), freeflows=None,
+                  blockSize=1 << 22):
+    # fileName: tripinfo XML or a TripRecorder npz
+    # info: ordered (column, value) pairs for the run, e.g. controller, run,
+    # put in front of the trip columns, extra pairs go after them
+    if freeflows is None:
+        freeflows = readFreeflows()
+    columns = [col for col, value in info] + TRIP_COLUMNS[5:] +\
+        [col for col, value in extra]
+    if fileName.endswith('.npz'):
+        columns += EMISSION_COLUMNS
+        trips = readTripRecord(fileName)
+        if not len(trips):
+            return pd.DataFrame(columns=columns)
+        trips = addTripColumns(trips, netModel, freeflows, None)
+    else:
+        chunks = list(iterTripChunks(fileName, blockSize))
+        if not chunks:
+            return pd.DataFrame(columns=columns)
+        # joins are done once per file, their overhead is per call
+        trips = addTripColumns(pd.concat(chunks, ignore_index=True),
+                               netModel, freeflows, readStops(fileName))
+    for col, value in list(info) + list(extra):
+        trips[col] = value
+    return trips[columns]
+